@@ -1,5 +1,9 @@
 import numpy as np
+from numba import njit, vectorize
+from scipy.interpolate import CubicSpline
+
 from sbe.utility import conditional_njit
+from sbe.utility import ConversionFactors as co
 
 def make_electric_field(E0, w, alpha, chirp, phase, type_real_np):
     """
@@ -17,3 +21,104 @@ def make_electric_field(E0, w, alpha, chirp, phase, type_real_np):
             * np.sin(2.0*np.pi*w*t*(1 + chirp*t) + phase)
 
     return electric_field
+
+
+def make_electric_field_axis(E0, w, alpha, chirp, phase, type_real_np):
+    """
+    Jitted electric fields of a parameter axis: E0, chirp and phase are
+    arrays with one entry per parameter combination q
+    """
+    @conditional_njit(type_real_np)
+    def electric_field(t, q):
+        '''
+        Returns the instantaneous driving pulse field of combination q
+        '''
+        return E0[q]*np.exp(-t**2/(2*alpha)**2) \
+            * np.sin(2.0*np.pi*w*t*(1 + chirp[q]*t) + phase[q])
+
+    return electric_field
+
+
+@njit
+def interpolate_table(table, u):
+    """
+    4-point Lagrange interpolation in a table on a uniform grid at the
+    (fractional) index u; table entries are returned exactly at the nodes
+    """
+    j = int(np.floor(u))
+    r = u - j
+    if r < 1e-9:
+        return table[min(max(j, 0), table.size - 1)]
+    if r > 1 - 1e-9:
+        return table[min(max(j + 1, 0), table.size - 1)]
+
+    # Extrapolate with the outermost polynomial beyond the table
+    j = min(max(j, 1), table.size - 3)
+    r = u - j
+    return - r*(r - 1)*(r - 2)/6*table[j-1] + (r + 1)*(r - 1)*(r - 2)/2*table[j] \
+        - (r + 1)*r*(r - 2)/2*table[j+1] + (r + 1)*r*(r - 1)/6*table[j+2]
+
+
+def make_tabulated_field(electric_field, t0, dt, Nt):
+    """
+    Tabulates the electric field on the half steps t0 + j*dt/2 of the time
+    grid (all stages of rk4 and lawson) and the vector potential
+    A(t) = -int_t0^t E(t') dt' by cumulative integration of the cubic
+    interpolant (4th order). Between the half steps both are interpolated
+    with 4-point Lagrange polynomials.
+
+    Parameters
+    ----------
+    electric_field : function
+        E(t) in atomic units for an array of times, e.g. make_electric_field,
+        make_sampled_field or any numpy expression; it does not need to be
+        jitted
+    t0, dt, Nt : float, float, int
+        start time, time step and number of time steps of the calculation
+
+    Returns
+    -------
+    electric_field, vector_potential : numba ufuncs
+        E(t) and A(t) from the tables, for scalar or array valued t; the
+        solver reads A(t) from the table instead of integrating A' = -E in
+        the ODE vector
+    """
+    h = dt/2
+    # Two extra points on each side for the interpolation at the edges
+    t_start = t0 - 2*h
+    t = t_start + h*np.arange(2*(Nt - 1) + 5)
+    E_table = np.asarray(electric_field(t), dtype=np.float64)
+
+    # -int E over [t_m, t_m+1] from the cubic through E_m-1, ..., E_m+2
+    dA = -h*(-E_table[:-3] + 13*E_table[1:-2] + 13*E_table[2:-1] - E_table[3:])/24
+    A_table = np.zeros(E_table.size)
+    A_table[1] = -dA[0]
+    A_table[3:-1] = np.cumsum(dA[1:])
+    A_table[0] = A_table[1] + h*(E_table[0] + E_table[1])/2
+    A_table[-1] = A_table[-2] - h*(E_table[-2] + E_table[-1])/2
+
+    @vectorize
+    def electric_field_table(t):
+        return interpolate_table(E_table, (t - t_start)/h)
+
+    @vectorize
+    def vector_potential(t):
+        return interpolate_table(A_table, (t - t_start)/h)
+
+    return electric_field_table, vector_potential
+
+
+def make_sampled_field(t_samples, E_samples):
+    """
+    Electric field of sampled data (measured waveforms, pulse sequences)
+    with times in fs and field strengths in MV/cm. Returns E(t) in atomic
+    units as a cubic spline through the samples, zero outside of them; use
+    it as electric_field_function of sbe_solver together with field_table.
+    """
+    spline = CubicSpline(np.asarray(t_samples)*co.fs_to_au,
+                         np.asarray(E_samples)*co.MVpcm_to_au, extrapolate=False)
+
+    def electric_field(t):
+        return np.nan_to_num(spline(t))
+
+    return electric_field
@@ -24,97 +24,28 @@ def rect_mesh(P, E_dir, type_real_np):
     vec_k_E_dir = length_BZ_E_dir*E_dir
     vec_k_ortho = length_BZ_ortho*np.array([E_dir[1], -E_dir[0]])
 
-    # Containers for the mesh, and BZ directional paths
-    mesh = []
-    paths = []
-
     # Create the kpoint mesh and the paths
-    for beta in beta_array:
-
-        # Container for a single path
-        path = []
-        for alpha in alpha_array:
-            # Create a k-point
-            kpoint = alpha*vec_k_E_dir + beta*vec_k_ortho
-
-            mesh.append(kpoint)
-            path.append(kpoint)
-
-        # Append the a1'th path to the paths array
-        paths.append(path)
+    paths = mp_paths(alpha_array, beta_array, vec_k_E_dir, vec_k_ortho)
 
     dk = length_BZ_E_dir/Nk_E_dir
     kweight = length_BZ_E_dir/Nk_E_dir * length_BZ_ortho/Nk_ortho
 
-    return dk, kweight, np.array(mesh), np.array(paths)
+    return dk, kweight, paths.reshape(-1, 2), paths
 
 def hex_mesh(P):
     '''
-    Create a hexagonal mesh
+    Create a hexagonal mesh: Monkhorst-Pack grid along Gamma-M or Gamma-K,
+    folded into the hexagonal BZ of the reciprocal lattice vectors P.b1, P.b2
     '''
-    def is_in_hex(p):
-        # Returns true if the point is in the hexagonal BZ.
-        # Checks if the absolute values of x and y components of p are within
-        # the first quadrant of the hexagon.
-        x = np.abs(p[0])
-        y = np.abs(p[1])
-        return ((y <= 2.0*np.pi/(np.sqrt(3)*P.a)) and
-                (np.sqrt(3.0)*x + y <= 4*np.pi/(np.sqrt(3)*P.a)))
-
-    def reflect_point(p):
-        x = p[0]
-        y = p[1]
-        if y > 2*np.pi/(np.sqrt(3)*P.a):
-            # Crosses top
-            p -= P.b2
-        elif y < -2*np.pi/(np.sqrt(3)*P.a):
-            # Crosses bottom
-            p += P.b2
-        elif np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*P.a):
-            # Crosses top-right
-            p -= P.b1 + P.b2
-        elif -np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*P.a):
-            # Crosses bot-right
-            p -= P.b1
-        elif np.sqrt(3)*x + y < -4*np.pi/(np.sqrt(3)*P.a):
-            # Crosses bot-left
-            p += P.b1 + P.b2
-        elif -np.sqrt(3)*x + y > 4*np.pi/(np.sqrt(3)*P.a):
-            # Crosses top-left
-            p += P.b1
-        return p
-
-    # Containers for the mesh, and BZ directional paths
-    mesh = []
-    paths = []
-
     # Create the Monkhorst-Pack mesh
     if P.align == 'M':
         if P.Nk2%3 != 0:
             raise RuntimeError("Nk2: " + "{:d}".format(P.Nk2) +
                                " needs to be divisible by 3")
+        b_a1 = P.b1
         b_a2 = (2*np.pi/(3*P.a))*np.array([1, np.sqrt(3)])
         alpha1 = np.linspace(-0.5 + (1/(2*P.Nk1)), 0.5 - (1/(2*P.Nk1)), num=P.Nk1)
         alpha2 = np.linspace(-1.0 + (1.5/(2*P.Nk2)), 0.5 - (1.5/(2*P.Nk2)), num=P.Nk2)
-        for a2 in alpha2:
-            # Container for a single gamma-M path
-            path_M = []
-            for a1 in alpha1:
-                # Create a k-point
-                kpoint = a1*P.b1 + a2*b_a2
-                # If current point is in BZ, append it to the mesh and path_M
-                if is_in_hex(kpoint):
-                    mesh.append(kpoint)
-                    path_M.append(kpoint)
-                # If current point is NOT in BZ, reflect it along
-                # the appropriate axis to get it in the BZ, then append.
-                else:
-                    while not is_in_hex(kpoint):
-                        kpoint = reflect_point(kpoint)
-                    mesh.append(kpoint)
-                    path_M.append(kpoint)
-            # Append the a1'th path to the paths array
-            paths.append(path_M)
 
     elif P.align == 'K':
         if P.Nk1%3 != 0 or P.Nk1%2 != 0:
@@ -129,19 +60,125 @@ def hex_mesh(P):
         # (extending into the 2nd BZ to get correct boundary conditions)
         alpha1 = np.linspace(-0.5 + (1.5/(2*P.Nk1)), 1.0 - (1.5/(2*P.Nk1)), P.Nk1)
         alpha2 = np.linspace(0 + (0.5/(2*P.Nk2)), 0.5 - (0.5/(2*P.Nk2)), P.Nk2)
-        for a2 in alpha2:
-            path_K = []
-            for a1 in alpha1:
-                kpoint = a1*b_a1 + a2*b_a2
-                if is_in_hex(kpoint):
-                    mesh.append(kpoint)
-                    path_K.append(kpoint)
-                else:
-                    while not is_in_hex(kpoint):
-                        kpoint = reflect_point(kpoint)
-                    # kpoint -= (2*np.pi/a) * np.array([1, 1/np.sqrt(3)])
-                    mesh.append(kpoint)
-                    path_K.append(kpoint)
-            paths.append(path_K)
-
-    return np.array(mesh), np.array(paths), (3*np.sqrt(3)/2)*(4*np.pi/(P.a*3))**2
+
+    # Points outside of the BZ are folded back with a reciprocal lattice vector
+    paths = fold_to_bz(mp_paths(alpha1, alpha2, b_a1, b_a2), P.b1, P.b2)
+
+    return paths.reshape(-1, 2), paths, (3*np.sqrt(3)/2)*(4*np.pi/(P.a*3))**2
+
+
+def lattice_mesh(P):
+    '''
+    Create a mesh for the reciprocal lattice vectors P.b1, P.b2 of any 2d
+    lattice (square, rectangular, oblique, hexagonal): Nk2 Monkhorst-Pack
+    paths of Nk1 points along b1, folded into the first BZ (Wigner-Seitz
+    cell). Each path spans one period b1, so it is periodic along the path.
+    '''
+    alpha1 = np.linspace(-0.5 + (1/(2*P.Nk1)), 0.5 - (1/(2*P.Nk1)), num=P.Nk1)
+    alpha2 = np.linspace(-0.5 + (1/(2*P.Nk2)), 0.5 - (1/(2*P.Nk2)), num=P.Nk2)
+
+    paths = fold_to_bz(mp_paths(alpha1, alpha2, P.b1, P.b2), P.b1, P.b2)
+
+    return paths.reshape(-1, 2), paths, np.abs(np.cross(P.b1, P.b2))
+
+
+def mp_paths(alpha1, alpha2, v1, v2):
+    '''
+    Monkhorst-Pack paths k = alpha1*v1 + alpha2*v2 with shape
+    (alpha2.size, alpha1.size, 2), one path per alpha2
+    '''
+    return alpha1[np.newaxis, :, np.newaxis]*v1 + alpha2[:, np.newaxis, np.newaxis]*v2
+
+
+def fold_to_bz(kpoints, b1, b2):
+    '''
+    Folds k-points (array of shape (..., 2)) into the first Brillouin zone
+    (Wigner-Seitz cell) of the reciprocal lattice b1, b2: k - G with the
+    lattice vector G closest to k. Points inside the BZ and on its boundary
+    are not moved.
+    '''
+    c1, c2 = reduced_basis(b1, b2)
+    basis = np.array([c1, c2])
+
+    # Nearest lattice vector in the reduced basis, then the closest one of
+    # it and its 8 neighbours; G = 0 first, so that it wins ties
+    k = kpoints.reshape(-1, 2)
+    n0 = np.round(np.linalg.solve(basis.T, k.T).T)
+    shifts = np.array([[0, 0]] + [[i, j] for i in (-1, 0, 1) for j in (-1, 0, 1)])
+    n = n0[:, np.newaxis, :] + shifts[np.newaxis, :, :]
+    n[:, 0, :] = 0
+    G = n @ basis
+    dist = np.sum((k[:, np.newaxis, :] - G)**2, axis=2)
+    # Rounding errors must not move points on the BZ boundary
+    dist[:, 0] *= 1 - 1e-12
+    G_min = G[np.arange(k.shape[0]), np.argmin(dist, axis=1)]
+
+    return (k - G_min).reshape(kpoints.shape)
+
+
+def reduced_basis(b1, b2):
+    '''
+    Lagrange-Gauss reduced basis (shortest lattice vectors) of the lattice
+    spanned by b1, b2. The Wigner-Seitz cell of a reduced basis is bounded
+    by the lattice vectors n1*c1 + n2*c2 with |n1|, |n2| <= 1.
+    '''
+    c1 = np.array(b1, dtype=np.float64)
+    c2 = np.array(b2, dtype=np.float64)
+    if c1 @ c1 > c2 @ c2:
+        c1, c2 = c2, c1
+    while True:
+        c2 = c2 - np.round((c1 @ c2)/(c1 @ c1))*c1
+        if c2 @ c2 >= c1 @ c1:
+            return c1, c2
+        c1, c2 = c2, c1
+
+
+def mirror_partners(paths, E_dir, b1=None, b2=None, tol=1e-8):
+    '''
+    Mirror images of the paths under the reflection at the axis along E_dir,
+    which keeps the E-field direction. Points are compared modulo the
+    reciprocal lattice b1, b2 (exactly for b1 = b2 = None). Since the mirror
+    keeps the position along E_dir, the image of a path is another path
+    (or itself) with the points in the same cyclic order.
+
+    Returns
+    -------
+    partner : np.ndarray
+        index of the path which is the mirror image of path i, -1 if the
+        image is not part of the mesh
+    shift : np.ndarray
+        the image of point j of path i is point (j + shift[i]) % Nk1 of
+        path partner[i]
+    '''
+    Nk2, Nk1 = paths.shape[:2]
+    mirror = 2*np.outer(E_dir, E_dir)/(E_dir @ E_dir) - np.eye(2)
+
+    def point_keys(kpoints):
+        # Integer keys of the points, fractional coordinates modulo 1
+        if b1 is None:
+            return np.round(kpoints/tol).astype(np.int64)
+        frac = np.linalg.solve(np.array([b1, b2]).T, kpoints.reshape(-1, 2).T).T
+        return (np.round(frac/tol).astype(np.int64) % int(round(1/tol))).reshape(kpoints.shape)
+
+    keys = point_keys(paths)
+    mirror_keys = point_keys(paths @ mirror.T)
+
+    # Paths with the same set of points
+    path_index = {}
+    for i in range(Nk2):
+        path_index.setdefault(tuple(sorted(map(tuple, keys[i]))), i)
+
+    partner = np.full(Nk2, -1)
+    shift = np.zeros(Nk2, dtype=int)
+    for i in range(Nk2):
+        j = path_index.get(tuple(sorted(map(tuple, mirror_keys[i]))), -1)
+        if j < 0:
+            continue
+        # Cyclic shift of the points of the image
+        start = np.flatnonzero(np.all(keys[j] == mirror_keys[i, 0], axis=1))
+        for s in start:
+            if np.array_equal(np.roll(keys[j], -s, axis=0), mirror_keys[i]):
+                partner[i], shift[i] = j, s
+                break
+
+    return partner, shift
@@ -1,5 +1,6 @@
 import numpy as np
-from sbe.utility import conditional_njit
+from numba import prange
+from sbe.utility import conditional_njit, two_sum
 
 
 ##########################################################################################
@@ -39,27 +40,38 @@ def make_polarization_path(dipole, path, E_dir, P):
     pathlen = kx_in_path_before_shift.size
 
     type_complex_np = P.type_complex_np
+    type_accum_complex_np = P.type_accum_complex_np
     gauge = P.gauge
-    @conditional_njit(type_complex_np)
+
+    # The dipoles of the unshifted path (length gauge) are constant in time
+    d_E_dir_path = np.empty(pathlen, dtype=type_accum_complex_np)
+    d_ortho_path = np.empty(pathlen, dtype=type_accum_complex_np)
+    if gauge == 'length':
+        d_01x = np.empty(pathlen, dtype=type_complex_np)
+        d_01y = np.empty(pathlen, dtype=type_complex_np)
+        d_01x[:] = di_01xf(kx=kx_in_path_before_shift, ky=ky_in_path_before_shift)
+        d_01y[:] = di_01yf(kx=kx_in_path_before_shift, ky=ky_in_path_before_shift)
+        d_E_dir_path[:] = d_01x * E_dir[0] + d_01y * E_dir[1]
+        d_ortho_path[:] = d_01x * E_ort[0] + d_01y * E_ort[1]
+
+    @conditional_njit(type_complex_np, P.parallel)
     def polarization_path(rho_cv, A_field):
+        if gauge == 'length':
+            P_E_dir = 2*np.real(np.sum(d_E_dir_path * rho_cv))
+            P_ortho = 2*np.real(np.sum(d_ortho_path * rho_cv))
+            return P_E_dir, P_ortho
+
         ##################################################
         # Dipole container
         ##################################################
         d_01x = np.empty(pathlen, dtype=type_complex_np)
         d_01y = np.empty(pathlen, dtype=type_complex_np)
 
-        d_E_dir = np.empty(pathlen, dtype=type_complex_np)
-        d_ortho = np.empty(pathlen, dtype=type_complex_np)
-
-        if gauge == 'length':
-            kx_shift = 0
-            ky_shift = 0
-        if gauge == 'velocity':
-            kx_shift = A_field*E_dir[0]
-            ky_shift = A_field*E_dir[1]
+        d_E_dir = np.empty(pathlen, dtype=type_accum_complex_np)
+        d_ortho = np.empty(pathlen, dtype=type_accum_complex_np)
 
-        kx_in_path = kx_in_path_before_shift + kx_shift
-        ky_in_path = ky_in_path_before_shift + ky_shift
+        kx_in_path = kx_in_path_before_shift + A_field*E_dir[0]
+        ky_in_path = ky_in_path_before_shift + A_field*E_dir[1]
 
         d_01x[:] = di_01xf(kx=kx_in_path, ky=ky_in_path)
         d_01y[:] = di_01yf(kx=kx_in_path, ky=ky_in_path)
@@ -118,10 +130,39 @@ def make_current_path(sys, path, E_dir, curvature, P):
 
     type_real_np = P.type_real_np
     type_complex_np = P.type_complex_np
+    type_accum_np = P.type_accum_np
     gauge = P.gauge
     save_anom = P.save_anom
-    @conditional_njit(type_complex_np)
+
+    # Band velocities and curvature of the unshifted path (length gauge)
+    # are constant in time
+    e_deriv_path = np.zeros((4, pathlen), dtype=type_accum_np)
+    Bcurv_c_path = np.zeros(pathlen, dtype=type_accum_np)
+    if gauge == 'length':
+        edx_v = edxjit_v(kx=kx_in_path_before_shift, ky=ky_in_path_before_shift)
+        edy_v = edyjit_v(kx=kx_in_path_before_shift, ky=ky_in_path_before_shift)
+        edx_c = edxjit_c(kx=kx_in_path_before_shift, ky=ky_in_path_before_shift)
+        edy_c = edyjit_c(kx=kx_in_path_before_shift, ky=ky_in_path_before_shift)
+        e_deriv_path[0] = edx_v * E_dir[0] + edy_v * E_dir[1]
+        e_deriv_path[1] = edx_v * E_ort[0] + edy_v * E_ort[1]
+        e_deriv_path[2] = edx_c * E_dir[0] + edy_c * E_dir[1]
+        e_deriv_path[3] = edx_c * E_ort[0] + edy_c * E_ort[1]
+        if save_anom:
+            Bcurv_c_path[:] = np.real(Bcurv_11(kx=kx_in_path_before_shift,
+                                               ky=ky_in_path_before_shift))
+
+    @conditional_njit(type_complex_np, P.parallel)
     def current_path(rho_vv, rho_cc, A_field, E_field):
+        if gauge == 'length':
+            J_E_dir = - np.sum(e_deriv_path[0] * rho_vv.real) - \
+                np.sum(e_deriv_path[2] * rho_cc.real)
+            J_ortho = - np.sum(e_deriv_path[1] * rho_vv.real) - \
+                np.sum(e_deriv_path[3] * rho_cc.real)
+            J_anom_ortho = 0.0
+            if save_anom:
+                J_anom_ortho = -E_field * np.sum(Bcurv_c_path * rho_cc.real)
+            return J_E_dir, J_ortho, J_anom_ortho
+
         ##################################################
         # E derivative container
         ##################################################
@@ -130,22 +171,14 @@ def make_current_path(sys, path, E_dir, curvature, P):
         edx_c = np.empty(pathlen, dtype=type_real_np)
         edy_c = np.empty(pathlen, dtype=type_real_np)
 
-        e_deriv_E_dir_v = np.empty(pathlen, dtype=type_real_np)
-        e_deriv_ortho_v = np.empty(pathlen, dtype=type_real_np)
-        e_deriv_E_dir_c = np.empty(pathlen, dtype=type_real_np)
-        e_deriv_ortho_c = np.empty(pathlen, dtype=type_real_np)
+        e_deriv_E_dir_v = np.empty(pathlen, dtype=type_accum_np)
+        e_deriv_ortho_v = np.empty(pathlen, dtype=type_accum_np)
+        e_deriv_E_dir_c = np.empty(pathlen, dtype=type_accum_np)
+        e_deriv_ortho_c = np.empty(pathlen, dtype=type_accum_np)
 
-        if gauge == 'length':
-            kx_shift = 0
-            ky_shift = 0
-            rho_vv_subs = 0
-        if gauge == 'velocity':
-            kx_shift = A_field*E_dir[0]
-            ky_shift = A_field*E_dir[1]
-            rho_vv_subs = 1
-
-        kx_in_path = kx_in_path_before_shift + kx_shift
-        ky_in_path = ky_in_path_before_shift + ky_shift
+        kx_in_path = kx_in_path_before_shift + A_field*E_dir[0]
+        ky_in_path = ky_in_path_before_shift + A_field*E_dir[1]
+        rho_vv_subs = 1
 
         edx_v[:] = edxjit_v(kx=kx_in_path, ky=ky_in_path)
         edy_v[:] = edyjit_v(kx=kx_in_path, ky=ky_in_path)
@@ -241,7 +274,8 @@ def make_emission_exact_path_velocity(sys, path, E_dir, curvature, P):
     type_complex_np = P.type_complex_np
     symmetric_insulator = P.symmetric_insulator
     do_semicl = P.do_semicl
-    @conditional_njit(type_complex_np)
+    parallel = P.parallel
+    @conditional_njit(type_complex_np, parallel)
     def emission_exact_path_velocity(solution, E_field, A_field):
         '''
         Calculates current from the system density matrix
@@ -323,6 +357,26 @@ def make_emission_exact_path_velocity(sys, path, E_dir, curvature, P):
         if symmetric_insulator:
             rho_vv = -rho_cc + 1
 
+        if parallel:
+            # prange over k: one update of each sum per k-point
+            for i_k in prange(pathlen):
+                U_h_H_U_E_dir = U_h[i_k] @ (h_deriv_E_dir[i_k] @ U[i_k])
+                U_h_H_U_ortho = U_h[i_k] @ (h_deriv_ortho[i_k] @ U[i_k])
+
+                I_E_dir += - U_h_H_U_E_dir[0, 0].real * (rho_vv[i_k].real - 1) \
+                           - U_h_H_U_E_dir[1, 1].real * rho_cc[i_k].real \
+                           - 2*np.real(U_h_H_U_E_dir[0, 1] * rho_cv[i_k])
+                I_ortho += - U_h_H_U_ortho[0, 0].real * (rho_vv[i_k].real - 1) \
+                           - U_h_H_U_ortho[1, 1].real * rho_cc[i_k].real \
+                           - 2*np.real(U_h_H_U_ortho[0, 1] * rho_cv[i_k])
+            if do_semicl:
+                I_semicl = 0.0
+                for i_k in prange(pathlen):
+                    I_semicl += -E_field * Bcurv[i_k, 0].real * rho_vv[i_k].real \
+                                - E_field * Bcurv[i_k, 1].real * rho_cc[i_k].real
+                I_ortho += I_semicl
+            return I_E_dir, I_ortho
+
         for i_k in range(pathlen):
 
             dH_U_E_dir = h_deriv_E_dir[i_k] @ U[i_k]
@@ -426,9 +480,25 @@ def make_emission_exact_path_length(sys, path, E_dir, curvature, P):
         Bcurv[:, 0] = curvature.Bfjit[0][0](kx=kx_in_path, ky=ky_in_path)
         Bcurv[:, 1] = curvature.Bfjit[1][1](kx=kx_in_path, ky=ky_in_path)
 
+    ##########################################################
+    # Band basis matrix elements U^+ dH/dk U, constant in time
+    ##########################################################
+    U_h_H_U_E_dir = U_h @ (h_deriv_E_dir @ U)
+    U_h_H_U_ortho = U_h @ (h_deriv_ortho @ U)
+
+    h_vv_E_dir = np.ascontiguousarray(U_h_H_U_E_dir[:, 0, 0].real, dtype=P.type_accum_np)
+    h_cc_E_dir = np.ascontiguousarray(U_h_H_U_E_dir[:, 1, 1].real, dtype=P.type_accum_np)
+    h_vc_E_dir = np.ascontiguousarray(U_h_H_U_E_dir[:, 0, 1], dtype=P.type_accum_complex_np)
+
+    h_vv_ortho = np.ascontiguousarray(U_h_H_U_ortho[:, 0, 0].real, dtype=P.type_accum_np)
+    h_cc_ortho = np.ascontiguousarray(U_h_H_U_ortho[:, 1, 1].real, dtype=P.type_accum_np)
+    h_vc_ortho = np.ascontiguousarray(U_h_H_U_ortho[:, 0, 1], dtype=P.type_accum_complex_np)
+
     symmetric_insulator = P.symmetric_insulator
     do_semicl = P.do_semicl
-    @conditional_njit(P.type_complex_np)
+    compensated = P.precision == 'extended'
+    parallel = P.parallel
+    @conditional_njit(P.type_complex_np, parallel)
     def emission_exact_path_length(solution, E_field, _A_field=1):
         '''
         Parameters:
@@ -458,21 +528,49 @@ def make_emission_exact_path_length(sys, path, E_dir, curvature, P):
         if symmetric_insulator:
             rho_vv = -rho_cc
 
-        for i_k in range(pathlen):
-
-            dH_U_E_dir = h_deriv_E_dir[i_k] @ U[i_k]
-            U_h_H_U_E_dir = U_h[i_k] @ dH_U_E_dir
+        if compensated and not do_semicl:
+            # Error free summation over k, the terms of a k-point in double
+            I_E_dir = 0.0
+            I_ortho = 0.0
+            c_E_dir = 0.0
+            c_ortho = 0.0
+            for i_k in range(pathlen):
+                I_E_dir, e = two_sum(I_E_dir, - h_vv_E_dir[i_k] * rho_vv[i_k].real
+                                     - h_cc_E_dir[i_k] * rho_cc[i_k].real
+                                     - 2*np.real(h_vc_E_dir[i_k] * rho_cv[i_k]))
+                c_E_dir += e
+                I_ortho, e = two_sum(I_ortho, - h_vv_ortho[i_k] * rho_vv[i_k].real
+                                     - h_cc_ortho[i_k] * rho_cc[i_k].real
+                                     - 2*np.real(h_vc_ortho[i_k] * rho_cv[i_k]))
+                c_ortho += e
+            return I_E_dir + c_E_dir, I_ortho + c_ortho
+
+        if parallel:
+            # prange over k: one update of each sum per k-point
+            for i_k in prange(pathlen):
+                I_E_dir += - h_vv_E_dir[i_k] * rho_vv[i_k].real \
+                           - h_cc_E_dir[i_k] * rho_cc[i_k].real \
+                           - 2*np.real(h_vc_E_dir[i_k] * rho_cv[i_k])
+                I_ortho += - h_vv_ortho[i_k] * rho_vv[i_k].real \
+                           - h_cc_ortho[i_k] * rho_cc[i_k].real \
+                           - 2*np.real(h_vc_ortho[i_k] * rho_cv[i_k])
+            if do_semicl:
+                I_semicl = 0.0
+                for i_k in prange(pathlen):
+                    I_semicl += -E_field * Bcurv[i_k, 0].real * rho_vv[i_k].real \
+                                - E_field * Bcurv[i_k, 1].real * rho_vc[i_k].real
+                I_ortho += I_semicl
+            return I_E_dir, I_ortho
 
-            dH_U_ortho = h_deriv_ortho[i_k] @ U[i_k]
-            U_h_H_U_ortho = U_h[i_k] @ dH_U_ortho
+        for i_k in range(pathlen):
 
-            I_E_dir += - U_h_H_U_E_dir[0, 0].real * rho_vv[i_k].real
-            I_E_dir += - U_h_H_U_E_dir[1, 1].real * rho_cc[i_k].real
-            I_E_dir += - 2*np.real(U_h_H_U_E_dir[0, 1] * rho_cv[i_k])
+            I_E_dir += - h_vv_E_dir[i_k] * rho_vv[i_k].real
+            I_E_dir += - h_cc_E_dir[i_k] * rho_cc[i_k].real
+            I_E_dir += - 2*np.real(h_vc_E_dir[i_k] * rho_cv[i_k])
 
-            I_ortho += - U_h_H_U_ortho[0, 0].real * rho_vv[i_k].real
-            I_ortho += - U_h_H_U_ortho[1, 1].real * rho_cc[i_k].real
-            I_ortho += - 2*np.real(U_h_H_U_ortho[0, 1] * rho_cv[i_k])
+            I_ortho += - h_vv_ortho[i_k] * rho_vv[i_k].real
+            I_ortho += - h_cc_ortho[i_k] * rho_cc[i_k].real
+            I_ortho += - 2*np.real(h_vc_ortho[i_k] * rho_cv[i_k])
 
             if do_semicl:
                 # '-' because there is q^2 compared to q only at the SBE current
@@ -482,3 +580,197 @@ def make_emission_exact_path_length(sys, path, E_dir, curvature, P):
         return I_E_dir, I_ortho
 
     return emission_exact_path_length
+
+
+##########################################################################################
+## Velocity gauge observables for blocks of time steps (deferred evaluation)
+##########################################################################################
+def shifted_block_path(path, E_dir, A_field):
+    """
+    kx and ky of the path shifted by every A_field of a block of time steps,
+    flattened with time as slow and k as fast index (size Nt_block*pathlen)
+    """
+    kx_in_block = (path[np.newaxis, :, 0] + A_field[:, np.newaxis]*E_dir[0]).flatten()
+    ky_in_block = (path[np.newaxis, :, 1] + A_field[:, np.newaxis]*E_dir[1]).flatten()
+
+    return kx_in_block, ky_in_block
+
+
+def make_emission_exact_block_velocity(sys, path, E_dir, curvature, P):
+    """
+    Construct a function that calculates the emission of a path for a block
+    of time steps at once. Velocity gauge counterpart of
+    make_emission_exact_path_velocity: the matrix elements of all shifted
+    k-points of the block are evaluated in one call per function and
+    reduced with einsum.
+
+    Parameters
+    ----------
+    sys : TwoBandSystem
+        Hamiltonian and related functions
+    path : np.ndarray [type_real_np]
+        kx and ky components of path
+    E_dir : np.ndarray [type_real_np]
+        Direction of the electric field
+    curvature : SymbolicCurvature
+        Curvature is only needed for semiclassical calculation
+
+    Returns
+    -------
+    emission_exact_block_velocity : function
+        Calculates the current of a path for a block of time steps
+    """
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+    pathlen = path.shape[0]
+
+    type_complex_np = P.type_complex_np
+    type_accum_complex_np = P.type_accum_complex_np
+    symmetric_insulator = P.symmetric_insulator
+    do_semicl = P.do_semicl
+
+    def emission_exact_block_velocity(solution, E_field, A_field):
+        '''
+        Parameters:
+        -----------
+        solution : np.ndarray [type_complex_np]
+            solution of the block, idx 0 is t; idx 1 is k; idx 2 is fv, pvc, pcv, fc
+        E_field : np.ndarray [type_real_np]
+            E_field of the time steps of the block
+        A_field : np.ndarray [type_real_np]
+            A_field of the time steps of the block, determines the k-shift
+
+        Returns:
+        --------
+        I_E_dir : np.ndarray [type_real_np]
+            Parallel to electric field component of current
+        I_ortho : np.ndarray [type_real_np]
+            Orthogonal to electric field component of current
+        '''
+        kx_in_block, ky_in_block = shifted_block_path(path, E_dir, A_field)
+        Nk_block = kx_in_block.size
+
+        h_deriv_E_dir = np.empty((Nk_block, 2, 2), dtype=type_accum_complex_np)
+        h_deriv_ortho = np.empty((Nk_block, 2, 2), dtype=type_accum_complex_np)
+        U = np.empty((Nk_block, 2, 2), dtype=type_accum_complex_np)
+        U_h = np.empty((Nk_block, 2, 2), dtype=type_accum_complex_np)
+
+        for i in range(2):
+            for j in range(2):
+                h_deriv_x = sys.hderivfjit[0][i][j](kx=kx_in_block, ky=ky_in_block)
+                h_deriv_y = sys.hderivfjit[1][i][j](kx=kx_in_block, ky=ky_in_block)
+                h_deriv_E_dir[:, i, j] = h_deriv_x*E_dir[0] + h_deriv_y*E_dir[1]
+                h_deriv_ortho[:, i, j] = h_deriv_x*E_ort[0] + h_deriv_y*E_ort[1]
+                U[:, i, j] = sys.Ujit[i][j](kx=kx_in_block, ky=ky_in_block)
+                U_h[:, i, j] = sys.Ujit_h[i][j](kx=kx_in_block, ky=ky_in_block)
+
+        # Band basis matrix elements U^+ dH/dk U, shape (Nt_block, pathlen, 2, 2)
+        U_h_H_U_E_dir = np.einsum('kab,kbc,kcd->kad', U_h, h_deriv_E_dir, U)\
+            .reshape(-1, pathlen, 2, 2)
+        U_h_H_U_ortho = np.einsum('kab,kbc,kcd->kad', U_h, h_deriv_ortho, U)\
+            .reshape(-1, pathlen, 2, 2)
+
+        rho_vv = solution[:, :, 0].real
+        rho_cv = solution[:, :, 2]
+        rho_cc = solution[:, :, 3].real
+
+        if symmetric_insulator:
+            rho_vv = -rho_cc + 1
+
+        I_E_dir = - np.einsum('tk,tk->t', U_h_H_U_E_dir[:, :, 0, 0].real, rho_vv - 1) \
+            - np.einsum('tk,tk->t', U_h_H_U_E_dir[:, :, 1, 1].real, rho_cc) \
+            - 2*np.einsum('tk,tk->t', U_h_H_U_E_dir[:, :, 0, 1], rho_cv).real
+        I_ortho = - np.einsum('tk,tk->t', U_h_H_U_ortho[:, :, 0, 0].real, rho_vv - 1) \
+            - np.einsum('tk,tk->t', U_h_H_U_ortho[:, :, 1, 1].real, rho_cc) \
+            - 2*np.einsum('tk,tk->t', U_h_H_U_ortho[:, :, 0, 1], rho_cv).real
+
+        if do_semicl:
+            # '-' because there is q^2 compared to q only at the SBE current
+            Bcurv_v = np.empty(Nk_block, dtype=type_complex_np)
+            Bcurv_c = np.empty(Nk_block, dtype=type_complex_np)
+            Bcurv_v[:] = curvature.Bfjit[0][0](kx=kx_in_block, ky=ky_in_block)
+            Bcurv_c[:] = curvature.Bfjit[1][1](kx=kx_in_block, ky=ky_in_block)
+            I_ortho += -E_field*np.einsum('tk,tk->t', Bcurv_v.real.reshape(-1, pathlen), rho_vv)
+            I_ortho += -E_field*np.einsum('tk,tk->t', Bcurv_c.real.reshape(-1, pathlen), rho_cc)
+
+        return I_E_dir, I_ortho
+
+    return emission_exact_block_velocity
+
+
+def make_polarization_block_velocity(dipole, path, E_dir, P):
+    """
+    Block of time steps version of make_polarization_path in the velocity gauge
+
+    Returns
+    -------
+    polarization_block_velocity : function
+        (rho_cv, A_field) of the block -> (P_E_dir, P_ortho) per time step
+    """
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+    pathlen = path.shape[0]
+    type_accum_complex_np = P.type_accum_complex_np
+
+    def polarization_block_velocity(rho_cv, A_field):
+        kx_in_block, ky_in_block = shifted_block_path(path, E_dir, A_field)
+
+        d_01x = np.empty(kx_in_block.size, dtype=type_accum_complex_np)
+        d_01y = np.empty(kx_in_block.size, dtype=type_accum_complex_np)
+        d_01x[:] = dipole.Axfjit[0][1](kx=kx_in_block, ky=ky_in_block)
+        d_01y[:] = dipole.Ayfjit[0][1](kx=kx_in_block, ky=ky_in_block)
+
+        d_E_dir = (d_01x*E_dir[0] + d_01y*E_dir[1]).reshape(-1, pathlen)
+        d_ortho = (d_01x*E_ort[0] + d_01y*E_ort[1]).reshape(-1, pathlen)
+
+        P_E_dir = 2*np.einsum('tk,tk->t', d_E_dir, rho_cv).real
+        P_ortho = 2*np.einsum('tk,tk->t', d_ortho, rho_cv).real
+
+        return P_E_dir, P_ortho
+
+    return polarization_block_velocity
+
+
+def make_current_block_velocity(sys, path, E_dir, curvature, P):
+    """
+    Block of time steps version of make_current_path in the velocity gauge
+
+    Returns
+    -------
+    current_block_velocity : function
+        (rho_vv, rho_cc, A_field, E_field) of the block ->
+        (J_E_dir, J_ortho, J_anom_ortho) per time step
+    """
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+    pathlen = path.shape[0]
+    type_accum_np = P.type_accum_np
+    type_complex_np = P.type_complex_np
+    save_anom = P.save_anom
+
+    def current_block_velocity(rho_vv, rho_cc, A_field, E_field):
+        kx_in_block, ky_in_block = shifted_block_path(path, E_dir, A_field)
+
+        # Band velocities in E-field direction and orthogonal to it
+        e_deriv = np.empty((4, kx_in_block.size), dtype=type_accum_np)
+        for i in range(4):
+            e_deriv[i] = sys.ederivfjit[i](kx=kx_in_block, ky=ky_in_block)
+        e_deriv_E_dir_v = (e_deriv[0]*E_dir[0] + e_deriv[1]*E_dir[1]).reshape(-1, pathlen)
+        e_deriv_ortho_v = (e_deriv[0]*E_ort[0] + e_deriv[1]*E_ort[1]).reshape(-1, pathlen)
+        e_deriv_E_dir_c = (e_deriv[2]*E_dir[0] + e_deriv[3]*E_dir[1]).reshape(-1, pathlen)
+        e_deriv_ortho_c = (e_deriv[2]*E_ort[0] + e_deriv[3]*E_ort[1]).reshape(-1, pathlen)
+
+        J_E_dir = - np.einsum('tk,tk->t', e_deriv_E_dir_v, rho_vv.real - 1) \
+            - np.einsum('tk,tk->t', e_deriv_E_dir_c, rho_cc.real)
+        J_ortho = - np.einsum('tk,tk->t', e_deriv_ortho_v, rho_vv.real - 1) \
+            - np.einsum('tk,tk->t', e_deriv_ortho_c, rho_cc.real)
+
+        if save_anom:
+            # Same as current_path: only the conduction band contributes
+            Bcurv_c = np.empty(kx_in_block.size, dtype=type_complex_np)
+            Bcurv_c[:] = curvature.Bfjit[1][1](kx=kx_in_block, ky=ky_in_block)
+            J_anom_ortho = -E_field*np.einsum('tk,tk->t', Bcurv_c.real.reshape(-1, pathlen),
+                                              rho_cc.real)
+        else:
+            J_anom_ortho = np.zeros(A_field.size, dtype=type_accum_np)
+
+        return J_E_dir, J_ortho, J_anom_ortho
+
+    return current_block_velocity
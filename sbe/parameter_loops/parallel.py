@@ -1,5 +1,14 @@
 import os
+import time
+import itertools
+import collections
+import multiprocessing
+import multiprocessing.connection
 from sbe.solver import sbe_solver
+from sbe.utility import parse_params
+
+# Marker file of a completed point of parameter_sweep
+sweep_done_marker = 'sweep_point_done'
 
 
 def mkdir(dirname):
@@ -31,18 +40,135 @@ def chirp_phasesweep(chirplist, phaselist, system, dipole, curvat, params):
         os.chdir('..')
 
 
-def phasesweep_parallel(phaselist, system, dipole, curvat, params):
-    for phase in phaselist:
-        pid = os.fork()
-
-        if pid == 0:
-            params.phase = phase
-            print("Current phase: ", params.phase)
-            dirname_phase = 'phase_{:1.2f}'.format(params.phase)
-            mkdir_chdir(dirname_phase)
-            sbe_solver(system, dipole, params, curvat)
-
-            return 0
+def phasesweep_parallel(phaselist, system, dipole, curvat, params, workers=None):
+    return parameter_sweep({'phase': phaselist}, system, dipole, curvat, params, workers)
+
+
+def parameter_sweep(sweep, system, dipole, curvat, params, workers=None, retries=1):
+    """
+    Runs sbe_solver for all points of the Cartesian product of the parameter
+    lists in sweep on a bounded number of forked worker processes.
+
+    Every point gets its own copy of params (the params class itself is not
+    modified) and its own directory, e.g. chirp_-0.920/phase_0.00/T2_1 for
+    sweep = {'chirp': [...], 'phase': [...], 'T2': [...]}. The points start
+    longest first by their cost Nk*Nt*Nparam, so that no worker is left
+    with a long calculation at the end. Points whose directory already
+    holds the marker sweep_point_done (written by sweep_point after
+    sbe_solver has returned, i.e. after its last output file) are skipped,
+    which makes an interrupted sweep resumable. A worker that crashes or is
+    killed is restarted up to retries times for its point.
+
+    Parameters
+    ----------
+    sweep : dict
+        parameter name -> list of values
+    system, dipole, curvat :
+        as for sbe_solver
+    params : class
+        Parameters from the params.py file
+    workers : int
+        Number of points calculated at the same time. Default: available
+        cores divided by params.workers (processes of a single point)
+    retries : int
+        Number of restarts of a failed point
+
+    Returns
+    -------
+    failed : list of dict
+        Points which failed after all retries
+    """
+    if workers is None:
+        point_workers = getattr(params, 'workers', 1)
+        point_workers = 1 if point_workers == 'auto' else point_workers
+        workers = max(1, len(os.sched_getaffinity(0))//point_workers)
+
+    names = list(sweep.keys())
+    points = [dict(zip(names, values)) for values in itertools.product(*sweep.values())]
+
+    jobs = []
+    skipped = 0
+    for point in points:
+        dirname = os.path.join(*[sweep_dirname(name, value) for name, value in point.items()])
+        if os.path.isfile(os.path.join(dirname, sweep_done_marker)):
+            skipped += 1
+            continue
+        point_params = type('params', (params,), dict(point))
+        P = parse_params(point_params)
+        jobs.append((P.Nk*P.Nt*P.Nparam, point, dirname, point_params))
+    # Longest first
+    jobs.sort(key=lambda job: job[0], reverse=True)
+
+    print("Parameter sweep: {:d} points, {:d} done before, {:d} workers"
+          .format(len(points), skipped, workers))
+
+    ctx = multiprocessing.get_context('fork')
+    pending = collections.deque(jobs)
+    running = {}
+    attempts = collections.Counter()
+    failed = []
+    done_cost = 0
+    busy_time = 0
+    start_time = time.perf_counter()
+
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.popleft()
+            os.makedirs(job[2], exist_ok=True)
+            process = ctx.Process(target=sweep_point, args=(job[2], system, dipole, curvat,
+                                                             job[3]))
+            process.start()
+            running[process.sentinel] = (process, job, time.perf_counter())
+
+        for sentinel in multiprocessing.connection.wait(list(running.keys())):
+            process, job, job_start = running.pop(sentinel)
+            process.join()
+            busy_time += time.perf_counter() - job_start
+            key = job[2]
+            if process.exitcode == 0:
+                done_cost += job[0]
+                continue
+            attempts[key] += 1
+            print("Point {} failed with exit code {} (attempt {:d})"
+                  .format(job[1], process.exitcode, attempts[key]))
+            if attempts[key] <= retries:
+                pending.appendleft(job)
+            else:
+                failed.append(job[1])
+
+    run_time = time.perf_counter() - start_time
+    print("Parameter sweep: {:d} points calculated, {:d} failed in {:.1f} s"
+          .format(len(jobs) - len(failed), len(failed), run_time))
+    if run_time > 0 and len(jobs) > 0:
+        print("Throughput: {:.2f} points/h, {:.3e} k-point time steps/s, "
+              "worker utilization {:.0f} %"
+              .format(3600*(len(jobs) - len(failed))/run_time, done_cost/run_time,
+                      100*busy_time/(workers*run_time)))
+
+    return failed
+
+
+def sweep_point(dirname, system, dipole, curvat, params):
+    """
+    Calculation of a single point of parameter_sweep in its directory, the
+    marker sweep_done_marker is written once all output is complete
+    """
+    os.chdir(dirname)
+    print("Current point: ", dirname)
+    sbe_solver(system, dipole, params, curvat)
+    with open(sweep_done_marker, 'w') as f:
+        f.write("done\n")
+
+
+def sweep_dirname(name, value):
+    """
+    Directory of a parameter value, chirp and phase as in chirp_phasesweep
+    """
+    if name == 'chirp':
+        return 'chirp_{:1.3f}'.format(value)
+    if name == 'phase':
+        return 'phase_{:1.2f}'.format(value)
+    return '{}_{}'.format(name, value)
 
 
 # def parallel_chirp_phasesweep(chirplist, phaselist, system, dipole, params):
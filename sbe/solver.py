@@ -1,14 +1,20 @@
+import os
+import copy
 import time
+import multiprocessing
 import numpy as np
 from numpy.fft import fft, ifft, fftshift, ifftshift, fftfreq
 import matplotlib.pyplot as plt
 from matplotlib.patches import RegularPolygon
 from scipy.integrate import ode
+from numba import njit, prange, set_num_threads, objmode, from_dtype
+from mpi4py import MPI
 
-from sbe.fields import make_electric_field
-from sbe.kpoint_mesh import rect_mesh, hex_mesh
+from sbe.fields import make_electric_field, make_electric_field_axis, make_tabulated_field
+from sbe.kpoint_mesh import rect_mesh, hex_mesh, lattice_mesh, mirror_partners
 from sbe.utility import ConversionFactors as co
-from sbe.utility import conditional_njit, parse_params
+from sbe.utility import conditional_njit, parse_params, set_parameter_combination, \
+    set_time_step, two_sum, MpiHelpers
 from sbe.observables import *
 
 
@@ -34,7 +40,9 @@ def sbe_solver(sys, dipole, params, curvature, electric_field_function=None):
         electric_field_function : function
             Jitted function of a user provided electric field.
             Can only take time as parameter. If is None takes
-            electric field from sbe/solver/fields.py
+            electric field from sbe/solver/fields.py. With
+            params.field_table any function of numpy arrays (e.g.
+            make_sampled_field of sampled data) works
 
         Returns
         -------
@@ -73,11 +81,6 @@ def sbe_solver(sys, dipole, params, curvature, electric_field_function=None):
     # Flag evaluation
     P = parse_params(params)
 
-    # USER OUTPUT
-    ###########################################################################
-    if P.user_out:
-        print_user_info(P)
-
     # INITIALIZATIONS
     ###########################################################################
     # Form the E-field direction
@@ -98,6 +101,41 @@ def sbe_solver(sys, dipole, params, curvature, electric_field_function=None):
                           np.sin(np.radians(P.angle_inc_E_field))])
         dk, kweight, _kpnts, paths = rect_mesh(P, E_dir, P.type_real_np)
         # BZ_plot(_kpnts, a, b1, b2, paths)
+    elif P.BZ_type == 'lattice':
+        _kpnts, paths, area = lattice_mesh(P)
+        kweight = area/P.Nk
+        dk = np.linalg.norm(P.b1)/P.Nk1
+        E_dir = P.b1/np.linalg.norm(P.b1)
+
+    # Time step from the band gap and the stability limit on the mesh
+    if P.dt_auto:
+        set_time_step(P, auto_time_step(sys, dipole, paths, dk, E_dir, P))
+
+    # Only one path of every pair of mirror images is integrated
+    path_weights = None
+    if P.symmetry is not None:
+        path_weights = mirror_path_weights(sys, dipole, curvature, paths, E_dir, P)
+
+    # Progressive Nk2: levels of paths, mirror symmetric if the mesh is
+    levels = None
+    if P.convergence_tol is not None:
+        if P.BZ_type == 'rectangle':
+            partner, _shift = mirror_partners(paths, E_dir)
+        else:
+            partner, _shift = mirror_partners(paths, E_dir, P.b1, P.b2)
+        levels = progressive_levels(P.Nk2, partner[0] if partner[0] >= 0 else P.Nk2 - 1)
+
+    # Threads of the kernels compiled with parallel
+    if P.parallel:
+        set_num_threads(P.threads)
+
+    # MPI ranks share the batches of paths, rank 0 writes the output
+    mpi = MpiHelpers() if P.mpi else None
+
+    # USER OUTPUT
+    ###########################################################################
+    if P.user_out and (mpi is None or mpi.rank == 0):
+        print_user_info(P)
 
     # Initialize electric_field, create fnumba and initialize ode solver
     if electric_field_function is None:
@@ -105,41 +143,145 @@ def sbe_solver(sys, dipole, params, curvature, electric_field_function=None):
     else:
         electric_field = electric_field_function
 
-    fnumba = make_fnumba(sys, dipole, E_dir, P.gamma1, P.gamma2, P.dk_order, electric_field,
-                         P.gauge, P.type_complex_np, P.do_semicl)
+    # Tabulated E(t) and A(t) on the half steps of the time grid
+    vector_potential = None
+    if P.field_table:
+        electric_field, vector_potential = make_tabulated_field(electric_field, P.t0, P.dt, P.Nt)
+
+    # A(t) of the ODE vector, from the table the A-component is not integrated
+    vector_potential_of = make_vector_potential(vector_potential, P.type_complex_np)
+
+    # Parameter axis: the right hand side and the observables get the fields
+    # E(t, q) of all parameter combinations q
+    field_axis = electric_field
+    if P.Nparam > 1:
+        if electric_field_function is not None:
+            raise RuntimeError("Array valued E0, chirp, or phase need the electric field "
+                               "of sbe/fields.py")
+        field_axis = make_electric_field_axis(P.E0_axis, P.w, P.alpha, P.chirp_axis,
+                                              P.phase_axis, P.type_real_np)
+
+    # Velocity gauge: energies and dipoles of the shifted path from tables
+    shift_table = P.gauge == 'velocity' and P.velocity_shift_table
+
+    fnumba = make_fnumba(sys, dipole, E_dir, P.gamma1_axis, P.gamma2_axis, P.dk_order, field_axis,
+                         P.gauge, P.type_complex_np, P.do_semicl, P.Nk1, P.compact_state,
+                         shift_table, P.parallel, vector_potential)
+    if shift_table:
+        shift_range = velocity_shift_range(electric_field, P, vector_potential)
+
+    # Time steps without driving field, propagated analytically
+    field_free = None
+    if P.fast_forward:
+        field_free = field_free_steps(electric_field, P)
+
+    # The compact state (f_v, Re p_vc, Im p_vc, f_c) per k-point is a real vector
+    type_state_np = P.type_real_np if P.compact_state else P.type_complex_np
+
+    # zvode with analytic Jacobian (chord iteration) instead of functional iteration
+    banded_jacobian = P.solver_method in ('bdf', 'adams') and P.solver_jacobian \
+        and P.gauge == 'length'
 
     if P.solver_method in ('bdf', 'adams'):
-        solver = ode(fnumba).set_integrator('zvode', method=P.solver_method, max_step=P.dt)
+        if banded_jacobian:
+            # Exact banded Jacobian: the k-points are stored in interleaved
+            # ring order inside zvode, which makes the periodic stencil banded
+            kpos, band = banded_ring_ordering(P.Nk1, P.dk_order)
+            jnumba = make_jacobian(P.gamma1, P.gamma2, P.dk_order, electric_field,
+                                   P.type_complex_np)
+        elif P.compact_state:
+            solver = ode(fnumba).set_integrator('vode', method=P.solver_method, max_step=P.dt)
+        else:
+            solver = ode(fnumba).set_integrator('zvode', method=P.solver_method, max_step=P.dt)
 
-    t, A_field, E_field, solution, solution_y_vec, I_exact_E_dir, I_exact_ortho, \
-    J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho = solution_container(P)
+    containers = solution_container(P)
+    t, A_field, E_field, I_exact_E_dir, I_exact_ortho, \
+    J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho = containers
 
     # Only define full density matrix solution if save_full is True
-    if P.save_full:
-        solution_full = np.empty((P.Nk1, P.Nk2, P.Nt, 4), dtype=P.type_complex_np)
+    solution_full = None
+    if P.save_full and P.workers > 1:
+        # The workers write their paths directly into shared memory
+        solution_full = shared_array((P.Nk1, P.Nk2, P.Nt, 4), type_state_np)
+    elif P.save_full and P.mpi:
+        # The paths of the other ranks stay zero for the reduction
+        solution_full = np.zeros((P.Nk1, P.Nk2, P.Nt, 4), dtype=type_state_np)
+    elif P.save_full:
+        solution_full = np.empty((P.Nk1, P.Nk2, P.Nt, 4), dtype=type_state_np)
+
+    # Filename tail
+    tail = filename_tail(P)
+
+    # Continue from the checkpoint of an interrupted run
+    checkpoint_name = 'checkpoint_' + tail + '.npz'
+    resume = None
+    if P.resume:
+        resume = read_checkpoint(checkpoint_name, containers, solution_full, P)
+    checkpoint_time = time.perf_counter()
 
     ###########################################################################
     # SOLVING
     ###########################################################################
-    # Iterate through each path in the Brillouin zone
-    for Nk2_idx, path in enumerate(paths):
+    # Iterate through the batches of paths in the Brillouin zone. All paths of
+    # a batch are integrated together in a single ODE vector. With mpi each
+    # rank integrates a contiguous share of the batches, with workers > 1 they
+    # are distributed over forked processes (see worker_batches). With
+    # P.symmetry the currents of the mirror images of the paths are added
+    # after each batch (see mirror_batches).
+    batches = list(enumerate(path_batches(P, path_weights, levels)))
+    if mpi is not None:
+        start, stop = mpi.listrange(len(batches))
+        batches = batches[start:stop]
+    # zvode records t, A_field and E_field in the first batch of the rank
+    first_batch_idx = batches[0][0] if len(batches) > 0 else 0
+
+    batches = mirror_batches(worker_batches(batches, containers, P), path_weights, containers)
+    if P.convergence_tol is not None:
+        batches = progressive_batches(batches, levels, containers, P)
+
+    for batch_idx, Nk2_idxs in batches:
+
+        # Skip the batches completed before the checkpoint, the current
+        # batch continues at time index ti_resume
+        ti_resume = 0
+        if resume is not None:
+            if batch_idx < resume['batch_idx']:
+                continue
+            if batch_idx == resume['batch_idx']:
+                ti_resume = resume['ti']
+
+        # Paths of the batch: shape (Nk2_batch, Nk1, 2)
+        path = paths[Nk2_idxs]
+        Nk_batch = Nk2_idxs.size*P.Nk1
+
+        # All k-points of the batch in a single list; the observables sum
+        # over all paths of the batch at once
+        k_in_batch = path.reshape(Nk_batch, 2)
 
-        # parallelization if requested in runscript
-        if P.Nk2_idx_ext != Nk2_idx and P.Nk2_idx_ext >= 0:
-            continue
         if P.gauge == 'length':
-            emission_exact_path = make_emission_exact_path_length(sys, path, E_dir, curvature, P)
-        if P.gauge == 'velocity':
-            emission_exact_path = make_emission_exact_path_velocity(sys, path, E_dir, curvature, P)
-        if P.save_approx:
-            polarization_path = make_polarization_path(dipole, path, E_dir, P)
-            current_path = make_current_path(sys, path, E_dir, curvature, P)
-
-        print("Path: ", Nk2_idx + 1)
+            emission_exact_path = make_emission_exact_path_length(sys, k_in_batch, E_dir, curvature, P)
+        if P.gauge == 'velocity' and not P.deferred_observables:
+            emission_exact_path = make_emission_exact_path_velocity(sys, k_in_batch, E_dir, curvature, P)
+        polarization_path = None
+        current_path = None
+        if P.deferred_observables:
+            # Only the state is recorded during the time loop, the observables
+            # are evaluated for blocks of P.deferred_block time steps
+            emission_exact_path = None
+            block_observables = make_block_observables(sys, dipole, k_in_batch, E_dir,
+                                                       curvature, P)
+        elif P.save_approx:
+            polarization_path = make_polarization_path(dipole, k_in_batch, E_dir, P)
+            current_path = make_current_path(sys, k_in_batch, E_dir, curvature, P)
+
+        if Nk2_idxs.size == 1:
+            print("Path: ", Nk2_idxs[0] + 1)
+        else:
+            print("Paths: ", Nk2_idxs[0] + 1, "-", Nk2_idxs[-1] + 1)
 
-        # Retrieve the set of k-points for the current path
-        kx_in_path = path[:, 0]
-        ky_in_path = path[:, 1]
+        # Retrieve the set of k-points for the current batch of paths
+        kx_in_path = k_in_batch[:, 0]
+        ky_in_path = k_in_batch[:, 1]
 
         if P.do_semicl:
             zero_arr = np.zeros(np.size(kx_in_path), dtype=P.type_complex_np)
@@ -168,56 +310,182 @@ def sbe_solver(sys, dipole, params, curvature, electric_field_function=None):
         # Initialize the values of of each k point vector
         # (rho_nn(k), rho_nm(k), rho_mn(k), rho_mm(k))
         y0 = initial_condition(ev, ec, P)
-        y0 = np.append(y0, [0.0])
+        # One copy of the batch and one A-field per parameter combination
+        y0 = np.append(np.tile(y0, P.Nparam), np.zeros(P.Nparam)).astype(P.type_complex_np)
+        if P.compact_state:
+            # p_vc = 0 initially, the real parts are the compact state
+            y0 = y0.real.astype(P.type_real_np)
+
+        # With shift tables the right hand side gets the shift grid and the
+        # tables in place of dk and the matrix elements of the path
+        dk_batch = dk
+        if shift_table:
+            dk_batch, ecv_in_path, dipole_in_path, A_in_path = \
+                velocity_shift_table(fnumba.pre_velocity, path, shift_range, P)
+
+        if P.solver_method in ('rk4', 'rk45', 'lawson', 'strang'):
+            # The complete time loop of the batch runs in numba, Python is
+            # only entered for the progress output
+            solution_y_vec = np.copy(y0)
+            y_ref = None
+            if P.precision == 'extended':
+                # Trailing words of the double-double state
+                solution_y_vec = np.concatenate((y0, np.zeros_like(y0)))
+                y_ref = y0
+            accumulate = make_observables_accumulator(field_axis, emission_exact_path,
+                                                      polarization_path, current_path,
+                                                      Nk_batch, P, y_ref, vector_potential)
+            if P.solver_method == 'rk4':
+                integrate = make_rk4_integrator(fnumba.inplace, accumulate, P)
+            elif P.solver_method == 'lawson':
+                integrate = make_lawson_integrator(fnumba.inplace, accumulate, P)
+            elif P.solver_method == 'strang':
+                integrate = make_strang_integrator(accumulate, electric_field, P,
+                                                   vector_potential)
+            else:
+                integrate = make_rk45_integrator(fnumba.inplace, accumulate, P)
+            if P.fast_forward:
+                fast_forward = make_fast_forward(accumulate, electric_field, P)
+
+            # Full solution or ring buffer of the last block of time steps
+            if P.save_full:
+                solution_batch = np.empty((P.Nt, Nk_batch, 4), dtype=type_state_np)
+            elif P.deferred_observables:
+                solution_batch = np.empty((P.deferred_block, Nk_batch, 4), dtype=type_state_np)
+            else:
+                solution_batch = np.empty((0, Nk_batch, 4), dtype=type_state_np)
+
+            # Current time and (trial) step size, accepted and rejected steps
+            step = np.array([P.t0, P.dt], dtype=P.type_accum_np)
+            stats = np.zeros(2, dtype=np.int64)
+
+            if ti_resume > 0:
+                solution_y_vec[:] = resume['y']
+                step[:] = resume['step']
+                stats[:] = resume['stats']
+                if P.save_full:
+                    solution_batch[:] = resume['solution_batch']
+
+            Nt_progress = max(P.Nt//20, 1)
+            Nt_chunk = P.deferred_block if P.deferred_observables else Nt_progress
+            for ti in range(ti_resume, P.Nt, Nt_chunk):
+                if P.user_out and ti % Nt_progress < Nt_chunk:
+                    print('{:5.2f}%'.format((ti/P.Nt)*100))
+                ti_end = min(ti + Nt_chunk, P.Nt)
+                for ti_a, ti_b, free in time_segments(ti, ti_end, field_free):
+                    propagate, ecv_segment = integrate, ecv_in_path
+                    if free:
+                        propagate = fast_forward
+                        if P.gauge == 'velocity':
+                            # Energies of the path shifted by the constant A
+                            A_segment = vector_potential_of(ti_a*P.dt + P.t0, solution_y_vec)
+                            ecv_segment = fnumba.pre_velocity(path, A_segment)[0]
+                    propagate(ti_a, ti_b, solution_y_vec, step, stats, path, dk_batch,
+                              ecv_segment, dipole_in_path, A_in_path, y0, t, A_field, E_field,
+                              I_exact_E_dir, I_exact_ortho, J_E_dir, J_ortho, P_E_dir, P_ortho,
+                              J_anom_ortho, solution_batch)
+                if P.deferred_observables:
+                    block = solution_batch[np.arange(ti, ti_end) % solution_batch.shape[0]]
+                    add_block_observables(ti, ti_end, block, block_observables, E_field,
+                                          A_field, I_exact_E_dir, I_exact_ortho, J_E_dir,
+                                          J_ortho, P_E_dir, P_ortho, J_anom_ortho, P)
+                if P.checkpoint and \
+                        time.perf_counter() - checkpoint_time > P.checkpoint_interval:
+                    write_checkpoint(checkpoint_name, batch_idx, ti_end, solution_y_vec, step,
+                                     stats, containers, solution_batch, solution_full, P)
+                    checkpoint_time = time.perf_counter()
+
+            if P.solver_method == 'rk45' and P.user_out:
+                print("Steps accepted: ", stats[0], " rejected: ", stats[1])
 
-        # Set the initual values and function parameters for the current kpath
-        if P.solver_method in ('bdf', 'adams'):
-            solver.set_initial_value(y0, P.t0)\
-                .set_f_params(path, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+            if P.save_full:
+                solution_full[:, Nk2_idxs, :, :] = \
+                    solution_batch.reshape(P.Nt, Nk2_idxs.size, P.Nk1, 4).transpose(2, 1, 0, 3)
+            if P.checkpoint and time.perf_counter() - checkpoint_time > P.checkpoint_interval:
+                write_checkpoint(checkpoint_name, batch_idx + 1, 0, solution_y_vec, step,
+                                 stats, containers, None, solution_full, P)
+                checkpoint_time = time.perf_counter()
+            continue
+
+        # Container for the solution of the batch
+        solution = np.zeros((Nk_batch, 4), dtype=P.type_complex_np)
+        if P.deferred_observables:
+            solution_block = np.zeros((P.deferred_block, Nk_batch, 4), dtype=type_state_np)
 
-        elif P.solver_method == 'rk4':
-            solution_y_vec[:] = y0
+        # Set the initual values and function parameters for the current kpath
+        # (a resumed batch restarts zvode from the state of the checkpoint)
+        y_start, t_start = y0, P.t0
+        if ti_resume > 0:
+            y_start, t_start = resume['y'], resume['step'][0]
+        if banded_jacobian:
+            fbanded, jbanded = make_banded_system(fnumba, jnumba, kpos, band, Nk2_idxs.size)
+            solver = ode(fbanded, jbanded)\
+                .set_integrator('zvode', method=P.solver_method, max_step=P.dt,
+                                with_jacobian=True, lband=band, uband=band)
+            solver.set_initial_value(y_start[fbanded.state_perm], t_start)\
+                .set_f_params(path, dk, ecv_in_path, dipole_in_path, A_in_path, y0)\
+                .set_jac_params(path, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+        else:
+            solver.set_initial_value(y_start, t_start)\
+                .set_f_params(path, dk_batch, ecv_in_path, dipole_in_path, A_in_path, y0)
 
         # Propagate through time
         # Index of current integration time step
-        ti = 0
+        ti = ti_resume
         solver_successful = True
 
         while solver_successful and ti < P.Nt:
+            # Checkpoint before the observables of ti are added (deferred
+            # observables: at the start of a block)
+            if P.checkpoint and ti % (P.deferred_block if P.deferred_observables else 1) == 0 \
+                    and time.perf_counter() - checkpoint_time > P.checkpoint_interval:
+                y_checkpoint = solver.y[fbanded.state_iperm] if banded_jacobian else solver.y
+                write_checkpoint(checkpoint_name, batch_idx, ti, y_checkpoint,
+                                 np.array([solver.t, P.dt]), np.zeros(2, dtype=np.int64),
+                                 containers, None, solution_full, P)
+                checkpoint_time = time.perf_counter()
+
             # User output of integration progress
             if (ti % (P.Nt//20) == 0 and P.user_out):
                 print('{:5.2f}%'.format((ti/P.Nt)*100))
 
-            if P.solver_method in ('bdf', 'adams'):
-                # Do not append the last element (A_field)
-                solution[:, :] = solver.y[:-1].reshape(P.Nk1, 4)
-
-                # Construct time array only once
-                if Nk2_idx == 0 or P.Nk2_idx_ext > 0:
-                    # Construct time and A_field only in first round
-                    t[ti] = solver.t
-                    A_field[ti] = solver.y[-1].real
-                    E_field[ti] = electric_field(t[ti])
-
-            elif P.solver_method == 'rk4':
-                # Do not append the last element (A_field)
-                solution[:, :] = solution_y_vec[:-1].reshape(P.Nk1, 4)
-
-                # Construct time array only once
-                if Nk2_idx == 0 or P.Nk2_idx_ext > 0:
-                    # Construct time and A_field only in first round
-                    t[ti] = ti*P.dt + P.t0
-                    A_field[ti] = solution_y_vec[-1].real
-                    E_field[ti] = electric_field(t[ti])
+            # Do not append the last element (A_field)
+            if banded_jacobian:
+                solution[:, :] = solver.y[fbanded.state_iperm][:-1].reshape(Nk_batch, 4)
+            elif P.compact_state:
+                expand_compact_state(solver.y[:-1].reshape(Nk_batch, 4), solution)
+            else:
+                solution[:, :] = solver.y[:-1].reshape(Nk_batch, 4)
+
+            # Construct time array only once
+            if batch_idx == first_batch_idx:
+                # Construct time and A_field only in first round
+                t[ti] = solver.t
+                A_field[ti] = vector_potential_of(solver.t, solver.y)
+                E_field[ti] = electric_field(t[ti])
 
             # Only write full density matrix solution if save_full is True
-            if P.save_full:
-                solution_full[:, Nk2_idx, ti, :] = solution
-
-            I_E_dir_buf, I_ortho_buf = emission_exact_path(solution, E_field[ti], A_field[ti])
-            I_exact_E_dir[ti] += I_E_dir_buf
-            I_exact_ortho[ti] += I_ortho_buf
-            if P.save_approx:
+            if P.save_full and P.compact_state:
+                solution_full[:, Nk2_idxs, ti, :] = \
+                    solver.y[:-1].reshape(Nk2_idxs.size, P.Nk1, 4).transpose(1, 0, 2)
+            elif P.save_full:
+                solution_full[:, Nk2_idxs, ti, :] = \
+                    solution.reshape(Nk2_idxs.size, P.Nk1, 4).transpose(1, 0, 2)
+
+            if P.deferred_observables:
+                # Evaluate the observables when the block is full
+                solution_block[ti % P.deferred_block] = solver.y[:-1].reshape(Nk_batch, 4)
+                ti_start = ti - ti % P.deferred_block
+                if ti + 1 - ti_start == P.deferred_block or ti + 1 == P.Nt:
+                    add_block_observables(ti_start, ti + 1, solution_block[:ti + 1 - ti_start],
+                                          block_observables, E_field, A_field, I_exact_E_dir,
+                                          I_exact_ortho, J_E_dir, J_ortho, P_E_dir, P_ortho,
+                                          J_anom_ortho, P)
+            else:
+                I_E_dir_buf, I_ortho_buf = emission_exact_path(solution, E_field[ti], A_field[ti])
+                I_exact_E_dir[ti] += I_E_dir_buf
+                I_exact_ortho[ti] += I_ortho_buf
+            if P.save_approx and not P.deferred_observables:
                 P_E_dir_buf, P_ortho_buf = polarization_path(solution[:, 2], A_field[ti])
                 P_E_dir[ti] += P_E_dir_buf
                 P_ortho[ti] += P_ortho_buf
@@ -226,44 +494,82 @@ def sbe_solver(sys, dipole, params, curvature, electric_field_function=None):
                 J_ortho[ti] += J_ortho_buf
                 J_anom_ortho[ti] += J_anom_ortho_buf
 
-            if P.solver_method in ('bdf', 'adams'):
-                # Integrate one integration time step
-                solver.integrate(solver.t + P.dt)
-                solver_successful = solver.successful()
-            elif P.solver_method == 'rk4':
-                solution_y_vec = rk_integrate(t[ti], solution_y_vec, path, dk, ecv_in_path, \
-                                              dipole_in_path, A_in_path, y0, P.dt, fnumba)
+            # Integrate one integration time step
+            solver.integrate(solver.t + P.dt)
+            solver_successful = solver.successful()
 
             # Increment time counter
             ti += 1
 
-    # End time of solver loop
-    end_time = time.perf_counter()
+        if P.checkpoint and time.perf_counter() - checkpoint_time > P.checkpoint_interval:
+            write_checkpoint(checkpoint_name, batch_idx + 1, 0, solver.y,
+                             np.array([solver.t, P.dt]), np.zeros(2, dtype=np.int64),
+                             containers, None, solution_full, P)
+            checkpoint_time = time.perf_counter()
 
-    # Write solutions
-    # Filename tail
-    tail = 'E_{:.4f}_w_{:.1f}_a_{:.1f}_{}_t0_{:.1f}_dt_{:.6f}_NK1-{}_NK2-{}_T1_{:.1f}_T2_{:.1f}_chirp_{:.3f}_ph_{:.2f}_solver_{:s}'\
-        .format(P.E0_MVpcm, P.w_THz, P.alpha_fs, P.gauge, P.t0_fs, P.dt_fs, P.Nk1, P.Nk2, P.T1_fs, P.T2_fs, P.chirp_THz, P.phase, P.solver_method)
+    # Progressive Nk2: the currents are sums over the converged paths only
+    if P.convergence_tol is not None:
+        kweight *= P.Nk2/P.Nk2_converged
 
-    write_current_emission(tail, kweight, t, I_exact_E_dir, I_exact_ortho,
-                           J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, P)
+    # Currents (and solution_full) of all ranks summed on rank 0
+    if mpi is not None:
+        mpi_reduce(mpi, containers[3:] + (solution_full,))
+        if mpi.rank != 0:
+            return
+
+    # End time of solver loop
+    end_time = time.perf_counter()
 
-    # Save the parameters of the calculation
+    # Write solutions and save the parameters of the calculation, one set of
+    # files per combination of a parameter axis
     run_time = end_time - start_time
-    params_name = 'params_' + tail + '.txt'
-    paramsfile = open(params_name, 'w')
-    paramsfile.write(str(P.__dict__) + "\n\n")
-    paramsfile.write("Runtime: {:.16f} s".format(run_time))
-    paramsfile.close()
+    for q in range(P.Nparam):
+        P_q, tail_q, currents = P, tail, containers[3:]
+        if P.Nparam > 1:
+            P_q = copy.copy(P)
+            set_parameter_combination(P_q, q)
+            tail_q = filename_tail(P_q)
+            currents = [None if c is None else c[q] for c in currents]
+        write_current_emission(tail_q, kweight, t, *currents, P_q)
+
+        params_name = 'params_' + tail_q + '.txt'
+        paramsfile = open(params_name, 'w')
+        paramsfile.write(str(P_q.__dict__) + "\n\n")
+        paramsfile.write("Runtime: {:.16f} s".format(run_time))
+        paramsfile.close()
 
     if P.save_full:
         S_name = 'Sol_' + tail
         np.savez(S_name, t=t, solution_full=solution_full, paths=paths,
                  electric_field=electric_field(t), A_field=A_field)
 
+    # The results are complete, a later run must not resume from the checkpoint
+    if os.path.exists(checkpoint_name):
+        os.remove(checkpoint_name)
+
+
+def make_vector_potential(vector_potential, type_complex_np):
+    """
+        Jitted A(t, y), the vector potential at time t for the ODE vector y:
+        with params.field_table the table vector_potential of
+        make_tabulated_field, otherwise the last component of y, which is
+        integrated as A' = -E (single parameter combination)
+    """
+    if vector_potential is None:
+        @conditional_njit(type_complex_np)
+        def vector_potential_of(t, y):
+            return y[-1].real
+    else:
+        @conditional_njit(type_complex_np)
+        def vector_potential_of(t, y):
+            return vector_potential(t)
+
+    return vector_potential_of
+
 
 def make_fnumba(sys, dipole, E_dir, gamma1, gamma2, dk_order, electric_field, gauge, type_complex_np,
-                do_semicl):
+                do_semicl, Nk1=None, compact=False, shift_table=False, parallel=False,
+                vector_potential=None):
     """
         Initialization of the solver for the sbe ( eq. (39/47/80) in https://arxiv.org/abs/2008.03177)
 
@@ -278,21 +584,45 @@ def make_fnumba(sys, dipole, E_dir, gamma1, gamma2, dk_order, electric_field, ga
             Symbolic expression for the dipole elements (eq. (37/38))
         E_dir : np.ndarray
             2-dimensional array with the x and y component of the electric field
-        gamma1 : float
+        gamma1 : float or np.ndarray
             inverse of occupation damping time (T_1 in (eq. (?))
-        gamma2 : float
-            inverse of polarization damping time (T_2 in eq. (80))
+        gamma2 : float or np.ndarray
+            inverse of polarization damping time (T_2 in eq. (80)), arrays
+            of gamma1 and gamma2 give one value per parameter combination
+            (parameter axis, only flength and fvelocity)
         electric_field : jitted function
-            absolute value of the instantaneous driving field E(t) (eq. (75))
+            absolute value of the instantaneous driving field E(t) (eq. (75)),
+            E(t, q) of combination q for a parameter axis
         gauge: 'length' or 'velocity'
             parameter to determine which gauge is used in the routine
         do_semicl: boolean
             parameter to determine whether a semiclassical calculation will be done
+        Nk1 : int
+            number of k-points per path, only needed for dk_order = 'spectral'
+        compact : boolean
+            right hand side for the compact real state (f_v, Re p_vc, Im p_vc, f_c)
+            per k-point instead of (f_v, p_vc, p_cv, f_c), see expand_compact_state
+        shift_table : boolean
+            velocity gauge: interpolate the energies and dipoles of the shifted
+            path in precomputed tables (see velocity_shift_table). The
+            arguments dk, ecv_in_path, dipole_in_path and A_in_path of f then
+            hold the shift grid and the tables instead.
+        parallel : boolean
+            the loops over k of the in-place kernels run on numba's thread
+            pool (prange)
+        vector_potential : function
+            tabulated A(t) (params.field_table, see make_tabulated_field):
+            the velocity gauge reads A from the table and the last component
+            of the ODE vector is not integrated (its derivative is zero)
 
         Returns
         -------
         f :
             right hand side of ode d/dt(rho(t)) = f(rho, t) (eq. (39/47/80))
+            f.inplace is the jitted kernel writing the right hand side into
+            a preallocated array, f.inplace(t, y, x, kpath, ...)
+            f.pre_velocity(kpath, k_shift) evaluates the energies and dipoles
+            of the shifted path
     """
     ########################################
     # Wire the energies
@@ -313,114 +643,270 @@ def make_fnumba(sys, dipole, E_dir, gamma1, gamma2, dk_order, electric_field, ga
     di_01yf = dipole.Ayfjit[0][1]
     di_11yf = dipole.Ayfjit[1][1]
 
-    @conditional_njit(type_complex_np)
-    def flength(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
+    ########################################
+    # Parameter axis
+    ########################################
+    # Array valued gamma1, gamma2: one copy of the batch per parameter
+    # combination q in the ODE vector, electric_field then takes (t, q)
+    gamma1_axis = np.atleast_1d(gamma1)
+    gamma2_axis = np.atleast_1d(gamma2)
+    Nparam = gamma1_axis.size
+    gamma1 = gamma1_axis[0]
+    gamma2 = gamma2_axis[0]
+    if Nparam == 1:
+        @conditional_njit(type_complex_np)
+        def field_axis(t, q):
+            return electric_field(t)
+    else:
+        field_axis = electric_field
+
+    # A' = -E of the A-component(s) of the ODE vector, a tabulated A is read
+    # with vector_potential_of instead
+    vector_potential_of = make_vector_potential(vector_potential, type_complex_np)
+    A_rate = -1.0 if vector_potential is None else 0.0
+
+    ########################################
+    # Spectral k-derivative
+    ########################################
+    # periodic derivative along the path instead of a stencil, a dense
+    # product for short paths and by FFT (spectral_derivative) otherwise
+    spectral = dk_order == 'spectral'
+    spectral_fft = spectral and Nk1 > spectral_dense_max
+    if spectral:
+        spectral_weights = spectral_derivative_weights(Nk1).astype(type_complex_np)
+        spectral_kappa = spectral_wavenumbers(Nk1)
+        dk_order = 0
+    else:
+        spectral_weights = np.zeros(1, dtype=type_complex_np)
+        spectral_kappa = np.zeros(1)
+
+    # Neighbours k + drift_offsets[s] and weights of the k-derivative in the
+    # kernels of the compact state
+    type_real_np = np.finfo(type_complex_np).dtype
+    # Array types of the FFT derivative returned from object mode, the
+    # kernels of quad precision are not jitted
+    type_complex_nb = type_real_nb = None
+    if type_complex_np is not np.complex256:
+        type_complex_nb = from_dtype(np.dtype(type_complex_np))[:]
+        type_real_nb = from_dtype(np.dtype(type_real_np))[:]
+    if spectral_fft:
+        drift_offsets = np.zeros(0, dtype=np.int64)
+        drift_weights = np.zeros(0, dtype=type_real_np)
+    elif spectral:
+        drift_offsets = np.arange(1, Nk1)
+        drift_weights = spectral_derivative_weights(Nk1)[1:].astype(type_real_np)
+    elif gauge == 'length':
+        stencil = derivative_stencil(dk_order)
+        drift_offsets = np.concatenate((np.arange(1, stencil.size + 1),
+                                        -np.arange(1, stencil.size + 1)))
+        drift_weights = np.concatenate((stencil, -stencil)).astype(type_real_np)
+    else:
+        drift_offsets = np.zeros(0, dtype=np.int64)
+        drift_weights = np.zeros(0, dtype=type_real_np)
+
+    @conditional_njit(type_complex_np, parallel)
+    def flength_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
         """
         Length gauge doesn't need recalculation of energies and dipoles.
         The length gauge is evaluated on a constant pre-defined k-grid.
+        kpath holds a batch of paths with shape (Nk2_batch, Nk1, 2); the
+        k-derivative is periodic in each path of the batch.
+        With a parameter axis, the ODE vector holds Nparam copies of the
+        batch, followed by the Nparam A-fields.
+        The right hand side is written into x.
         """
+        Nk_path = kpath.shape[1]
+        Npath = kpath.shape[0]
+        if spectral_fft:
+            with objmode(dy=type_complex_nb):
+                dy = spectral_derivative(y[:y.size - Nparam], spectral_kappa)
+        else:
+            dy = y[:1]
+        for q in range(Nparam):
+            # Gradient term coefficient and damping of the parameter combination
+            electric_f = field_axis(t, q)
+            D = electric_f/dk
+            g1 = gamma1_axis[q]
+            g2 = gamma2_axis[q]
+
+            # Update the solution vector, the k-points of a path in parallel
+            for p in range(Npath):
+                # Offset of the path in the solution vector
+                o = 4*(q*Npath + p)*Nk_path
+                for k in prange(Nk_path):
+                    i = o + 4*k
+                    right4 = o + 4*(k+4)
+                    right3 = o + 4*(k+3)
+                    right2 = o + 4*(k+2)
+                    right  = o + 4*(k+1)
+                    left   = o + 4*(k-1)
+                    left2  = o + 4*(k-2)
+                    left3  = o + 4*(k-3)
+                    left4  = o + 4*(k-4)
+                    if k == 0:
+                        left   = o + 4*(Nk_path-1)
+                        left2  = o + 4*(Nk_path-2)
+                        left3  = o + 4*(Nk_path-3)
+                        left4  = o + 4*(Nk_path-4)
+                    elif k == 1 and dk_order >= 4:
+                        left2  = o + 4*(Nk_path-1)
+                        left3  = o + 4*(Nk_path-2)
+                        left4  = o + 4*(Nk_path-3)
+                    elif k == 2 and dk_order >= 6:
+                        left3  = o + 4*(Nk_path-1)
+                        left4  = o + 4*(Nk_path-2)
+                    elif k == 3 and dk_order >= 8:
+                        left4  = o + 4*(Nk_path-1)
+                    elif k == Nk_path-1:
+                        right4 = o + 4*3
+                        right3 = o + 4*2
+                        right2 = o + 4*1
+                        right  = o + 4*0
+                    elif k == Nk_path-2 and dk_order >= 4:
+                        right4 = o + 4*2
+                        right3 = o + 4*1
+                        right2 = o + 4*0
+                    elif k == Nk_path-3 and dk_order >= 6:
+                        right4 = o + 4*1
+                        right3 = o + 4*0
+                    elif k == Nk_path-4 and dk_order >= 8:
+                        right4 = o + 4*0
+
+                    # Energy gap e_2(k) - e_1(k) >= 0 at point k
+                    ecv = ecv_in_path[p*Nk_path + k]
+
+                    # Rabi frequency: w_R = q*d_12(k)*E(t)
+                    # Rabi frequency conjugate: w_R_c = q*d_21(k)*E(t)
+                    wr = dipole_in_path[p*Nk_path + k]*electric_f
+                    wr_c = wr.conjugate()
+
+                    # Rabi frequency: w_R = q*(d_11(k) - d_22(k))*E(t)
+                    wr_d_diag = A_in_path[p*Nk_path + k]*electric_f
+
+                    # Update each component of the solution vector
+                    # i = f_v, i+1 = p_vc, i+2 = p_cv, i+3 = f_c
+                    x[i]   = 2*(y[i+1]*wr_c).imag - g1*(y[i]-y0[i])
+
+                    x[i+1] = (1j*ecv - g2 + 1j*wr_d_diag)*y[i+1] - 1j*wr*(y[i]-y[i+3])
+
+                    x[i+3] = -2*(y[i+1]*wr_c).imag - g1*(y[i+3]-y0[i+3])
+
+                    # compute drift term via k-derivative
+                    if dk_order == 2:
+                        x[i]   += D*( y[right]/2   - y[left]/2  )
+                        x[i+1] += D*( y[right+1]/2 - y[left+1]/2 )
+                        x[i+3] += D*( y[right+3]/2 - y[left+3]/2 )
+                    elif dk_order == 4:
+                        x[i]   += D*(- y[right2]/12   + 2/3*y[right]   - 2/3*y[left]   + y[left2]/12 )
+                        x[i+1] += D*(- y[right2+1]/12 + 2/3*y[right+1] - 2/3*y[left+1] + y[left2+1]/12 )
+                        x[i+3] += D*(- y[right2+3]/12 + 2/3*y[right+3] - 2/3*y[left+3] + y[left2+3]/12 )
+                    elif dk_order == 6:
+                        x[i]   += D*(  y[right3]/60   - 3/20*y[right2]   + 3/4*y[right] \
+                                     - y[left3]/60    + 3/20*y[left2]    - 3/4*y[left] )
+                        x[i+1] += D*(  y[right3+1]/60 - 3/20*y[right2+1] + 3/4*y[right+1] \
+                                     - y[left3+1]/60  + 3/20*y[left2+1]  - 3/4*y[left+1] )
+                        x[i+3] += D*(  y[right3+3]/60 - 3/20*y[right2+3] + 3/4*y[right+3] \
+                                     - y[left3+3]/60  + 3/20*y[left2+3]  - 3/4*y[left+3] )
+                    elif dk_order == 8:
+                        x[i]   += D*(- y[right4]/280   + 4/105*y[right3]   - 1/5*y[right2]   + 4/5*y[right] \
+                                     + y[left4] /280   - 4/105*y[left3]    + 1/5*y[left2]    - 4/5*y[left] )
+                        x[i+1] += D*(- y[right4+1]/280 + 4/105*y[right3+1] - 1/5*y[right2+1] + 4/5*y[right+1] \
+                                     + y[left4+1] /280 - 4/105*y[left3+1]  + 1/5*y[left2+1]  - 4/5*y[left+1] )
+                        x[i+3] += D*(- y[right4+3]/280 + 4/105*y[right3+3] - 1/5*y[right2+3] + 4/5*y[right+3] \
+                                     + y[left4+3] /280 - 4/105*y[left3+3]  + 1/5*y[left2+3]  - 4/5*y[left+3] )
+                    elif spectral_fft:
+                        x[i]   += D*dy[i]
+                        x[i+1] += D*dy[i+1]
+                        x[i+3] += D*dy[i+3]
+                    elif spectral:
+                        for m in range(1, Nk_path):
+                            right = o + 4*((k + m) % Nk_path)
+                            x[i]   += D*spectral_weights[m]*y[right]
+                            x[i+1] += D*spectral_weights[m]*y[right+1]
+                            x[i+3] += D*spectral_weights[m]*y[right+3]
+
+                    x[i+2] = x[i+1].conjugate()
+
+            x[x.size - Nparam + q] = A_rate*electric_f
+
+    @conditional_njit(type_complex_np)
+    def flength(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
         # x != y(t+dt)
         x = np.empty(np.shape(y), dtype=type_complex_np)
+        flength_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+        return x
 
-        # Gradient term coefficient
+    @conditional_njit(type_complex_np)
+    def compact_local(y, x, i, kb, electric_f, ecv_in_path, dipole_in_path, A_in_path, y0):
+        """
+        Local (k-diagonal) part of the SBE for the compact state at
+        position i of the vector and index kb of the batch.
+        i = f_v, i+1 = Re p_vc, i+2 = Im p_vc, i+3 = f_c
+        """
+        ecv = ecv_in_path[kb]
+        wr = dipole_in_path[kb]*electric_f
+        wr_c = wr.conjugate()
+        wr_d_diag = A_in_path[kb]*electric_f
+
+        p_vc = y[i+1] + 1j*y[i+2]
+        x_vc = (1j*ecv - gamma2 + 1j*wr_d_diag)*p_vc - 1j*wr*(y[i]-y[i+3])
+
+        x[i]   = 2*(p_vc*wr_c).imag - gamma1*(y[i]-y0[i])
+        x[i+1] = x_vc.real
+        x[i+2] = x_vc.imag
+        x[i+3] = -2*(p_vc*wr_c).imag - gamma1*(y[i+3]-y0[i+3])
+
+    @conditional_njit(type_complex_np, parallel)
+    def flength_compact_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
+        """
+        flength_inplace for the compact real state: same equations, p_cv is
+        not stored and every component is real.
+        """
         electric_f = electric_field(t)
         D = electric_f/dk
 
-        # Update the solution vector
-        Nk_path = kpath.shape[0]
-        for k in range(Nk_path):
-            i = 4*k
-            right4 = 4*(k+4)
-            right3 = 4*(k+3)
-            right2 = 4*(k+2)
-            right  = 4*(k+1)
-            left   = 4*(k-1)
-            left2  = 4*(k-2)
-            left3  = 4*(k-3)
-            left4  = 4*(k-4)
-            if k == 0:
-                left   = 4*(Nk_path-1)
-                left2  = 4*(Nk_path-2)
-                left3  = 4*(Nk_path-3)
-                left4  = 4*(Nk_path-4)
-            elif k == 1 and dk_order >= 4:
-                left2  = 4*(Nk_path-1)
-                left3  = 4*(Nk_path-2)
-                left4  = 4*(Nk_path-3)
-            elif k == 2 and dk_order >= 6:
-                left3  = 4*(Nk_path-1)
-                left4  = 4*(Nk_path-2)
-            elif k == 3 and dk_order >= 8:
-                left4  = 4*(Nk_path-1)
-            elif k == Nk_path-1:
-                right4 = 4*3
-                right3 = 4*2
-                right2 = 4*1
-                right  = 4*0
-            elif k == Nk_path-2 and dk_order >= 4:
-                right4 = 4*2
-                right3 = 4*1
-                right2 = 4*0
-            elif k == Nk_path-3 and dk_order >= 6:
-                right4 = 4*1
-                right3 = 4*0
-            elif k == Nk_path-4 and dk_order >= 8:
-                right4 = 4*0
-
-            # Energy gap e_2(k) - e_1(k) >= 0 at point k
-            ecv = ecv_in_path[k]
-
-            # Rabi frequency: w_R = q*d_12(k)*E(t)
-            # Rabi frequency conjugate: w_R_c = q*d_21(k)*E(t)
-            wr = dipole_in_path[k]*electric_f
-            wr_c = wr.conjugate()
+        Nk_path = kpath.shape[1]
+        if spectral_fft:
+            with objmode(dy=type_real_nb):
+                dy = spectral_derivative(y[:-1], spectral_kappa)
+        else:
+            dy = y[:1]
+        for p in range(kpath.shape[0]):
+            o = 4*p*Nk_path
+            for k in prange(Nk_path):
+                i = o + 4*k
+                compact_local(y, x, i, p*Nk_path + k, electric_f, ecv_in_path,
+                              dipole_in_path, A_in_path, y0)
+
+                # compute drift term via k-derivative
+                for s in range(drift_offsets.size):
+                    j = o + 4*((k + drift_offsets[s]) % Nk_path)
+                    w = D*drift_weights[s]
+                    x[i]   += w*y[j]
+                    x[i+1] += w*y[j+1]
+                    x[i+2] += w*y[j+2]
+                    x[i+3] += w*y[j+3]
+                if spectral_fft:
+                    x[i]   += D*dy[i]
+                    x[i+1] += D*dy[i+1]
+                    x[i+2] += D*dy[i+2]
+                    x[i+3] += D*dy[i+3]
+
+        x[-1] = A_rate*electric_f
 
-            # Rabi frequency: w_R = q*(d_11(k) - d_22(k))*E(t)
-            wr_d_diag = A_in_path[k]*electric_f
-
-            # Update each component of the solution vector
-            # i = f_v, i+1 = p_vc, i+2 = p_cv, i+3 = f_c
-            x[i]   = 2*(y[i+1]*wr_c).imag - gamma1*(y[i]-y0[i])
-
-            x[i+1] = (1j*ecv - gamma2 + 1j*wr_d_diag)*y[i+1] - 1j*wr*(y[i]-y[i+3])
-
-            x[i+3] = -2*(y[i+1]*wr_c).imag - gamma1*(y[i+3]-y0[i+3])
-
-            # compute drift term via k-derivative
-            if dk_order == 2:
-                x[i]   += D*( y[right]/2   - y[left]/2  )
-                x[i+1] += D*( y[right+1]/2 - y[left+1]/2 )
-                x[i+3] += D*( y[right+3]/2 - y[left+3]/2 )
-            elif dk_order == 4:
-                x[i]   += D*(- y[right2]/12   + 2/3*y[right]   - 2/3*y[left]   + y[left2]/12 )
-                x[i+1] += D*(- y[right2+1]/12 + 2/3*y[right+1] - 2/3*y[left+1] + y[left2+1]/12 )
-                x[i+3] += D*(- y[right2+3]/12 + 2/3*y[right+3] - 2/3*y[left+3] + y[left2+3]/12 )
-            elif dk_order == 6:
-                x[i]   += D*(  y[right3]/60   - 3/20*y[right2]   + 3/4*y[right] \
-                             - y[left3]/60    + 3/20*y[left2]    - 3/4*y[left] )
-                x[i+1] += D*(  y[right3+1]/60 - 3/20*y[right2+1] + 3/4*y[right+1] \
-                             - y[left3+1]/60  + 3/20*y[left2+1]  - 3/4*y[left+1] )
-                x[i+3] += D*(  y[right3+3]/60 - 3/20*y[right2+3] + 3/4*y[right+3] \
-                             - y[left3+3]/60  + 3/20*y[left2+3]  - 3/4*y[left+3] )
-            elif dk_order == 8:
-                x[i]   += D*(- y[right4]/280   + 4/105*y[right3]   - 1/5*y[right2]   + 4/5*y[right] \
-                             + y[left4] /280   - 4/105*y[left3]    + 1/5*y[left2]    - 4/5*y[left] )
-                x[i+1] += D*(- y[right4+1]/280 + 4/105*y[right3+1] - 1/5*y[right2+1] + 4/5*y[right+1] \
-                             + y[left4+1] /280 - 4/105*y[left3+1]  + 1/5*y[left2+1]  - 4/5*y[left+1] )
-                x[i+3] += D*(- y[right4+3]/280 + 4/105*y[right3+3] - 1/5*y[right2+3] + 4/5*y[right+3] \
-                             + y[left4+3] /280 - 4/105*y[left3+3]  + 1/5*y[left2+3]  - 4/5*y[left+3] )
-
-            x[i+2] = x[i+1].conjugate()
-
-        x[-1] = -electric_f
+    @conditional_njit(type_complex_np)
+    def flength_compact(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
+        x = np.empty_like(y)
+        flength_compact_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
         return x
 
     @conditional_njit(type_complex_np)
     def pre_velocity(kpath, k_shift):
         # First round k_shift is zero, consequently we just recalculate
         # the original data ecv_in_path, dipole_in_path, A_in_path
-        kx = kpath[:, 0] + E_dir[0]*k_shift
-        ky = kpath[:, 1] + E_dir[1]*k_shift
+        # kpath holds a batch of paths, all k-points are shifted at once
+        kx = kpath[:, :, 0].flatten() + E_dir[0]*k_shift
+        ky = kpath[:, :, 1].flatten() + E_dir[1]*k_shift
 
         ecv_in_path = ecf(kx=kx, ky=ky) - evf(kx=kx, ky=ky)
 
@@ -443,56 +929,125 @@ def make_fnumba(sys, dipole, E_dir, gamma1, gamma2, dk_order, electric_field, ga
         return ecv_in_path, dipole_in_path, A_in_path
 
     @conditional_njit(type_complex_np)
-    def fvelocity(t, y, kpath, _dk, ecv_in_path, dipole_in_path, A_in_path, y0):
+    def interpolate_shift_table(k_shift, shift_grid, ecv_table, dipole_table, A_table):
+        # 6-point Lagrange interpolation between the rows of the tables on
+        # the uniform grid shift_grid[0] + j*shift_grid[1]
+        u = (k_shift - shift_grid[0])/shift_grid[1]
+        j = min(max(int(np.floor(u)), 2), ecv_table.shape[0] - 4)
+        u -= j
+
+        ecv_in_path = np.zeros(ecv_table.shape[1], dtype=type_complex_np)
+        dipole_in_path = np.zeros(ecv_table.shape[1], dtype=type_complex_np)
+        A_in_path = np.zeros(ecv_table.shape[1], dtype=type_complex_np)
+        for m in range(-2, 4):
+            weight = 1.0
+            for n in range(-2, 4):
+                if n != m:
+                    weight *= (u - n)/(m - n)
+            ecv_in_path += weight*ecv_table[j+m]
+            dipole_in_path += weight*dipole_table[j+m]
+            A_in_path += weight*A_table[j+m]
+
+        return ecv_in_path, dipole_in_path, A_in_path
+
+    @conditional_njit(type_complex_np)
+    def shifted_path(kpath, k_shift, dk, ecv_in_path, dipole_in_path, A_in_path):
+        # Energies and dipoles of the path shifted by k_shift along E_dir
+        if shift_table:
+            return interpolate_shift_table(k_shift, dk, ecv_in_path, dipole_in_path, A_in_path)
+        return pre_velocity(kpath, k_shift)
+
+    @conditional_njit(type_complex_np, parallel)
+    def fvelocity_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
         """
         Velocity gauge needs a recalculation of energies and dipoles as k
         is shifted according to the vector potential A
+        With a parameter axis, every combination shifts the path by its own
+        A-field (the last Nparam entries of y).
+        The right hand side is written into x.
         """
+        Nk_batch = kpath.shape[0]*kpath.shape[1]
+        for q in range(Nparam):
+            A_q = vector_potential_of(t, y) if Nparam == 1 else y[y.size - Nparam + q].real
+            ecv_shift, dipole_shift, A_shift = \
+                shifted_path(kpath, A_q, dk, ecv_in_path, dipole_in_path, A_in_path)
 
-        ecv_in_path, dipole_in_path, A_in_path = pre_velocity(kpath, y[-1].real)
+            electric_f = field_axis(t, q)
+            g1 = gamma1_axis[q]
+            g2 = gamma2_axis[q]
 
-        # x != y(t+dt)
-        x = np.empty(np.shape(y), dtype=type_complex_np)
+            # Update the solution vector, the k-points in parallel
+            for k in prange(Nk_batch):
+                i = 4*(q*Nk_batch + k)
+                # Energy term eband(i,k) the energy of band i at point k
+                ecv = ecv_shift[k]
 
-        electric_f = electric_field(t)
+                # Rabi frequency: w_R = d_12(k).E(t)
+                # Rabi frequency conjugate
+                wr = dipole_shift[k]*electric_f
+                wr_c = wr.conjugate()
 
-        # Update the solution vector
-        Nk_path = kpath.shape[0]
-        for k in range(Nk_path):
-            i = 4*k
-            # Energy term eband(i,k) the energy of band i at point k
-            ecv = ecv_in_path[k]
+                # Rabi frequency: w_R = (d_11(k) - d_22(k))*E(t)
+                # wr_d_diag   = A_in_path[k]*D
+                wr_d_diag = A_shift[k]*electric_f
 
-            # Rabi frequency: w_R = d_12(k).E(t)
-            # Rabi frequency conjugate
-            wr = dipole_in_path[k]*electric_f
-            wr_c = wr.conjugate()
+                # Update each component of the solution vector
+                # i = f_v, i+1 = p_vc, i+2 = p_cv, i+3 = f_c
+                x[i] = 2*(y[i+1]*wr_c).imag - g1*(y[i]-y0[i])
 
-            # Rabi frequency: w_R = (d_11(k) - d_22(k))*E(t)
-            # wr_d_diag   = A_in_path[k]*D
-            wr_d_diag = A_in_path[k]*electric_f
+                x[i+1] = (1j*ecv - g2 + 1j*wr_d_diag)*y[i+1] - 1j*wr*(y[i]-y[i+3])
 
-            # Update each component of the solution vector
-            # i = f_v, i+1 = p_vc, i+2 = p_cv, i+3 = f_c
-            x[i] = 2*(y[i+1]*wr_c).imag - gamma1*(y[i]-y0[i])
+                x[i+2] = x[i+1].conjugate()
 
-            x[i+1] = (1j*ecv - gamma2 + 1j*wr_d_diag)*y[i+1] - 1j*wr*(y[i]-y[i+3])
+                x[i+3] = -2*(y[i+1]*wr_c).imag - g1*(y[i+3]-y0[i+3])
 
-            x[i+2] = x[i+1].conjugate()
+            x[x.size - Nparam + q] = A_rate*electric_f
 
-            x[i+3] = -2*(y[i+1]*wr_c).imag - gamma1*(y[i+3]-y0[i+3])
+    @conditional_njit(type_complex_np)
+    def fvelocity(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
+        # x != y(t+dt)
+        x = np.empty(np.shape(y), dtype=type_complex_np)
+        fvelocity_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+        return x
 
-        x[-1] = -electric_f
+    @conditional_njit(type_complex_np, parallel)
+    def fvelocity_compact_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path,
+                                  y0):
+        """
+        fvelocity_inplace for the compact real state.
+        """
+        ecv_in_path, dipole_in_path, A_in_path = \
+            shifted_path(kpath, vector_potential_of(t, y), dk, ecv_in_path, dipole_in_path,
+                         A_in_path)
+
+        electric_f = electric_field(t)
 
+        for k in prange(ecv_in_path.size):
+            compact_local(y, x, 4*k, k, electric_f, ecv_in_path, dipole_in_path, A_in_path, y0)
+
+        x[-1] = A_rate*electric_f
+
+    @conditional_njit(type_complex_np)
+    def fvelocity_compact(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
+        x = np.empty_like(y)
+        fvelocity_compact_inplace(t, y, x, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
         return x
 
     freturn = None
     if gauge == 'length':
         print("Using length gauge")
         freturn = flength
+        freturn_inplace = flength_inplace
+        if compact:
+            freturn = flength_compact
+            freturn_inplace = flength_compact_inplace
     elif gauge == 'velocity':
         print("Using velocity gauge")
         freturn = fvelocity
+        freturn_inplace = fvelocity_inplace
+        if compact:
+            freturn = fvelocity_compact
+            freturn_inplace = fvelocity_compact_inplace
     else:
         raise AttributeError("You have to either assign velocity or length gauge")
 
@@ -501,19 +1056,1141 @@ def make_fnumba(sys, dipole, E_dir, gamma1, gamma2, dk_order, electric_field, ga
     def f(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
         return freturn(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
 
+    # Jitted kernel f.inplace(t, y, x, ...) writes the right hand side into x
+    f.inplace = freturn_inplace
+    f.pre_velocity = pre_velocity
+
     return f
 
-def rk_integrate(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0, \
-                 dt, fnumba):
 
-    k1 = fnumba(t,          y,          kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
-    k2 = fnumba(t + 0.5*dt, y + 0.5*k1, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
-    k3 = fnumba(t + 0.5*dt, y + 0.5*k2, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
-    k4 = fnumba(t +     dt, y +     k3, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+def derivative_stencil(dk_order):
+    """
+        Coefficients c_s of the central k-derivative used in flength,
+        dy/dk ~ sum_s c_s*(y[k+s] - y[k-s])/dk
+    """
+    if dk_order == 2:
+        return np.array([1/2])
+    if dk_order == 4:
+        return np.array([2/3, -1/12])
+    if dk_order == 6:
+        return np.array([3/4, -3/20, 1/60])
+    if dk_order == 8:
+        return np.array([4/5, -1/5, 4/105, -1/280])
+    raise AttributeError("dk_order needs to be either 2, 4, 6, or 8.")
+
+
+# Largest Nk1 for which the spectral k-derivative is applied as the dense
+# O(Nk1^2) product with spectral_derivative_weights, longer paths use the FFT
+# (spectral_derivative). The FFT costs a fixed ~35 us per call of the right
+# hand side for the switch to object mode; measured per call of flength, the
+# dense product breaks even at Nk1 ~ 85 for a single path and Nk1 ~ 45 for a
+# batch of 4 paths, at Nk1 = 200 (900) it costs 0.33 ms (7.5 ms) against
+# 0.07 ms (0.15 ms) for the FFT of a single path.
+spectral_dense_max = 48
+
+
+def spectral_wavenumbers(Nk_path):
+    """
+        Wave numbers 2 pi fftfreq(Nk_path) of the spectral k-derivative (in
+        units of 1/dk), the Nyquist mode of even Nk_path is dropped.
+    """
+    kappa = 2*np.pi*fftfreq(Nk_path)
+    if Nk_path % 2 == 0:
+        kappa[Nk_path//2] = 0
+    return kappa
+
+
+def spectral_derivative(y, kappa, ncomp=4):
+    """
+        dk times the spectral k-derivative of a batch of periodic paths by
+        FFT, O(Nk_path log Nk_path) per path. y holds ncomp entries per
+        k-point and kappa.size k-points per path (see spectral_wavenumbers).
+        Called from the jitted right hand sides in object mode.
+    """
+    paths = y.reshape(-1, kappa.size, ncomp)
+    dy = ifft(1j*kappa[np.newaxis, :, np.newaxis]*fft(paths, axis=1), axis=1)
+    if np.isrealobj(y):
+        dy = dy.real
+    return dy.astype(y.dtype).reshape(-1)
+
+
+def spectral_derivative_weights(Nk_path):
+    """
+        Weights w_m of the spectral (Fourier) derivative of a periodic path,
+        dy/dk ~ sum_m w_m*y[k+m]/dk. Identical to spectral_derivative, the
+        dense product is used for Nk_path <= spectral_dense_max.
+    """
+    freq = spectral_wavenumbers(Nk_path)
+    delta = np.zeros(Nk_path)
+    delta[0] = 1
+    column = ifft(1j*freq*fft(delta)).real
+    # (D delta)[k] = w_{-k}
+    return column[(-np.arange(Nk_path)) % Nk_path]
+
+
+def banded_ring_ordering(Nk_path, dk_order):
+    """
+        Interleaved ordering 0, Nk-1, 1, Nk-2, ... of the periodic k-path.
+        In this order every neighbour k+-s of the stencil is at most 2s
+        positions away, which makes the Jacobian of flength banded.
+
+        Returns
+        -------
+        kpos : np.ndarray
+            kpos[k] is the position of k-point k in the interleaved order
+        band : int
+            lower and upper bandwidth of the Jacobian in the state vector
+    """
+    order = np.empty(Nk_path, dtype=np.int64)
+    order[0::2] = np.arange((Nk_path + 1)//2)
+    order[1::2] = Nk_path - 1 - np.arange(Nk_path//2)
+    kpos = np.argsort(order)
+
+    band = 3
+    k = np.arange(Nk_path)
+    for s in range(1, derivative_stencil(dk_order).size + 1):
+        for neighbour in ((k + s) % Nk_path, (k - s) % Nk_path):
+            band = max(band, 4*np.amax(np.abs(kpos[k] - kpos[neighbour])))
+
+    return kpos, int(band)
+
+
+def banded_state_permutation(kpos, Nk2_batch=1):
+    """
+        Permutation of the ODE vector (4 entries per k, paths of the batch
+        one after another and the A-field as last entry) into the
+        interleaved k-order given by kpos.
+        y_banded = y[state_perm], y = y_banded[state_iperm]
+    """
+    Nk_path = kpos.size
+    Nk_batch = Nk2_batch*Nk_path
+    kpos_batch = (Nk_path*np.arange(Nk2_batch)[:, np.newaxis] + kpos).flatten()
+    state_iperm = np.empty(4*Nk_batch + 1, dtype=np.int64)
+    state_iperm[:-1] = (4*kpos_batch[:, np.newaxis] + np.arange(4)).flatten()
+    state_iperm[-1] = 4*Nk_batch
+    state_perm = np.argsort(state_iperm)
+
+    return state_perm, state_iperm
+
+
+def make_jacobian(gamma1, gamma2, dk_order, electric_field, type_complex_np):
+    """
+        Exact Jacobian of the length gauge right hand side flength in the
+        packed banded format of zvode, jac[i - j + band, j] = df_i/dy_j.
+
+        flength is affine in y, so the Jacobian only depends on time through
+        E(t). p_cv is treated as independent variable obeying the complex
+        conjugate equation of p_vc, which makes the right hand side holomorphic.
+        The A-field entry does not couple to the density matrix in the length
+        gauge, its row and column are zero.
+
+        Parameters
+        ----------
+        gamma1 : float
+            inverse of occupation damping time
+        gamma2 : float
+            inverse of polarization damping time
+        dk_order : int
+            accuracy order of the k-derivative
+        electric_field : jitted function
+            absolute value of the instantaneous driving field E(t)
+
+        Returns
+        -------
+        jlength : jitted function
+            Jacobian of flength; the k-point k of every path in the batch sits
+            at position kpos[k] of the path (see banded_ring_ordering)
+    """
+    stencil = derivative_stencil(dk_order)
+
+    @conditional_njit(type_complex_np)
+    def jlength(t, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, kpos, band):
+        Nk_path = kpath.shape[1]
+        Nk_batch = ecv_in_path.size
+        jac = np.zeros((2*band + 1, 4*Nk_batch + 1), dtype=type_complex_np)
+
+        electric_f = electric_field(t)
+        D = electric_f/dk
+
+        for kb in range(Nk_batch):
+            # Offset of the path in the batch and index of k in the path
+            o = 4*(kb - kb % Nk_path)
+            k = kb % Nk_path
+            i = o + 4*kpos[k]
+
+            ecv = ecv_in_path[kb]
+            wr = dipole_in_path[kb]*electric_f
+            wr_c = wr.conjugate()
+            wr_d_diag = A_in_path[kb]*electric_f
+
+            # d f_v/dt = -1j*(wr_c*p_vc - wr*p_cv) - gamma1*(f_v - f_v0)
+            jac[band, i]     += -gamma1
+            jac[band-1, i+1] += -1j*wr_c
+            jac[band-2, i+2] += 1j*wr
+
+            # d p_vc/dt = (1j*ecv - gamma2 + 1j*wr_d_diag)*p_vc - 1j*wr*(f_v - f_c)
+            jac[band+1, i]   += -1j*wr
+            jac[band, i+1]   += 1j*ecv - gamma2 + 1j*wr_d_diag
+            jac[band-2, i+3] += 1j*wr
+
+            # d p_cv/dt = (-1j*ecv - gamma2 - 1j*wr_d_diag)*p_cv + 1j*wr_c*(f_v - f_c)
+            jac[band+2, i]   += 1j*wr_c
+            jac[band, i+2]   += -1j*ecv - gamma2 - 1j*wr_d_diag
+            jac[band-1, i+3] += -1j*wr_c
+
+            # d f_c/dt = 1j*(wr_c*p_vc - wr*p_cv) - gamma1*(f_c - f_c0)
+            jac[band+2, i+1] += 1j*wr_c
+            jac[band+1, i+2] += -1j*wr
+            jac[band, i+3]   += -gamma1
+
+            # Drift term, acts on every component separately
+            for s in range(stencil.size):
+                right = o + 4*kpos[(k + s + 1) % Nk_path]
+                left = o + 4*kpos[(k - s - 1) % Nk_path]
+                for c in range(4):
+                    jac[i - right + band, right + c] += D*stencil[s]
+                    jac[i - left + band, left + c] -= D*stencil[s]
+
+        return jac
+
+    return jlength
+
+
+def make_banded_system(fnumba, jnumba, kpos, band, Nk2_batch=1):
+    """
+        Wraps the right hand side and the Jacobian for zvode, which
+        integrates the ODE vector of a batch of Nk2_batch paths in the
+        interleaved k-order given by kpos.
+        Both functions take the same parameters as fnumba. The permutation
+        of the ODE vector is attached to f as f.state_perm (natural to
+        interleaved order) and f.state_iperm (interleaved to natural order).
+    """
+    state_perm, state_iperm = banded_state_permutation(kpos, Nk2_batch)
+
+    def f(t, y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0):
+        return fnumba(t, y[state_iperm], kpath, dk, ecv_in_path, dipole_in_path,
+                      A_in_path, y0)[state_perm]
+
+    def jac(t, _y, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, _y0):
+        return jnumba(t, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, kpos, band)
+
+    f.state_perm = state_perm
+    f.state_iperm = state_iperm
+
+    return f, jac
+
+
+def make_observables_accumulator(electric_field, emission_exact_path, polarization_path,
+                                 current_path, Nk_batch, P, y_ref=None, vector_potential=None):
+    """
+        Jitted evaluation of the observables of a batch of paths at one time
+        step of the output grid, used by the integrators that run the whole
+        time loop in numba.
+
+        Parameters
+        ----------
+        y_ref : np.ndarray, optional
+            if given, accumulate gets the deviation y - y_ref of the ODE
+            vector instead of y. The length gauge observables are linear in
+            the density matrix; the observables of the deviation and of y_ref
+            are evaluated separately, so the large cancelling contributions of
+            the occupations (f_v ~ 1) do not round the small time dependent part.
+        vector_potential : function, optional
+            tabulated A(t) (params.field_table), which replaces the last
+            component of y
+
+        Returns
+        -------
+        accumulate : jitted function
+            writes t, A_field and E_field at the time index ti and adds the
+            currents (and polarization) of the ODE vector y at time t_ti
+    """
+    if P.Nparam > 1:
+        return make_parameter_axis_accumulator(electric_field, emission_exact_path,
+                                               polarization_path, current_path, Nk_batch, P)
+
+    save_approx = P.save_approx
+    save_full = P.save_full
+    deferred = P.deferred_observables
+    compact_state = P.compact_state
+    type_complex_np = P.type_complex_np
+    vector_potential_of = make_vector_potential(vector_potential, type_complex_np)
+
+    deviation = y_ref is not None
+    if deviation:
+        state_ref = y_ref[:-1].reshape(Nk_batch, 4).copy()
+        if compact_state:
+            solution_ref = np.empty((Nk_batch, 4), dtype=type_complex_np)
+            expand_compact_state(state_ref, solution_ref)
+        else:
+            solution_ref = state_ref.astype(type_complex_np)
+    else:
+        state_ref = np.zeros((0, 4), dtype=P.type_real_np if compact_state else type_complex_np)
+        solution_ref = np.zeros((0, 4), dtype=type_complex_np)
+
+    @conditional_njit(P.type_complex_np)
+    def accumulate(ti, t_ti, y, t, A_field, E_field, I_exact_E_dir, I_exact_ortho, J_E_dir,
+                   J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch):
+        A_ti = vector_potential_of(t_ti, y)
+        E_ti = electric_field(t_ti)
+
+        # The time arrays are identical for all batches
+        t[ti] = t_ti
+        A_field[ti] = A_ti
+        E_field[ti] = E_ti
+
+        # Do not use the last element (A_field)
+        if save_full and deviation:
+            solution_batch[ti % solution_batch.shape[0], :, :] = \
+                y[:-1].reshape(Nk_batch, 4) + state_ref
+        elif save_full or deferred:
+            solution_batch[ti % solution_batch.shape[0], :, :] = y[:-1].reshape(Nk_batch, 4)
+        if deferred:
+            # The observables are evaluated later for the whole block
+            return
+        if compact_state:
+            # The observables work on the 4-component density matrix
+            solution = np.empty((Nk_batch, 4), dtype=type_complex_np)
+            expand_compact_state(y[:-1].reshape(Nk_batch, 4), solution)
+        else:
+            solution = y[:-1].reshape(Nk_batch, 4)
+
+        I_E_dir_buf, I_ortho_buf = emission_exact_path(solution, E_ti, A_ti)
+        if deviation:
+            I_E_dir_ref, I_ortho_ref = emission_exact_path(solution_ref, E_ti, A_ti)
+            I_E_dir_buf += I_E_dir_ref
+            I_ortho_buf += I_ortho_ref
+        I_exact_E_dir[ti] += I_E_dir_buf
+        I_exact_ortho[ti] += I_ortho_buf
+        if save_approx:
+            P_E_dir_buf, P_ortho_buf = polarization_path(solution[:, 2], A_ti)
+            J_E_dir_buf, J_ortho_buf, J_anom_ortho_buf = \
+                current_path(solution[:, 0], solution[:, 3], A_ti, E_ti)
+            if deviation:
+                P_E_dir_ref, P_ortho_ref = polarization_path(solution_ref[:, 2], A_ti)
+                J_E_dir_ref, J_ortho_ref, J_anom_ortho_ref = \
+                    current_path(solution_ref[:, 0], solution_ref[:, 3], A_ti, E_ti)
+                P_E_dir_buf += P_E_dir_ref
+                P_ortho_buf += P_ortho_ref
+                J_E_dir_buf += J_E_dir_ref
+                J_ortho_buf += J_ortho_ref
+                J_anom_ortho_buf += J_anom_ortho_ref
+            P_E_dir[ti] += P_E_dir_buf
+            P_ortho[ti] += P_ortho_buf
+            J_E_dir[ti] += J_E_dir_buf
+            J_ortho[ti] += J_ortho_buf
+            J_anom_ortho[ti] += J_anom_ortho_buf
+
+    return accumulate
+
+
+def make_parameter_axis_accumulator(electric_field, emission_exact_path, polarization_path,
+                                    current_path, Nk_batch, P):
+    """
+        make_observables_accumulator for a parameter axis: the ODE vector
+        holds P.Nparam copies of the batch followed by their A-fields,
+        electric_field takes (t, q). A_field, E_field and the currents have
+        the shape (P.Nparam, P.Nt), the time array is shared.
+    """
+    save_approx = P.save_approx
+    Nparam = P.Nparam
+
+    @conditional_njit(P.type_complex_np)
+    def accumulate(ti, t_ti, y, t, A_field, E_field, I_exact_E_dir, I_exact_ortho, J_E_dir,
+                   J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch):
+        t[ti] = t_ti
+        for q in range(Nparam):
+            A_ti = y[y.size - Nparam + q].real
+            E_ti = electric_field(t_ti, q)
+            A_field[q, ti] = A_ti
+            E_field[q, ti] = E_ti
+
+            solution = y[4*Nk_batch*q:4*Nk_batch*(q + 1)].reshape(Nk_batch, 4)
+            I_E_dir_buf, I_ortho_buf = emission_exact_path(solution, E_ti, A_ti)
+            I_exact_E_dir[q, ti] += I_E_dir_buf
+            I_exact_ortho[q, ti] += I_ortho_buf
+            if save_approx:
+                P_E_dir_buf, P_ortho_buf = polarization_path(solution[:, 2], A_ti)
+                J_E_dir_buf, J_ortho_buf, J_anom_ortho_buf = \
+                    current_path(solution[:, 0], solution[:, 3], A_ti, E_ti)
+                P_E_dir[q, ti] += P_E_dir_buf
+                P_ortho[q, ti] += P_ortho_buf
+                J_E_dir[q, ti] += J_E_dir_buf
+                J_ortho[q, ti] += J_ortho_buf
+                J_anom_ortho[q, ti] += J_anom_ortho_buf
+
+    return accumulate
+
+
+def make_rk4_integrator(finplace, accumulate, P):
+    """
+        Fixed step Runge-Kutta 4 integrator for a batch of paths. The whole
+        time loop runs in numba: the stages are preallocated and updated in
+        place and the observables are accumulated at every time step.
+
+        Parameters
+        ----------
+        finplace : jitted function
+            in-place right hand side of the ode (f.inplace of make_fnumba)
+        accumulate : jitted function
+            observables of the batch (see make_observables_accumulator)
+
+        Returns
+        -------
+        rk4_integrate : jitted function
+            propagates the ODE vector y in place through the time steps
+            ti_start <= ti < ti_end and adds the observables of every step
+            to the given arrays. step holds the time and step size, stats
+            counts the steps (same interface as make_rk45_integrator).
+    """
+    dt = P.dt
+    t0 = P.t0
+    type_complex_np = P.type_complex_np
+
+    if P.precision == 'extended':
+        return make_rk4_extended_integrator(finplace, accumulate, P)
+
+    @conditional_njit(type_complex_np, P.parallel)
+    def rk4_integrate(ti_start, ti_end, y, step, stats, kpath, dk, ecv_in_path, dipole_in_path,
+                      A_in_path, y0, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                      J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch):
+        # Stage buffers, complex or real (compact state) like y
+        k1 = np.empty_like(y)
+        k2 = np.empty_like(y)
+        k3 = np.empty_like(y)
+        k4 = np.empty_like(y)
+        y_stage = np.empty_like(y)
+
+        for ti in range(ti_start, ti_end):
+            t_ti = ti*dt + t0
+            accumulate(ti, t_ti, y, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                       J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch)
+
+            # Runge-Kutta 4 step
+            finplace(t_ti, y, k1, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+            for i in prange(y.size):
+                y_stage[i] = y[i] + 0.5*dt*k1[i]
+            finplace(t_ti + 0.5*dt, y_stage, k2, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in prange(y.size):
+                y_stage[i] = y[i] + 0.5*dt*k2[i]
+            finplace(t_ti + 0.5*dt, y_stage, k3, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in prange(y.size):
+                y_stage[i] = y[i] + dt*k3[i]
+            finplace(t_ti + dt, y_stage, k4, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in prange(y.size):
+                y[i] += dt/6*(k1[i] + 2*k2[i] + 2*k3[i] + k4[i])
+
+        step[0] = ti_end*dt + t0
+        stats[0] += ti_end - ti_start
+
+    return rk4_integrate
+
+
+def make_rk4_extended_integrator(finplace, accumulate, P):
+    """
+        Runge-Kutta 4 with the state in double-double precision for
+        precision = 'extended'. The ODE vector y holds the leading words
+        y[:n] followed by the trailing words y[n:] (n = y.size//2). The
+        right hand side is evaluated in double precision on the leading
+        words, its rounding error is relative to the increment dt*f and not
+        to the state. The stages and the update are accumulated with
+        error free sums, so the rounding of the state (~1e-16 per step for
+        f_v ~ 1) does not accumulate. accumulate gets the deviation
+        y - y0 (see y_ref of make_observables_accumulator).
+
+        Returns
+        -------
+        rk4_extended_integrate : jitted function
+            same interface as the integrator of make_rk4_integrator
+    """
+    dt = P.dt
+    t0 = P.t0
+
+    @njit
+    def rk4_extended_integrate(ti_start, ti_end, y, step, stats, kpath, dk, ecv_in_path,
+                               dipole_in_path, A_in_path, y0, t, A_field, E_field,
+                               I_exact_E_dir, I_exact_ortho, J_E_dir, J_ortho, P_E_dir,
+                               P_ortho, J_anom_ortho, solution_batch):
+        n = y.size//2
+        y_hi = y[:n]
+        y_lo = y[n:]
+
+        k1 = np.empty_like(y_hi)
+        k2 = np.empty_like(y_hi)
+        k3 = np.empty_like(y_hi)
+        k4 = np.empty_like(y_hi)
+        y_stage = np.empty_like(y_hi)
+        y_dev = np.empty_like(y_hi)
+
+        for ti in range(ti_start, ti_end):
+            t_ti = ti*dt + t0
+            # y_hi - y0 is exact for y_hi close to y0
+            for i in range(n):
+                y_dev[i] = (y_hi[i] - y0[i]) + y_lo[i]
+            accumulate(ti, t_ti, y_dev, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                       J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch)
+
+            finplace(t_ti, y_hi, k1, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+            for i in range(n):
+                y_stage[i] = y_hi[i] + (y_lo[i] + 0.5*dt*k1[i])
+            finplace(t_ti + 0.5*dt, y_stage, k2, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in range(n):
+                y_stage[i] = y_hi[i] + (y_lo[i] + 0.5*dt*k2[i])
+            finplace(t_ti + 0.5*dt, y_stage, k3, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in range(n):
+                y_stage[i] = y_hi[i] + (y_lo[i] + dt*k3[i])
+            finplace(t_ti + dt, y_stage, k4, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in range(n):
+                s, e = two_sum(y_hi[i], dt/6*(k1[i] + 2*k2[i] + 2*k3[i] + k4[i]))
+                # Renormalize: |y_lo| stays below half an ulp of y_hi
+                y_hi[i], y_lo[i] = two_sum(s, y_lo[i] + e)
+
+        step[0] = ti_end*dt + t0
+        stats[0] += ti_end - ti_start
+
+    return rk4_extended_integrate
+
+
+def make_lawson_integrator(finplace, accumulate, P):
+    """
+        Integrating factor Runge-Kutta 4 (Lawson) integrator for a batch of
+        paths. The diagonal linear part of the SBE,
+            L = (-gamma1, 1j*ecv - gamma2, -1j*ecv - gamma2, -gamma1)
+        per k-point, is integrated exactly with exp(L*dt) and only the field
+        driven remainder N = f - L*y is treated by the explicit RK4 stages.
+        dt is therefore limited by the field (drift and Rabi frequency) and
+        not by T2 or the band gap. In the velocity gauge L is taken at the
+        unshifted k-points, the shift of ecv stays in the remainder.
+
+        Parameters
+        ----------
+        finplace : jitted function
+            in-place right hand side of the ode (f.inplace of make_fnumba)
+        accumulate : jitted function
+            observables of the batch (see make_observables_accumulator)
+
+        Returns
+        -------
+        lawson_integrate : jitted function
+            same interface as the integrator of make_rk4_integrator
+    """
+    dt = P.dt
+    t0 = P.t0
+    gamma1 = P.gamma1
+    gamma2 = P.gamma2
+    type_complex_np = P.type_complex_np
+
+    @conditional_njit(type_complex_np)
+    def lawson_integrate(ti_start, ti_end, y, step, stats, kpath, dk, ecv_in_path,
+                         dipole_in_path, A_in_path, y0, t, A_field, E_field, I_exact_E_dir,
+                         I_exact_ortho, J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho,
+                         solution_batch):
+        # Diagonal linear part and its propagators for dt/2 and dt
+        lin = np.zeros(y.size, dtype=type_complex_np)
+        for k in range(ecv_in_path.size):
+            lin[4*k]   = -gamma1
+            lin[4*k+1] = 1j*ecv_in_path[k] - gamma2
+            lin[4*k+2] = -1j*ecv_in_path[k] - gamma2
+            lin[4*k+3] = -gamma1
+        e_half = np.exp(0.5*dt*lin)
+        e_full = np.exp(dt*lin)
+
+        # Stage buffers
+        k1 = np.empty(y.size, dtype=type_complex_np)
+        k2 = np.empty(y.size, dtype=type_complex_np)
+        k3 = np.empty(y.size, dtype=type_complex_np)
+        k4 = np.empty(y.size, dtype=type_complex_np)
+        y_stage = np.empty(y.size, dtype=type_complex_np)
+
+        for ti in range(ti_start, ti_end):
+            t_ti = ti*dt + t0
+            accumulate(ti, t_ti, y, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                       J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch)
+
+            # Lawson RK4 step, the remainder N = f - L*y is evaluated in place
+            finplace(t_ti, y, k1, kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+            for i in range(y.size):
+                k1[i] -= lin[i]*y[i]
+                y_stage[i] = e_half[i]*(y[i] + 0.5*dt*k1[i])
+            finplace(t_ti + 0.5*dt, y_stage, k2, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in range(y.size):
+                k2[i] -= lin[i]*y_stage[i]
+                y_stage[i] = e_half[i]*y[i] + 0.5*dt*k2[i]
+            finplace(t_ti + 0.5*dt, y_stage, k3, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in range(y.size):
+                k3[i] -= lin[i]*y_stage[i]
+                y_stage[i] = e_full[i]*y[i] + dt*e_half[i]*k3[i]
+            finplace(t_ti + dt, y_stage, k4, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+            for i in range(y.size):
+                k4[i] -= lin[i]*y_stage[i]
+                y[i] = e_full[i]*(y[i] + dt/6*k1[i]) \
+                    + dt/6*(2*e_half[i]*(k2[i] + k3[i]) + k4[i])
+
+        step[0] = ti_end*dt + t0
+        stats[0] += ti_end - ti_start
+
+    return lawson_integrate
+
+
+def make_strang_integrator(accumulate, electric_field, P, vector_potential=None):
+    """
+        Strang splitting propagator for the length gauge SBE of a batch of
+        paths. One time step is the symmetric sequence
+            R(dt/2) B(dt/2) K(dt) B(dt/2) R(dt/2)
+        of the damping R (T1, T2, exact), the local 2x2 Bloch rotation B
+        with the field frozen at the midpoint (closed form exponential per
+        k-point) and the drift K along the path. K is applied exactly as a
+        phase factor in the Fourier space of each path: the density matrix
+        is shifted by the integrated field, which also updates A(t). The
+        scheme is second order, unconditionally stable and costs
+        O(Nk1 log Nk1) per path and step.
+
+        Parameters
+        ----------
+        accumulate : jitted function
+            observables of the batch (see make_observables_accumulator)
+        electric_field : jitted function
+            absolute value of the instantaneous driving field E(t)
+        vector_potential : function, optional
+            tabulated A(t) (params.field_table): the integrated field of a
+            step is A(t) - A(t + dt) and the A-component of y is not updated
+
+        Returns
+        -------
+        strang_integrate : function
+            same interface as the integrator of make_rk4_integrator
+    """
+    dt = P.dt
+    t0 = P.t0
+    gamma1 = P.gamma1
+    gamma2 = P.gamma2
+    Nk1 = P.Nk1
+
+    # Phase factors of the shift: wave numbers per k-index, the Nyquist mode
+    # of even Nk1 is shifted as a cosine to keep real functions real
+    kappa = 2*np.pi*fftfreq(Nk1)
+    nyquist = Nk1 % 2 == 0
+
+    # 3-point Gauss-Legendre rule for the integrated field over one step
+    gauss_nodes = dt*(1 + np.array([-np.sqrt(3/5), 0, np.sqrt(3/5)]))/2
+    gauss_weights = dt*np.array([5/18, 8/18, 5/18])
+
+    @conditional_njit(P.type_complex_np)
+    def relaxation(y, y0, tau):
+        e1 = np.exp(-gamma1*tau)
+        e2 = np.exp(-gamma2*tau)
+        for i in range(0, y.size - 1, 4):
+            y[i]   = y0[i] + (y[i] - y0[i])*e1
+            y[i+1] = y[i+1]*e2
+            y[i+2] = y[i+2]*e2
+            y[i+3] = y0[i+3] + (y[i+3] - y0[i+3])*e1
+
+    @conditional_njit(P.type_complex_np)
+    def bloch_rotation(y, tau, electric_f, ecv_in_path, dipole_in_path, A_in_path):
+        # i d(rho)/dt = [H, rho] with H = ((h_d, h_vc), (h_vc^*, -h_d)),
+        # rho -> U rho U^+ with U = exp(-i H tau) = cos(w tau) - i sin(w tau)/w H
+        for k in range(ecv_in_path.size):
+            i = 4*k
+            h_d = -0.5*(ecv_in_path[k].real + A_in_path[k].real*electric_f)
+            h_vc = -dipole_in_path[k]*electric_f
+            w = np.sqrt(h_d**2 + abs(h_vc)**2)
+            c = np.cos(w*tau)
+            s = np.sin(w*tau)/w if w > 0 else tau
+
+            u00 = c - 1j*s*h_d
+            u01 = -1j*s*h_vc
+            u10 = -1j*s*h_vc.conjugate()
+            u11 = c + 1j*s*h_d
+
+            # U rho
+            a = u00*y[i]   + u01*y[i+2]
+            b = u00*y[i+1] + u01*y[i+3]
+            d = u10*y[i]   + u11*y[i+2]
+            e = u10*y[i+1] + u11*y[i+3]
+
+            # (U rho) U^+
+            y[i]   = a*u00.conjugate() + b*u01.conjugate()
+            y[i+1] = a*u10.conjugate() + b*u11.conjugate()
+            y[i+2] = d*u00.conjugate() + e*u01.conjugate()
+            y[i+3] = d*u10.conjugate() + e*u11.conjugate()
+
+    def strang_integrate(ti_start, ti_end, y, step, stats, kpath, dk, ecv_in_path,
+                         dipole_in_path, A_in_path, y0, t, A_field, E_field, I_exact_E_dir,
+                         I_exact_ortho, J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho,
+                         solution_batch):
+        # Density matrices of the batch, shape (Nk2_batch, Nk1, 4), view on y
+        rho = y[:-1].reshape(kpath.shape[0], Nk1, 4)
+
+        for ti in range(ti_start, ti_end):
+            t_ti = ti*dt + t0
+            accumulate(ti, t_ti, y, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                       J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch)
+
+            relaxation(y, y0, 0.5*dt)
+            bloch_rotation(y, 0.5*dt, electric_field(t_ti + 0.25*dt), ecv_in_path,
+                           dipole_in_path, A_in_path)
+
+            # Exact drift: rho(k) -> rho(k + int E dt), A' = -E
+            if vector_potential is None:
+                E_int = np.sum(gauss_weights*electric_field(t_ti + gauss_nodes))
+                y[-1] -= E_int
+            else:
+                E_int = vector_potential(t_ti) - vector_potential(t_ti + dt)
+            shift = kappa*E_int/dk
+            phase = np.exp(1j*shift)
+            if nyquist:
+                phase[Nk1//2] = np.cos(shift[Nk1//2])
+            rho[:, :, :] = ifft(fft(rho, axis=1)*phase[np.newaxis, :, np.newaxis], axis=1)
+
+            bloch_rotation(y, 0.5*dt, electric_field(t_ti + 0.75*dt), ecv_in_path,
+                           dipole_in_path, A_in_path)
+            relaxation(y, y0, 0.5*dt)
+
+        step[0] = ti_end*dt + t0
+        stats[0] += ti_end - ti_start
+
+    return strang_integrate
+
+
+# Dormand-Prince 5(4) tableau (Hairer, Norsett, Wanner, Solving ODEs I)
+dopri5_c = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+dopri5_a = np.array([
+    [0, 0, 0, 0, 0, 0],
+    [1/5, 0, 0, 0, 0, 0],
+    [3/40, 9/40, 0, 0, 0, 0],
+    [44/45, -56/15, 32/9, 0, 0, 0],
+    [19372/6561, -25360/2187, 64448/6561, -212/729, 0, 0],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656, 0],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]])
+# Difference of the 5th and the embedded 4th order weights
+dopri5_e = np.array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525, 1/40])
+# Continuous extension of 4th order, y(t + theta*h) = y + h*sum_s k_s*(P[s] . theta^(1..4))
+dopri5_p = np.array([
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]])
+
+
+def make_rk45_integrator(finplace, accumulate, P):
+    """
+        Adaptive Dormand-Prince 5(4) integrator for a batch of paths. The
+        step size is controlled by the local error estimate with the
+        tolerances P.solver_rtol and P.solver_atol, so large steps are taken
+        in the tails of the pulse. The observables are evaluated on the P.dt
+        output grid with the 4th order continuous extension of the method.
+
+        Parameters
+        ----------
+        finplace : jitted function
+            in-place right hand side of the ode (f.inplace of make_fnumba)
+        accumulate : jitted function
+            observables of the batch (see make_observables_accumulator)
+
+        Returns
+        -------
+        rk45_integrate : jitted function
+            propagates the ODE vector y in place, starting at time step[0] with
+            the trial step size step[1], until all output times ti < ti_end
+            are passed. step is updated in place, stats counts the accepted
+            and rejected steps.
+    """
+    dt = P.dt
+    t0 = P.t0
+    rtol = P.solver_rtol
+    atol = P.solver_atol
+    type_complex_np = P.type_complex_np
+    type_real_np = P.type_real_np
+
+    c = dopri5_c.astype(type_real_np)
+    a = dopri5_a.astype(type_real_np)
+    e = dopri5_e.astype(type_real_np)
+    p = dopri5_p.astype(type_real_np)
+
+    @conditional_njit(type_complex_np)
+    def rk45_integrate(ti_start, ti_end, y, step, stats, kpath, dk, ecv_in_path, dipole_in_path,
+                       A_in_path, y0, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                       J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch):
+        # Stage and solution buffers, complex or real (compact state) like y
+        k = np.empty((7, y.size), dtype=y.dtype)
+        y_stage = np.empty_like(y)
+        y_new = np.empty_like(y)
+        y_out = np.empty_like(y)
+        q = np.empty(7, dtype=type_real_np)
+
+        t_cur = step[0]
+        h = step[1]
+        finplace(t_cur, y, k[0], kpath, dk, ecv_in_path, dipole_in_path, A_in_path, y0)
+
+        # The integration stops exactly at the last output time of this call
+        t_stop = (ti_end - 1)*dt + t0
+
+        ti = ti_start
+        while ti < ti_end:
+            # Output time that is already reached (the initial time)
+            if ti*dt + t0 <= t_cur:
+                accumulate(ti, ti*dt + t0, y, t, A_field, E_field, I_exact_E_dir,
+                           I_exact_ortho, J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho,
+                           solution_batch)
+                ti += 1
+                continue
+
+            h_trial = h
+            last = t_cur + h >= t_stop
+            if last:
+                h = t_stop - t_cur
+
+            # Stages 2 to 6 and the 5th order solution
+            for s in range(1, 7):
+                for i in range(y.size):
+                    y_stage[i] = y[i]
+                    for r in range(s):
+                        y_stage[i] += h*a[s, r]*k[r, i]
+                if s < 6:
+                    finplace(t_cur + c[s]*h, y_stage, k[s], kpath, dk, ecv_in_path,
+                             dipole_in_path, A_in_path, y0)
+            y_new[:] = y_stage
+            finplace(t_cur + h, y_new, k[6], kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0)
+
+            # Weighted RMS norm of the local error
+            err = 0.0
+            for i in range(y.size):
+                err_i = 0.0j
+                for s in range(7):
+                    err_i += e[s]*k[s, i]
+                scale = atol + rtol*max(abs(y[i]), abs(y_new[i]))
+                err += (abs(h*err_i)/scale)**2
+            err = np.sqrt(err/y.size)
+
+            if err <= 1:
+                # Dense output for the output times inside the step
+                while ti < ti_end and (last or ti*dt + t0 <= t_cur + h):
+                    theta = (ti*dt + t0 - t_cur)/h
+                    for s in range(7):
+                        q[s] = theta*(p[s, 0] + theta*(p[s, 1] + theta*(p[s, 2]
+                                                                  + theta*p[s, 3])))
+                    for i in range(y.size):
+                        y_out[i] = y[i]
+                        for s in range(7):
+                            y_out[i] += h*q[s]*k[s, i]
+                    accumulate(ti, ti*dt + t0, y_out, t, A_field, E_field, I_exact_E_dir,
+                               I_exact_ortho, J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho,
+                               solution_batch)
+                    ti += 1
+
+                t_cur = t_stop if last else t_cur + h
+                y[:] = y_new
+                k[0, :] = k[6]
+                stats[0] += 1
+            else:
+                stats[1] += 1
+
+            # Step size control with safety factor
+            if err == 0:
+                factor = 10.0
+            else:
+                factor = min(10.0, max(0.2, 0.9*err**(-0.2)))
+            if err > 1:
+                factor = min(1.0, factor)
+            if last and err <= 1:
+                # The step was only shortened to hit t_stop
+                h = max(h*factor, h_trial)
+            else:
+                h = h*factor
+
+        step[0] = t_cur
+        step[1] = h
+
+    return rk45_integrate
+
+
+def make_fast_forward(accumulate, electric_field, P):
+    """
+        Analytic propagation through an interval without driving field,
+        with the interface of the integrators (see make_rk4_integrator).
+        Without field the k-points decouple: the occupations relax to y0
+        with gamma1, the coherences rotate and decay with
+        exp((1j*ecv - gamma2)*t) and A is constant. ecv_in_path are the
+        energies of the (in the velocity gauge shifted) path.
+        The coherences are propagated step by step until |p_vc| is below
+        P.coherence_tol (absolute, independent of the field threshold
+        P.field_free_tol). Afterwards the observables only relax with gamma1
+        and follow in closed form from two evaluations (not with save_full
+        or deferred_observables, which need the state of every step).
+
+        Returns
+        -------
+        fast_forward : jitted function
+            propagates y from the time step[0] through the output times
+            ti_start <= ti < ti_end to the time of ti_end
+    """
+    dt = P.dt
+    t0 = P.t0
+    gamma1 = P.gamma1
+    gamma2 = P.gamma2
+    coherence_tol = P.coherence_tol
+    save_approx = P.save_approx
+    compact_state = P.compact_state
+    closed_form = not (P.save_full or P.deferred_observables)
+    type_accum_np = P.type_accum_np
+
+    @conditional_njit(P.type_complex_np)
+    def propagate_free(y, y0, rotation, relaxation):
+        for k in range(rotation.size):
+            i = 4*k
+            y[i] = y0[i] + (y[i] - y0[i])*relaxation
+            y[i+3] = y0[i+3] + (y[i+3] - y0[i+3])*relaxation
+            if compact_state:
+                p_vc = (y[i+1] + 1j*y[i+2])*rotation[k]
+                y[i+1] = p_vc.real
+                y[i+2] = p_vc.imag
+            else:
+                y[i+1] = y[i+1]*rotation[k]
+                y[i+2] = y[i+1].conjugate()
+
+    @conditional_njit(P.type_complex_np)
+    def fast_forward(ti_start, ti_end, y, step, stats, kpath, dk, ecv_in_path, dipole_in_path,
+                     A_in_path, y0, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                     J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch):
+        # The state is at step[0], rk45 stops at the last output time of a call
+        tau = ti_start*dt + t0 - step[0]
+        if tau != 0:
+            propagate_free(y, y0, np.exp((1j*ecv_in_path.real - gamma2)*tau),
+                           np.exp(-gamma1*tau))
+        rotation = np.exp((1j*ecv_in_path.real - gamma2)*dt)
+        relaxation = np.exp(-gamma1*dt)
+
+        # Number of steps until the coherences are negligible
+        p_max = 0.0
+        for k in range(ecv_in_path.size):
+            if compact_state:
+                p_max = max(p_max, abs(y[4*k+1] + 1j*y[4*k+2]))
+            else:
+                p_max = max(p_max, abs(y[4*k+1]))
+        ti_closed = ti_end
+        if closed_form and p_max <= coherence_tol:
+            ti_closed = ti_start
+        elif closed_form and gamma2 > 0:
+            n_coherent = np.ceil(np.log(p_max/coherence_tol)/(gamma2*dt))
+            ti_closed = min(ti_end, ti_start + int(n_coherent))
+
+        for ti in range(ti_start, ti_closed):
+            accumulate(ti, ti*dt + t0, y, t, A_field, E_field, I_exact_E_dir, I_exact_ortho,
+                       J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch)
+            propagate_free(y, y0, rotation, relaxation)
+
+        if ti_closed < ti_end:
+            # Drop the coherences, the occupations relax from the state y at
+            # ti_closed to y_inf = y0 (with the same A)
+            for k in range(ecv_in_path.size):
+                y[4*k+1] = 0
+                y[4*k+2] = 0
+            y_inf = y0.copy()
+            y_inf[-1] = y[-1]
+
+            # Observables of y (column 0) and y_inf (column 1)
+            t_closed = ti_closed*dt + t0
+            t_buf = np.zeros(2, dtype=type_accum_np)
+            A_buf = np.zeros(2, dtype=type_accum_np)
+            E_buf = np.zeros(2, dtype=type_accum_np)
+            obs = np.zeros((7, 2), dtype=type_accum_np)
+            if save_approx:
+                accumulate(0, t_closed, y, t_buf, A_buf, E_buf, obs[0], obs[1], obs[2],
+                           obs[3], obs[4], obs[5], obs[6], solution_batch)
+                accumulate(1, t_closed, y_inf, t_buf, A_buf, E_buf, obs[0], obs[1], obs[2],
+                           obs[3], obs[4], obs[5], obs[6], solution_batch)
+            else:
+                accumulate(0, t_closed, y, t_buf, A_buf, E_buf, obs[0], obs[1], J_E_dir,
+                           J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch)
+                accumulate(1, t_closed, y_inf, t_buf, A_buf, E_buf, obs[0], obs[1], J_E_dir,
+                           J_ortho, P_E_dir, P_ortho, J_anom_ortho, solution_batch)
+
+            # The observables are affine in the occupations
+            for ti in range(ti_closed, ti_end):
+                w = np.exp(-gamma1*(ti - ti_closed)*dt)
+                t[ti] = ti*dt + t0
+                A_field[ti] = A_buf[0]
+                E_field[ti] = electric_field(ti*dt + t0)
+                I_exact_E_dir[ti] += obs[0, 1] + w*(obs[0, 0] - obs[0, 1])
+                I_exact_ortho[ti] += obs[1, 1] + w*(obs[1, 0] - obs[1, 1])
+                if save_approx:
+                    J_E_dir[ti] += obs[2, 1] + w*(obs[2, 0] - obs[2, 1])
+                    J_ortho[ti] += obs[3, 1] + w*(obs[3, 0] - obs[3, 1])
+                    P_E_dir[ti] += obs[4, 1] + w*(obs[4, 0] - obs[4, 1])
+                    P_ortho[ti] += obs[5, 1] + w*(obs[5, 0] - obs[5, 1])
+                    J_anom_ortho[ti] += obs[6, 1] + w*(obs[6, 0] - obs[6, 1])
+
+            w = np.exp(-gamma1*(ti_end - ti_closed)*dt)
+            for k in range(ecv_in_path.size):
+                y[4*k] = y0[4*k] + (y[4*k] - y0[4*k])*w
+                y[4*k+3] = y0[4*k+3] + (y[4*k+3] - y0[4*k+3])*w
+
+        step[0] = ti_end*dt + t0
+
+    return fast_forward
+
+
+def make_block_observables(sys, dipole, k_in_batch, E_dir, curvature, P):
+    """
+        Observables of a batch of paths for a block of time steps at once
+        (velocity gauge, P.deferred_observables)
+
+        Returns
+        -------
+        block_observables : function
+            (solution, E_field, A_field) of the block -> I_exact_E_dir,
+            I_exact_ortho and, with P.save_approx, P_E_dir, P_ortho, J_E_dir,
+            J_ortho, J_anom_ortho per time step of the block
+    """
+    emission_block = make_emission_exact_block_velocity(sys, k_in_batch, E_dir, curvature, P)
+    if P.save_approx:
+        polarization_block = make_polarization_block_velocity(dipole, k_in_batch, E_dir, P)
+        current_block = make_current_block_velocity(sys, k_in_batch, E_dir, curvature, P)
+
+    def block_observables(solution, E_field, A_field):
+        if P.compact_state:
+            solution = compact_state_view(solution)
+        observables = emission_block(solution, E_field, A_field)
+        if P.save_approx:
+            observables += polarization_block(solution[:, :, 2], A_field)
+            observables += current_block(solution[:, :, 0], solution[:, :, 3], A_field, E_field)
+        return observables
+
+    return block_observables
+
+
+def add_block_observables(ti_start, ti_end, solution, block_observables, E_field, A_field,
+                          I_exact_E_dir, I_exact_ortho, J_E_dir, J_ortho, P_E_dir, P_ortho,
+                          J_anom_ortho, P):
+    """
+        Adds the observables of the time steps ti_start <= ti < ti_end with
+        the batch solution of these steps (see make_block_observables)
+    """
+    observables = block_observables(solution, E_field[ti_start:ti_end],
+                                    A_field[ti_start:ti_end])
+    I_exact_E_dir[ti_start:ti_end] += observables[0]
+    I_exact_ortho[ti_start:ti_end] += observables[1]
+    if P.save_approx:
+        P_E_dir[ti_start:ti_end] += observables[2]
+        P_ortho[ti_start:ti_end] += observables[3]
+        J_E_dir[ti_start:ti_end] += observables[4]
+        J_ortho[ti_start:ti_end] += observables[5]
+        J_anom_ortho[ti_start:ti_end] += observables[6]
+
+
+def velocity_shift_range(electric_field, P, vector_potential=None):
+    """
+        Range of the k-shift A(t) = -int_t0^t E(t') dt' of the velocity gauge,
+        integrated with the trapezoidal rule on a grid of P.dt/4 (or from the
+        table vector_potential of make_tabulated_field) and widened by 10 %
+        for the intermediate stages of the solvers
+    """
+    t = np.linspace(P.t0, P.tf, 4*(P.Nt - 1) + 1)
+    if vector_potential is not None:
+        A = vector_potential(t)
+    else:
+        E = electric_field(t)
+        A = -np.concatenate(([0], np.cumsum((E[1:] + E[:-1])/2*(t[1] - t[0]))))
+    margin = 0.1*(np.amax(A) - np.amin(A)) + 1e-3
+
+    return np.amin(A) - margin, np.amax(A) + margin
 
-    ynew = y + dt/6 * (k1 + 2*k2 + 2*k3 + k4)
 
-    return ynew
+def velocity_shift_table(pre_velocity, kpath, shift_range, P):
+    """
+        Tables of ecv_in_path, dipole_in_path and A_in_path of a batch of
+        paths shifted by k_shift along E_dir, on a uniform grid of shifts.
+        The grid is refined by factors of 2 until the 6-point Lagrange
+        interpolation of the right hand side reproduces the values at the
+        midpoints of the grid within P.velocity_shift_tol (relative to the
+        largest value of each table).
+
+        Parameters
+        ----------
+        pre_velocity : jitted function
+            energies and dipoles of the shifted path (f.pre_velocity of make_fnumba)
+        kpath : np.ndarray
+            batch of paths, shape (Nk2_batch, Nk1, 2)
+        shift_range : tuple
+            smallest and largest shift, see velocity_shift_range
+
+        Returns
+        -------
+        shift_grid : np.ndarray
+            first grid point and grid spacing
+        ecv_table, dipole_table, A_table : np.ndarray
+            shape (number of shifts, Nk_batch)
+    """
+    # Lagrange weights of the midpoint between the nodes -2, ..., 3
+    midpoint_weights = np.array([3, -25, 150, 150, -25, 3])/256
+
+    def tables(shift_min, h, Nshift):
+        elements = [pre_velocity(kpath, shift_min + j*h) for j in range(Nshift)]
+        return [np.array([element[i] for element in elements]) for i in range(3)]
+
+    # Three extra grid points on each side for the interpolation stencil
+    Nint = 32
+    while True:
+        h = (shift_range[1] - shift_range[0])/Nint
+        shift_min = shift_range[0] - 3*h
+        fine = tables(shift_min, h/2, 2*(Nint + 6) + 1)
+        error = 0
+        for table in fine:
+            coarse = table[::2]
+            midpoint = sum(midpoint_weights[m]*coarse[m:m + Nint + 1] for m in range(6))
+            scale = max(np.amax(np.abs(table)), np.finfo(P.type_real_np).tiny)
+            error = max(error, np.amax(np.abs(midpoint - table[5:5 + 2*(Nint + 1):2]))/scale)
+        if error < P.velocity_shift_tol or Nint >= 2**16:
+            break
+        Nint *= 2
+
+    if error >= P.velocity_shift_tol:
+        print("WARNING: velocity shift table did not reach the tolerance, error = ", error)
+
+    shift_grid = np.array([shift_min, h], dtype=P.type_real_np)
+    return (shift_grid,) + tuple(np.ascontiguousarray(table[::2]) for table in fine)
+
+
+@njit
+def expand_compact_state(compact, solution):
+    """
+        Writes the 4-component view (f_v, p_vc, p_cv, f_c) of a compact
+        state (f_v, Re p_vc, Im p_vc, f_c) of shape (Nk, 4) into solution.
+    """
+    for k in range(compact.shape[0]):
+        solution[k, 0] = compact[k, 0]
+        solution[k, 1] = compact[k, 1] + 1j*compact[k, 2]
+        solution[k, 2] = compact[k, 1] - 1j*compact[k, 2]
+        solution[k, 3] = compact[k, 3]
+
+
+def compact_state_view(solution_full):
+    """
+        4-component density matrix (f_v, p_vc, p_cv, f_c) in the last axis
+        of a compact solution (f_v, Re p_vc, Im p_vc, f_c), e.g. the
+        solution_full saved with compact_state = True
+    """
+    rho = np.empty(solution_full.shape, dtype=np.result_type(solution_full.dtype, 1j))
+    rho[..., 0] = solution_full[..., 0]
+    rho[..., 1] = solution_full[..., 1] + 1j*solution_full[..., 2]
+    rho[..., 2] = solution_full[..., 1] - 1j*solution_full[..., 2]
+    rho[..., 3] = solution_full[..., 3]
+
+    return rho
+
 
 def solution_container(P):
     """
@@ -521,28 +2198,23 @@ def solution_container(P):
         as well as the currents will be written
     """
     # Solution containers
-    t = np.zeros(P.Nt, dtype=P.type_real_np)
-
-    # The solution array is structred as: first index is Nk1-index,
-    # second is Nk2-index, third is timestep, fourth is f_h, p_he, p_eh, f_e
-    solution = np.zeros((P.Nk1, 4), dtype=P.type_complex_np)
+    t = np.zeros(P.Nt, dtype=P.type_accum_np)
 
-    # For hand-made Runge-Kutta method, we need the solution as array with
-    # a single index
-    solution_y_vec = np.zeros((4*P.Nk1+1), dtype=P.type_complex_np)
+    # Fields and currents of every combination of a parameter axis
+    shape = P.Nt if P.Nparam == 1 else (P.Nparam, P.Nt)
 
-    A_field = np.zeros(P.Nt, dtype=P.type_real_np)
-    E_field = np.zeros(P.Nt, dtype=P.type_real_np)
+    A_field = np.zeros(shape, dtype=P.type_accum_np)
+    E_field = np.zeros(shape, dtype=P.type_accum_np)
 
-    I_exact_E_dir = np.zeros(P.Nt, dtype=P.type_real_np)
-    I_exact_ortho = np.zeros(P.Nt, dtype=P.type_real_np)
+    I_exact_E_dir = np.zeros(shape, dtype=P.type_accum_np)
+    I_exact_ortho = np.zeros(shape, dtype=P.type_accum_np)
 
     if P.save_approx:
-        J_E_dir = np.zeros(P.Nt, dtype=P.type_real_np)
-        J_ortho = np.zeros(P.Nt, dtype=P.type_real_np)
-        P_E_dir = np.zeros(P.Nt, dtype=P.type_real_np)
-        P_ortho = np.zeros(P.Nt, dtype=P.type_real_np)
-        J_anom_ortho = np.zeros(P.Nt, dtype=P.type_real_np)
+        J_E_dir = np.zeros(shape, dtype=P.type_accum_np)
+        J_ortho = np.zeros(shape, dtype=P.type_accum_np)
+        P_E_dir = np.zeros(shape, dtype=P.type_accum_np)
+        P_ortho = np.zeros(shape, dtype=P.type_accum_np)
+        J_anom_ortho = np.zeros(shape, dtype=P.type_accum_np)
     else:
         J_E_dir = None
         J_ortho = None
@@ -550,10 +2222,497 @@ def solution_container(P):
         P_ortho = None
         J_anom_ortho = None
 
-    return t, A_field, E_field, solution, solution_y_vec, I_exact_E_dir, I_exact_ortho, \
+    return t, A_field, E_field, I_exact_E_dir, I_exact_ortho, \
         J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho
 
 
+# Keys of the containers of solution_container in a checkpoint
+checkpoint_keys = ('t', 'A_field', 'E_field', 'I_exact_E_dir', 'I_exact_ortho',
+                   'J_E_dir', 'J_ortho', 'P_E_dir', 'P_ortho', 'J_anom_ortho')
+
+
+def write_checkpoint(checkpoint_name, batch_idx, ti, y, step, stats, containers,
+                     solution_batch, solution_full, P):
+    """
+        Writes the accumulated containers (see solution_container) and the
+        state of the integration atomically to checkpoint_name: the batches
+        before batch_idx (see path_batches) are complete, batch batch_idx is
+        integrated up to the time index ti with ODE vector y, time and step
+        size step and solver statistics stats (ti = 0: not started).
+        solution_batch (jitted solvers) and solution_full are only stored
+        with save_full.
+    """
+    data = {'batch_idx': batch_idx, 'ti': ti, 'y': y, 'step': step, 'stats': stats,
+            'Nt': P.Nt, 'Nk2_batch': P.Nk2_batch, 'save_full': P.save_full, 'Nparam': P.Nparam,
+            'field_table': P.field_table}
+    for key, container in zip(checkpoint_keys, containers):
+        if container is not None:
+            data[key] = container
+    if P.save_full:
+        data['solution_full'] = solution_full
+        if solution_batch is not None:
+            data['solution_batch'] = solution_batch
+
+    # Write to a temporary file first, a killed job never leaves a broken checkpoint
+    tmp_name = checkpoint_name + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        np.savez(f, **data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, checkpoint_name)
+
+
+def read_checkpoint(checkpoint_name, containers, solution_full, P):
+    """
+        Loads a checkpoint of write_checkpoint into the containers and
+        solution_full (in place). Returns the state of the interrupted batch
+        as a dict (batch_idx, ti, y, step, stats, solution_batch) or None if
+        there is no checkpoint of this calculation.
+    """
+    if not os.path.exists(checkpoint_name):
+        return None
+
+    with np.load(checkpoint_name) as data:
+        # With field_table the A-component of y is not integrated
+        if data['Nt'] != P.Nt or data['Nk2_batch'] != P.Nk2_batch \
+                or data['save_full'] != P.save_full or data['Nparam'] != P.Nparam \
+                or data.get('field_table', False) != P.field_table:
+            print("WARNING: The checkpoint " + checkpoint_name + " does not match the "
+                  "parameters (Nk2_batch, save_full, parameter axis, field_table), starting "
+                  "from the beginning.")
+            return None
+
+        for key, container in zip(checkpoint_keys, containers):
+            if container is not None:
+                container[:] = data[key]
+        if P.save_full:
+            solution_full[:] = data['solution_full']
+
+        resume = {'batch_idx': int(data['batch_idx']), 'ti': int(data['ti']),
+                  'y': data['y'], 'step': data['step'], 'stats': data['stats'],
+                  'solution_batch': data['solution_batch'] if 'solution_batch' in data else None}
+
+    if P.user_out:
+        print("Resuming from " + checkpoint_name + " at batch " + str(resume['batch_idx'] + 1) +
+              ", time step " + str(resume['ti']))
+
+    return resume
+
+
+@njit
+def sample_electric_field(electric_field, t):
+    E = np.empty(t.size)
+    for i in range(t.size):
+        E[i] = electric_field(t[i])
+    return E
+
+
+def field_free_steps(electric_field, P):
+    """
+        Mask of the time steps ti -> ti + 1 of the output grid during which
+        the driving field is negligible: |E| < field_free_tol*max|E| at the
+        start, the middle and the end of the step
+    """
+    t = P.t0 + 0.5*P.dt*np.arange(2*P.Nt + 1)
+    if P.field_table:
+        # The tabulated field is a ufunc
+        E = np.abs(electric_field(t))
+    else:
+        E = np.abs(sample_electric_field(electric_field, t))
+    small = E < P.field_free_tol*np.amax(E)
+
+    return small[0:-1:2] & small[1::2] & small[2::2]
+
+
+def auto_time_step(sys, dipole, paths, dk, E_dir, P):
+    """
+        Time step for dt = 'auto' from the highest frequency of the problem.
+        The observables are sampled at the Nyquist rate of the band gap and of
+        the carrier (including the chirp at the edges of the time window). The
+        explicit rk4 additionally needs the spectral radius of the right hand
+        side on the mesh (gap, Rabi frequencies and the k-derivative stencil
+        at the largest field amplitude E0) inside its stability interval 2*sqrt(2);
+        lawson and strang integrate the gap (strang also the k-advection)
+        exactly. rk45 chooses its own steps, dt is its output grid.
+
+        Returns
+        -------
+        dt : float
+            time step in a.u.
+    """
+    k = paths.reshape(-1, 2)
+    kx, ky = k[:, 0], k[:, 1]
+    ecv = np.real(sys.efjit[1](kx=kx, ky=ky) - sys.efjit[0](kx=kx, ky=ky))
+    ecv_max = np.amax(np.abs(ecv))
+
+    # Sampling of the band gap and of the instantaneous carrier frequency
+    w_max = 2*np.pi*P.w*(1 + 2*np.amax(np.abs(P.chirp_axis))*P.tf)
+    dt = np.pi/max(ecv_max, w_max)
+
+    if P.solver_method not in ('rk4', 'lawson', 'strang'):
+        return dt
+
+    # Rabi frequencies q*E0*d_12(k) and q*E0*(d_11(k) - d_22(k))
+    rabi = np.zeros(ecv.size)
+    if not P.do_semicl:
+        d_01 = E_dir[0]*dipole.Axfjit[0][1](kx=kx, ky=ky) \
+            + E_dir[1]*dipole.Ayfjit[0][1](kx=kx, ky=ky)
+        d_diag = E_dir[0]*(dipole.Axfjit[0][0](kx=kx, ky=ky) - dipole.Axfjit[1][1](kx=kx, ky=ky)) \
+            + E_dir[1]*(dipole.Ayfjit[0][0](kx=kx, ky=ky) - dipole.Ayfjit[1][1](kx=kx, ky=ky))
+        rabi = np.amax(P.E0_axis)*(2*np.abs(d_01) + np.abs(d_diag))
+
+    # Largest eigenvalue of the k-derivative: E0/dk times the maximum of the
+    # symbol 2*sum_s c_s*sin(s*theta) of the central stencil
+    drift = 0
+    if P.gauge == 'length' and P.solver_method != 'strang':
+        if P.dk_order == 'spectral':
+            symbol = np.pi
+        else:
+            stencil = derivative_stencil(P.dk_order)
+            theta = np.linspace(0, np.pi, 1025)
+            symbol = np.amax(np.abs(2*np.sin(np.outer(theta, np.arange(1, stencil.size + 1)))
+                                    @ stencil))
+        drift = np.amax(P.E0_axis)*symbol/dk
+
+    radius = rabi + drift
+    if P.solver_method == 'rk4':
+        radius = radius + np.abs(ecv) + max(np.amax(P.gamma1_axis), np.amax(P.gamma2_axis))
+
+    return min(dt, 2*np.sqrt(2)/np.amax(radius))
+
+
+def mirror_path_weights(sys, dipole, curvature, paths, E_dir, P):
+    """
+        Weights of the paths for P.symmetry: the mirror at the axis along
+        E_dir maps the mesh onto itself and (if declared with 'mirror' or
+        found on the mesh with 'auto') the Hamiltonian. It keeps the E_dir
+        components of the currents and flips the sign of the ortho
+        components. Of every pair of mirror images only one path is
+        integrated.
+
+        Returns
+        -------
+        weights : np.ndarray or None
+            2 for the integrated path of a pair, 0 for its mirror image and
+            1 for paths which are their own (or have no) mirror image. None
+            if the Hamiltonian is not mirror symmetric ('auto').
+    """
+    if P.BZ_type == 'rectangle':
+        partner, shift = mirror_partners(paths, E_dir)
+    else:
+        partner, shift = mirror_partners(paths, E_dir, P.b1, P.b2)
+    pairs = np.flatnonzero(partner > np.arange(P.Nk2))
+
+    if P.symmetry == 'auto' and not mirror_symmetric(sys, dipole, curvature, paths, E_dir,
+                                                     partner, shift, P):
+        print("No mirror symmetry along E_dir, all paths are integrated")
+        return None
+
+    weights = np.ones(P.Nk2, dtype=int)
+    weights[pairs] = 2
+    weights[partner[pairs]] = 0
+
+    return weights
+
+
+def mirror_symmetric(sys, dipole, curvature, paths, E_dir, partner, shift, P):
+    """
+        Checks the mirror symmetry of the Hamiltonian on the paths with a
+        mirror image in the mesh: the band energies and the absolute values
+        of the dipole components d_E, d_ortho along and orthogonal to E_dir
+        are the same at k and at its image, d_E*conj(d_ortho) changes sign
+        (semiclassics: the Berry curvature changes sign).
+    """
+    mirror = np.flatnonzero(partner >= 0)
+    if mirror.size == 0:
+        return False
+    k = paths[mirror].reshape(-1, 2)
+    k_image = np.array([np.roll(paths[partner[i]], -shift[i], axis=0) for i in mirror])\
+        .reshape(-1, 2)
+    E_ort = np.array([E_dir[1], -E_dir[0]])
+
+    def invariants(k, sign):
+        kx, ky = k[:, 0], k[:, 1]
+        values = [sys.efjit[0](kx=kx, ky=ky), sys.efjit[1](kx=kx, ky=ky)]
+        if P.do_semicl:
+            values += [sign*curvature.Bfjit[0][0](kx=kx, ky=ky),
+                       sign*curvature.Bfjit[1][1](kx=kx, ky=ky)]
+        else:
+            d_01x = dipole.Axfjit[0][1](kx=kx, ky=ky)
+            d_01y = dipole.Ayfjit[0][1](kx=kx, ky=ky)
+            d_E = E_dir[0]*d_01x + E_dir[1]*d_01y
+            d_ortho = E_ort[0]*d_01x + E_ort[1]*d_01y
+            values += [np.abs(d_E), np.abs(d_ortho), sign*d_E*np.conj(d_ortho)]
+        return [np.broadcast_to(v, kx.shape) for v in values]
+
+    for v, v_image in zip(invariants(k, 1), invariants(k_image, -1)):
+        if np.amax(np.abs(v - v_image)) > 1e-8*max(np.amax(np.abs(v)), 1e-30):
+            return False
+
+    return True
+
+
+def time_segments(ti_start, ti_end, field_free):
+    """
+        Splits the time steps ti_start <= ti < ti_end into segments
+        (ti_a, ti_b, free) of consecutive steps with (free = False) and
+        without (free = True) driving field
+    """
+    if field_free is None:
+        return [(ti_start, ti_end, False)]
+
+    free = field_free[ti_start:ti_end].astype(np.int8)
+    bounds = np.concatenate(([ti_start], ti_start + 1 + np.flatnonzero(np.diff(free)),
+                             [ti_end]))
+
+    return [(ti_a, ti_b, bool(field_free[ti_a])) for ti_a, ti_b in zip(bounds[:-1], bounds[1:])]
+
+
+def filename_tail(P):
+    """
+        Tail of the names of the output files of the calculation
+    """
+    return 'E_{:.4f}_w_{:.1f}_a_{:.1f}_{}_t0_{:.1f}_dt_{:.6f}_NK1-{}_NK2-{}_T1_{:.1f}_T2_{:.1f}_chirp_{:.3f}_ph_{:.2f}_solver_{:s}'\
+        .format(P.E0_MVpcm, P.w_THz, P.alpha_fs, P.gauge, P.t0_fs, P.dt_fs, P.Nk1, P.Nk2, P.T1_fs, P.T2_fs, P.chirp_THz, P.phase, P.solver_method)
+
+
+def worker_batches(batches, containers, P):
+    """
+        Batches (batch_idx, Nk2_idxs) of paths integrated by this process.
+        With P.workers > 1 the first batch is integrated before the other
+        processes are forked, so that they inherit the compiled kernels and
+        t, A_field and E_field. The parent and P.workers - 1 forked workers
+        then take the next open batch from a shared counter until all batches
+        are done. The workers add their currents into shared memory and exit,
+        the parent adds them to its own currents. A running numba thread pool
+        (P.parallel) does not survive the fork, which is why parse_params
+        rejects P.parallel with P.workers > 1.
+    """
+    workers = min(P.workers, len(batches))
+    if workers == 1:
+        yield from batches
+        return
+
+    yield batches[0]
+
+    ctx = multiprocessing.get_context('fork')
+    next_batch = ctx.Value('i', 1)
+    reduce_lock = ctx.Lock()
+    currents = [c for c in containers[3:] if c is not None]
+    shared = [shared_array(c.shape, c.dtype) for c in currents]
+
+    # Unwritten output would be printed again by every worker
+    print(end='', flush=True)
+    pids = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            break
+        pids.append(pid)
+    worker = pid == 0
+
+    status = 1
+    try:
+        if worker:
+            # The currents of the parent are reduced in the parent
+            for c in currents:
+                c[...] = 0
+        while True:
+            with next_batch.get_lock():
+                idx = next_batch.value
+                next_batch.value += 1
+            if idx >= len(batches):
+                break
+            yield batches[idx]
+
+        if worker:
+            with reduce_lock:
+                for c, s in zip(currents, shared):
+                    s += c
+        status = 0
+    finally:
+        if worker:
+            print(end='', flush=True)
+            os._exit(status)
+
+    failed = 0
+    for pid in pids:
+        failed += os.waitpid(pid, 0)[1] != 0
+    if failed > 0:
+        raise RuntimeError("{} of {} worker processes failed".format(failed, workers - 1))
+
+    for c, s in zip(currents, shared):
+        c += s
+
+
+def mpi_reduce(mpi, arrays):
+    """
+        Sums the arrays (None is skipped) of all MPI ranks in place on rank 0
+    """
+    for array in arrays:
+        if array is None:
+            continue
+        if mpi.rank == 0:
+            mpi.comm.Reduce(MPI.IN_PLACE, array, op=MPI.SUM, root=0)
+        else:
+            mpi.comm.Reduce(array, None, op=MPI.SUM, root=0)
+
+
+def shared_array(shape, dtype):
+    """
+        Zero initialized array in shared memory, which is inherited by forked
+        processes
+    """
+    nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+    buffer = multiprocessing.get_context('fork').RawArray('b', max(nbytes, 1))
+    return np.frombuffer(buffer, dtype=np.int8, count=nbytes).view(dtype).reshape(shape)
+
+
+def path_batches(P, path_weights=None, levels=None):
+    """
+        Splits the path indices 0..Nk2-1 into batches of Nk2_batch paths,
+        which are integrated together in a single ODE vector. With
+        path_weights (see mirror_path_weights) the paths of weight 0 are left
+        out and every batch has paths of a single weight. With levels (see
+        progressive_levels) the batches follow the levels.
+    """
+    if P.Nk2_idx_ext >= 0:
+        return [np.array([P.Nk2_idx_ext])]
+
+    if levels is not None:
+        groups = levels
+    elif path_weights is not None:
+        groups = [np.flatnonzero(path_weights == weight) for weight in (2, 1)]
+    else:
+        return [np.arange(start, min(start + P.Nk2_batch, P.Nk2))
+                for start in range(0, P.Nk2, P.Nk2_batch)]
+
+    return [idxs[start:start + P.Nk2_batch]
+            for idxs in groups for start in range(0, idxs.size, P.Nk2_batch)]
+
+
+def progressive_levels(Nk2, center):
+    """
+        Hierarchical order of the paths for P.convergence_tol. With the odd
+        part q of Nk2 = 2^m*q, level 0 has every q-th path (2^m paths), every
+        further level divides the stride by the next odd prime factor of q
+        (3 first) and adds the paths in between. The paths of the first
+        levels together are equally spaced and, with paths i and
+        (center - i) % Nk2 being mirror images (see mirror_partners), mirror
+        symmetric, so that the ortho currents of mirror symmetric systems
+        cancel on every level (not possible with even strides).
+
+        Returns
+        -------
+        levels : list of np.ndarray
+            indices of the paths added in each level
+    """
+    factors = []
+    n = Nk2
+    p = 3
+    while n % 2 == 0:
+        n //= 2
+    while n > 1:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 2
+
+    # The stride of level 0 is odd, 2*offset = center (mod stride)
+    strides = np.prod(factors)//np.cumprod([1] + factors)[:-1]
+    offset = center*(strides[0] + 1)//2 % strides[0]
+    done = np.zeros(Nk2, dtype=bool)
+    levels = []
+    for stride in list(strides) + [1]:
+        idxs = np.arange(offset % stride, Nk2, stride)
+        if not np.all(done[idxs]):
+            levels.append(idxs[~done[idxs]])
+        done[idxs] = True
+
+    return levels
+
+
+def progressive_batches(batches, levels, containers, P):
+    """
+        Batches (batch_idx, Nk2_idxs) of the progressive levels of paths
+        (see progressive_levels). After every level the harmonic intensities
+        of the paths integrated so far are compared with the ones of the
+        previous level; the batches end when the largest relative change is
+        below P.convergence_tol. P.Nk2_converged and P.convergence record the
+        number of integrated paths and the last change.
+    """
+    t, I_exact_E_dir, I_exact_ortho = containers[0], containers[3], containers[4]
+    level_ends = np.cumsum([level.size for level in levels])
+
+    Nk2_done = 0
+    intensities = None
+    P.Nk2_converged = 0
+    P.convergence = np.inf
+    for batch_idx, Nk2_idxs in batches:
+        yield batch_idx, Nk2_idxs
+        Nk2_done += Nk2_idxs.size
+        P.Nk2_converged = Nk2_done
+        if Nk2_done not in level_ends:
+            continue
+
+        intensities_prev = intensities
+        intensities = harmonic_intensities(t, I_exact_E_dir/Nk2_done, I_exact_ortho/Nk2_done, P)
+        if intensities_prev is None:
+            continue
+
+        # Harmonics 6 orders of magnitude below the strongest one are not monitored
+        floor = 1e-6*np.amax(intensities_prev)
+        P.convergence = float(np.amax(np.abs(intensities - intensities_prev)
+                                      / np.maximum(intensities_prev, floor)))
+        print("Paths: ", Nk2_done, " change of the harmonic intensities: ",
+              '{:.3e}'.format(P.convergence))
+        if P.convergence < P.convergence_tol and Nk2_done < P.Nk2:
+            print("Converged with ", Nk2_done, " of ", P.Nk2, " paths")
+            return
+
+
+def harmonic_intensities(t, I_E_dir, I_ortho, P):
+    """
+        Emission intensity (E_dir + ortho, arbitrary units) of the harmonic
+        orders n in P.convergence_window, integrated over n - 1/2 < freq/w < n + 1/2
+    """
+    dt_out = t[1] - t[0]
+    freq = fftshift(fftfreq(t.size, d=dt_out))
+    Int_E_dir, Int_ortho, _Iw_E_dir, _Iw_ortho = fourier_current_intensity(
+        I_E_dir, I_ortho, gaussian(t, P.alpha), dt_out, 1, freq)
+    Int = Int_E_dir + Int_ortho
+
+    orders = np.arange(np.ceil(max(P.convergence_window[0], 1)), P.convergence_window[1] + 1)
+    return np.array([np.sum(Int[np.abs(freq/P.w - n) < 0.5]) for n in orders])
+
+
+def mirror_batches(batches, path_weights, containers):
+    """
+        Batches (batch_idx, Nk2_idxs) of paths with the currents of their
+        mirror images: after a batch of paths of weight 2 the increments of
+        the E_dir currents are doubled, the increments of the ortho currents
+        cancel with the ones of the mirror images (opposite sign).
+    """
+    t, A_field, E_field, I_exact_E_dir, I_exact_ortho, \
+        J_E_dir, J_ortho, P_E_dir, P_ortho, J_anom_ortho = containers
+    currents_E_dir = [c for c in (I_exact_E_dir, J_E_dir, P_E_dir) if c is not None]
+    currents_ortho = [c for c in (I_exact_ortho, J_ortho, P_ortho, J_anom_ortho)
+                      if c is not None]
+
+    for batch_idx, Nk2_idxs in batches:
+        if path_weights is None or path_weights[Nk2_idxs[0]] == 1:
+            yield batch_idx, Nk2_idxs
+            continue
+
+        E_dir_before = [c.copy() for c in currents_E_dir]
+        ortho_before = [c.copy() for c in currents_ortho]
+        yield batch_idx, Nk2_idxs
+        for c, c_before in zip(currents_E_dir, E_dir_before):
+            c += c - c_before
+        for c, c_before in zip(currents_ortho, ortho_before):
+            c[...] = c_before
+
+
 def initial_condition(ev, ec, P):
     '''
     Occupy conduction band according to inital Fermi energy and temperature
@@ -780,11 +2939,21 @@ def print_user_info(P, B0=None, mu=None, incident_angle=None):
     print("ODE solver method               = " + str(P.solver_method))
     print("Precision (default = double)    = " + str(P.precision))
     print("Number of k-points              = " + str(P.Nk))
+    if P.Nparam > 1:
+        print("Parameter combinations          = " + str(P.Nparam))
+    if P.workers > 1:
+        print("Worker processes                = " + str(P.workers))
+    if P.symmetry is not None:
+        print("Path symmetry                   = " + P.symmetry)
+    if P.convergence_tol is not None:
+        print("Convergence tolerance (Nk2)     = " + str(P.convergence_tol))
     print("Order of k-derivative           = " + str(P.dk_order))
     if P.BZ_type == 'hexagon':
         print("Driving field alignment         = " + P.align)
     elif P.BZ_type == 'rectangle':
         print("Driving field direction         = " + str(P.angle_inc_E_field))
+    elif P.BZ_type == 'lattice':
+        print("Driving field direction         = b1")
     if B0 is not None:
         print("Incident angle                  = " + str(np.rad2deg(incident_angle)))
     print("Driving amplitude (MV/cm)[a.u.] = " + "("
@@ -2,18 +2,20 @@ import time
 from math import ceil, modf
 import numpy as np
 from numpy.fft import fft, ifft, fftshift, ifftshift, fftfreq
-from numba import njit
+from numba import njit, prange, set_num_threads, objmode
 import matplotlib.pyplot as plt
 from matplotlib.patches import RegularPolygon
 from scipy.integrate import ode
 
-from sbe.kpoint_mesh import hex_mesh, rect_mesh
+from sbe.kpoint_mesh import hex_mesh, rect_mesh, lattice_mesh
 from sbe.utility import ConversionFactors as co
 from sbe.utility import parse_params
 from sbe.fields import make_electric_field
 from sbe.dipole import diagonalize, dipole_elements
 from sbe.observables_n_bands import make_matrix_elements_dipoles, make_matrix_elements_hderiv, current_per_path
 from sbe.observables import make_current_path
+from sbe.solver import spectral_derivative_weights, spectral_wavenumbers, spectral_derivative, \
+    spectral_dense_max
 
 def sbe_solver_n_bands(sys, dipole, params, curvature, electric_field_function=None):
     """
@@ -97,6 +99,11 @@ def sbe_solver_n_bands(sys, dipole, params, curvature, electric_field_function=N
                           np.sin(np.radians(P.angle_inc_E_field))])
         dk, kweight, _kpnts, paths = rect_mesh(P, E_dir, P.type_real_np)
         # BZ_plot(_kpnts, a, b1, b2, paths)
+    elif P.BZ_type == 'lattice':
+        _kpnts, paths, area = lattice_mesh(P)
+        kweight = area/P.Nk
+        dk = np.linalg.norm(P.b1)/P.Nk1
+        E_dir = P.b1/np.linalg.norm(P.b1)
 
     E_ort = np.array([E_dir[1], -E_dir[0]])
 
@@ -107,7 +114,10 @@ def sbe_solver_n_bands(sys, dipole, params, curvature, electric_field_function=N
     else:
         electric_field = electric_field_function
 
-    fnumba = make_fnumba(P.n, E_dir, P.gamma1, P.gamma2, electric_field, P.dk_order)
+    if P.parallel:
+        set_num_threads(P.threads)
+    fnumba = make_fnumba(P.n, E_dir, P.gamma1, P.gamma2, electric_field, P.dk_order, P.Nk1,
+                         P.parallel)
     solver = ode(fnumba, jac=None)\
         .set_integrator('zvode', method=P.solver_method, max_step=P.dt)
 
@@ -294,7 +304,7 @@ def sbe_solver_n_bands(sys, dipole, params, curvature, electric_field_function=N
         np.savez(S_name, t=t, solution_full=solution_full, paths=paths,
                  electric_field=electric_field(t), A_field=A_field)
 
-def make_fnumba(n, E_dir, gamma1, gamma2, electric_field, dk_order):
+def make_fnumba(n, E_dir, gamma1, gamma2, electric_field, dk_order, Nk1=None, parallel=False):
     """
         Initialization of the solver for the SBE ( eq. (39/40(80) in https://arxiv.org/abs/2008.03177)
 
@@ -315,13 +325,28 @@ def make_fnumba(n, E_dir, gamma1, gamma2, electric_field, dk_order):
                 returns the instantaneous driving field
             gauge : str
                 length or velocity gauge (only v. implemented)
+            Nk1 : int
+                number of k-points per path, only needed for dk_order = 'spectral'
+            parallel : bool
+                loop over k on numba's thread pool (prange)
 
         Returns:
         --------
             freturn : function that is the right hand side of the ode
     """
+    # Spectral k-derivative: periodic derivative along the path, a dense
+    # product for short paths and by FFT otherwise
+    spectral = dk_order == 'spectral'
+    spectral_fft = spectral and Nk1 > spectral_dense_max
+    if spectral:
+        spectral_weights = spectral_derivative_weights(Nk1)
+        spectral_kappa = spectral_wavenumbers(Nk1)
+        dk_order = 0
+    else:
+        spectral_weights = np.zeros(1)
+        spectral_kappa = np.zeros(1)
 
-    @njit
+    @njit(parallel=parallel)
     def fnumba(t, y, kpath, dipole_in_path, e_in_path, y0, dk):
         """
             function that multiplies the block-structure of the matrices of the RHS
@@ -335,7 +360,12 @@ def make_fnumba(n, E_dir, gamma1, gamma2, electric_field, dk_order):
         D = electric_f/dk
 
         Nk_path = kpath.shape[0]
-        for k in range(Nk_path):
+        if spectral_fft:
+            with objmode(dy='complex128[:]'):
+                dy = spectral_derivative(y[:-1], spectral_kappa, n**2)
+        else:
+            dy = y[:1]
+        for k in prange(Nk_path):
             right4 = (k+4)
             right3 = (k+3)
             right2 = (k+2)
@@ -389,6 +419,12 @@ def make_fnumba(n, E_dir, gamma1, gamma2, electric_field, dk_order):
                                                       -  1/5*y[right2*(n**2) + i*n + j] + 4/5*y[right*(n**2) + i*n + j] \
                                                       + y[left4*(n**2) + i*n + j]/280 - 4/105*y[left3*(n**2) + i*n + j] \
                                                       + 1/5*y[left2*(n**2) + i*n + j] - 4/5*y[left*(n**2) + i*n + j] )
+                    elif spectral_fft:
+                        x[k*(n**2) + i*n + j] += D * dy[k*(n**2) + i*n + j]
+                    elif spectral:
+                        for m in range(1, Nk_path):
+                            right = (k + m) % Nk_path
+                            x[k*(n**2) + i*n + j] += D * spectral_weights[m] * y[right*(n**2) + i*n + j]
 
                     if i == j:
                         x[k*(n**2) + i*n + j] += - gamma1 * (y[k*(n**2) + i*n + j] - y0[k*(n**2) + i*n + j])
@@ -694,6 +730,8 @@ def print_user_info(P, B0=None, mu=None, incident_angle=None):
         print("Driving field alignment         = " + P.align)
     elif P.BZ_type == 'rectangle':
         print("Driving field direction         = " + str(P.angle_inc_E_field))
+    elif P.BZ_type == 'lattice':
+        print("Driving field direction         = b1")
     if B0 is not None:
         print("Incident angle                  = " + str(np.rad2deg(incident_angle)))
     print("Driving amplitude (MV/cm)[a.u.] = " + "("
@@ -52,6 +52,14 @@ class MpiHelpers:
                 klocal = np.zeros(le)
         return klist, klocal, ptuple, displace
 
+    def listrange(self, L):
+        '''
+        Gives the range (start, stop) of the elements of a list of length L on this core.
+        '''
+        ptuple = self.__equipartition(L)
+        displace = self.__displacelist(ptuple)
+        return displace[self.rank], displace[self.rank] + ptuple[self.rank]
+
     def __equipartition(self, L):
         '''
         Gives a tuple with entries equal to the number of cores.
@@ -1,9 +1,17 @@
+import os
 from math import modf
 import numpy as np
+import numba
 import sys
 
 from sbe.utility import ConversionFactors as co
 
+# Memory of a batch of paths for Nk2_batch = 'auto' (~ size of the L2/L3 cache)
+batch_cache_bytes = 8*1024**2
+
+# Parameters which can be given as arrays (parameter axis)
+parameter_axis_keys = ('E0', 'chirp', 'phase', 'T1', 'T2')
+
 def parse_params(user_params):
     class Params():
         pass
@@ -42,24 +50,118 @@ def parse_params(user_params):
     if hasattr(UP, 'save_anom'):
         P.save_anom = UP.save_anom
 
-    P.solver_method = 'bdf'                 # 'adams' non-stiff, 'bdf' stiff, 'rk4' Runge-Kutta 4th order
-    if hasattr(UP, 'solver_method'):
-        P.solver_method = UP.solver_method
+    P.solver_method = 'bdf'                 # 'adams' non-stiff, 'bdf' stiff, 'rk4' Runge-Kutta 4th order,
+    if hasattr(UP, 'solver_method'):        # 'rk45' adaptive Dormand-Prince, 'lawson' RK4 with
+        P.solver_method = UP.solver_method  # exact diagonal (gap, T1, T2) terms, 'strang' split step
+        if P.solver_method not in ['bdf', 'adams', 'rk4', 'rk45', 'lawson', 'strang']:
+            sys.exit("solver_method needs to be either bdf, adams, rk4, rk45, lawson, or strang.")
+        if P.solver_method == 'strang' and P.gauge != 'length':
+            sys.exit("Strang splitting (exact k-advection) only works in the length gauge.")
+
+    P.solver_rtol = 1e-6                    # relative and absolute local error
+    if hasattr(UP, 'solver_rtol'):          # tolerance of 'rk45'
+        P.solver_rtol = UP.solver_rtol
+
+    P.solver_atol = 1e-9
+    if hasattr(UP, 'solver_atol'):
+        P.solver_atol = UP.solver_atol
+
+    P.solver_jacobian = False               # analytic banded Jacobian for 'bdf'/'adams' (length gauge)
+    if hasattr(UP, 'solver_jacobian'):
+        P.solver_jacobian = UP.solver_jacobian
+
+    P.compact_state = False                 # real state (f_v, Re p_vc, Im p_vc, f_c) per k-point
+    if hasattr(UP, 'compact_state'):        # instead of (f_v, p_vc, p_cv, f_c), 'bdf'/'adams' use vode
+        P.compact_state = UP.compact_state
+        if P.compact_state and P.solver_method not in ['bdf', 'adams', 'rk4', 'rk45']:
+            sys.exit("compact_state only works with the bdf, adams, rk4, or rk45 solver.")
+        if P.compact_state and P.solver_jacobian:
+            sys.exit("compact_state can not be combined with solver_jacobian.")
 
-    P.precision = 'double'                  # quadruple for reducing numerical noise
+    P.velocity_shift_table = False          # velocity gauge: interpolate energies and dipoles of
+    if hasattr(UP, 'velocity_shift_table'): # the shifted path in precomputed tables of A(t)
+        P.velocity_shift_table = UP.velocity_shift_table
+        if P.velocity_shift_table and P.solver_method == 'lawson':
+            sys.exit("velocity_shift_table can not be combined with the lawson solver.")
+
+    P.velocity_shift_tol = 1e-10            # relative interpolation error of the shift tables
+    if hasattr(UP, 'velocity_shift_tol'):
+        P.velocity_shift_tol = UP.velocity_shift_tol
+
+    P.deferred_observables = False          # velocity gauge: record the state and evaluate the
+    if hasattr(UP, 'deferred_observables'): # currents afterwards for blocks of time steps
+        P.deferred_observables = UP.deferred_observables
+        if P.deferred_observables and P.gauge != 'velocity':
+            sys.exit("deferred_observables only works in the velocity gauge.")
+
+    P.deferred_block = 256                  # time steps per block of deferred_observables
+    if hasattr(UP, 'deferred_block'):
+        P.deferred_block = UP.deferred_block
+
+    # precision = 'single' runs the state and the kernels in float32/complex64
+    # and sums the observables in double. Accuracy envelope against double
+    # precision with the same solver (test 22: Dirac, Nk1 = 50, Nk2 = 4,
+    # E0 = 5 MV/cm, dt = 0.05 fs), maximum deviation of the current in
+    # E-direction relative to its maximum / of the emission spectrum up to
+    # the 10th harmonic:
+    #     rk4    2.1e-4 / 2.0e-2
+    #     lawson 1.5e-4 / 6.2e-3
+    #     strang 5.7e-4 / 1.1e-2
+    #     rk45   1.1e-3 / 1.1e-1  (the default solver_atol is below float32 resolution)
+    P.precision = 'double'                 # quadruple for reducing numerical noise
     if hasattr(UP, 'precision'):
         P.precision = UP.precision
 
     if P.precision == 'double':
         P.type_real_np    = np.float64
         P.type_complex_np = np.complex128
+    elif P.precision == 'single':           # fast exploration, see the accuracy envelope above
+        P.type_real_np    = np.float32
+        P.type_complex_np = np.complex64
+        if P.solver_method in ['bdf', 'adams']:
+            sys.exit("Error: Single precision only works with the rk4, rk45, lawson, or strang ODE solver.")
+    elif P.precision == 'extended':         # double-double rk4 state, compiled (instead of quadruple)
+        P.type_real_np    = np.float64
+        P.type_complex_np = np.complex128
+        if P.solver_method != 'rk4' or P.gauge != 'length':
+            sys.exit("Error: Extended precision only works with the Runge-Kutta 4 ODE solver "
+                     "in the length gauge.")
     elif P.precision == 'quadruple':
         P.type_real_np    = np.float128
         P.type_complex_np = np.complex256
         if P.solver_method != 'rk4':
             sys.exit("Error: Quadruple precision only works with Runge-Kutta 4 ODE solver.")
+        if P.compact_state:
+            sys.exit("Error: Quadruple precision only works with the full complex state.")
     else:
-        sys.exit("Only default or quadruple precision available.")
+        sys.exit("Only single, default, extended or quadruple precision available.")
+
+    # Sums over k-points, paths and time of the observables are accumulated
+    # in at least double precision
+    P.type_accum_np = np.promote_types(P.type_real_np, np.float64).type
+    P.type_accum_complex_np = np.promote_types(P.type_complex_np, np.complex128).type
+
+    P.fast_forward = False                  # analytic propagation of the time steps without
+    if hasattr(UP, 'fast_forward'):         # field (|E| < field_free_tol*max|E|)
+        P.fast_forward = UP.fast_forward
+        if P.fast_forward and P.solver_method not in ['rk4', 'rk45', 'lawson', 'strang']:
+            sys.exit("fast_forward only works with the rk4, rk45, lawson, or strang solver.")
+        if P.fast_forward and P.precision not in ['single', 'double']:
+            sys.exit("fast_forward only works in single or double precision.")
+
+    P.field_free_tol = 1e-14                # fast_forward: relative field threshold,
+    if hasattr(UP, 'field_free_tol'):       # steps with |E| < field_free_tol*max|E|
+        P.field_free_tol = UP.field_free_tol
+
+    P.coherence_tol = 1e-14                 # fast_forward: coherences |p_vc| below it
+    if hasattr(UP, 'coherence_tol'):        # (absolute) are dropped after the pulse
+        P.coherence_tol = UP.coherence_tol
+
+    P.field_table = False                   # E(t) and A(t) from tables on the half steps of
+    if hasattr(UP, 'field_table'):          # the time grid (any electric_field_function),
+        P.field_table = UP.field_table      # A is then not integrated in the ODE vector
+        if P.field_table and P.precision == 'quadruple':
+            sys.exit("field_table does not work in quadruple precision.")
 
     P.symmetric_insulator = False           # special flag for accurate insulator calc.
     if hasattr(UP, 'symmetric_insulator'):
@@ -67,9 +169,11 @@ def parse_params(user_params):
 
     P.dk_order = 8
     if hasattr(UP, 'dk_order'):             # Accuracy order of density-matrix k-deriv.
-        P.dk_order = UP.dk_order            # with length gauge (avail: 2,4,6,8)
-        if P.dk_order not in [2, 4, 6, 8]:
-            sys.exit("dk_order needs to be either 2, 4, 6, or 8.")
+        P.dk_order = UP.dk_order            # with length gauge (avail: 2,4,6,8,'spectral')
+        if P.dk_order not in [2, 4, 6, 8, 'spectral']:
+            sys.exit("dk_order needs to be either 2, 4, 6, 8, or 'spectral'.")
+        if P.dk_order == 'spectral' and P.solver_jacobian:
+            sys.exit("solver_jacobian needs a finite difference dk_order (2, 4, 6, or 8).")
 
     # Parameters for initial occupation
     P.e_fermi = UP.e_fermi*co.eV_to_au           # Fermi energy
@@ -78,42 +182,70 @@ def parse_params(user_params):
     P.temperature_eV =  UP.temperature
 
     # Driving field parameters
-    P.E0 = UP.E0*co.MVpcm_to_au                  # Driving pulse field amplitude
-    P.E0_MVpcm = UP.E0
     P.w = UP.w*co.THz_to_au                      # Driving pulse frequency
     P.w_THz = UP.w
-    P.chirp = UP.chirp*co.THz_to_au              # Pulse chirp frequency
-    P.chirp_THz = UP.chirp
     P.alpha = UP.alpha*co.fs_to_au               # Gaussian pulse width
     P.alpha_fs = UP.alpha
-    P.phase = UP.phase                           # Carrier-envelope phase
 
-    # Time scales
-    P.T1 = UP.T1*co.fs_to_au                     # Occupation damping time
-    P.gamma1 = 1/P.T1
-    P.T1_fs = UP.T1
-    P.gamma1_dfs = 1/P.T1_fs
+    # Parameter axis: E0 (MV/cm), chirp (THz), phase, T1 and T2 (fs) can be
+    # arrays. All combinations are integrated together in one ODE vector, the
+    # scalar attributes hold the first combination (set_parameter_combination)
+    axes = np.meshgrid(*[np.atleast_1d(np.asarray(getattr(UP, key), dtype=np.float64))
+                         for key in parameter_axis_keys], indexing='ij')
+    P.Nparam = axes[0].size
+    P.E0_MVpcm_axis, P.chirp_THz_axis, P.phase_axis, P.T1_fs_axis, P.T2_fs_axis = \
+        [axis.flatten() for axis in axes]
+    P.E0_axis = P.E0_MVpcm_axis*co.MVpcm_to_au
+    P.chirp_axis = P.chirp_THz_axis*co.THz_to_au
+    P.gamma1_axis = 1/(P.T1_fs_axis*co.fs_to_au)
+    P.gamma2_axis = 1/(P.T2_fs_axis*co.fs_to_au)
+    set_parameter_combination(P, 0)
+    if P.Nparam > 1:
+        if P.solver_method not in ['rk4', 'rk45'] or P.precision not in ['single', 'double']:
+            sys.exit("Array valued E0, chirp, phase, T1 or T2 only work with the rk4 or rk45 "
+                     "solver in single or double precision.")
+        if P.compact_state or P.velocity_shift_table or P.deferred_observables \
+                or P.fast_forward or P.save_full or P.field_table:
+            sys.exit("Array valued E0, chirp, phase, T1 or T2 can not be combined with "
+                     "compact_state, velocity_shift_table, deferred_observables, "
+                     "fast_forward, save_full, or field_table.")
 
-    P.T2 = UP.T2*co.fs_to_au                     # Polarization damping time
-    P.gamma2 = 1/P.T2
-    P.T2_fs = UP.T2
-    P.gamma2_dfs = 1/P.T2_fs
+    P.time_tol = 1e-8                            # t0 = 'auto': pulse envelope and
+    if hasattr(UP, 'time_tol'):                  # coherences below time_tol at t0, tf
+        P.time_tol = UP.time_tol
 
-    P.t0 = UP.t0*co.fs_to_au
     P.t0_fs = UP.t0
+    if isinstance(UP.t0, str):
+        if UP.t0 != 'auto':
+            sys.exit("t0 needs to be either a number (fs) or 'auto'.")
+        # The envelope exp(-t^2/(2 alpha)^2) of the pulse (and of the window
+        # of the Fourier transform) drops below time_tol, then the coherences
+        # decay by time_tol with T2
+        log_tol = np.log(1/P.time_tol)
+        P.t0_fs = -(2*UP.alpha*np.sqrt(log_tol) + np.amax(P.T2_fs_axis)*log_tol)
+    P.t0 = P.t0_fs*co.fs_to_au
 
     P.tf = -P.t0
     P.tf_fs = -P.t0_fs
 
-    P.dt = P.type_real_np(UP.dt*co.fs_to_au)
-    P.dt_fs = UP.dt
+    P.dt_auto = isinstance(UP.dt, str)           # dt = 'auto': from the highest frequency of
+    if P.dt_auto:                                # the field and the band gap (in sbe_solver)
+        if UP.dt != 'auto':
+            sys.exit("dt needs to be either a number (fs) or 'auto'.")
+        # Until the mesh is known: Nyquist step of the carrier including the
+        # chirp at the edges of the window
+        w_max = P.w*(1 + 2*np.amax(np.abs(P.chirp_axis))*P.tf)
+        set_time_step(P, 1/(2*w_max))
+    else:
+        P.dt = P.type_real_np(UP.dt*co.fs_to_au)
+        P.dt_fs = UP.dt
 
-    Nf = int((abs(2*P.t0_fs))/P.dt_fs)
-    if modf((2*P.t0_fs/P.dt_fs))[0] > 1e-12:
-        print("WARNING: The time window divided by dt is not an integer.")
-    # Define a proper time window if Nt exists
-    # +1 assures the inclusion of tf in the calculation
-    P.Nt = Nf + 1
+        Nf = int((abs(2*P.t0_fs))/P.dt_fs)
+        if modf((2*P.t0_fs/P.dt_fs))[0] > 1e-12:
+            print("WARNING: The time window divided by dt is not an integer.")
+        # Define a proper time window if Nt exists
+        # +1 assures the inclusion of tf in the calculation
+        P.Nt = Nf + 1
 
 
     # Brillouin zone type
@@ -137,13 +269,102 @@ def parse_params(user_params):
         P.angle_inc_E_field = UP.angle_inc_E_field
         P.length_BZ_ortho = UP.length_BZ_ortho
         P.length_BZ_E_dir = UP.length_BZ_E_dir
+    elif P.BZ_type == 'lattice':
+        P.align = None                          # E-field along b1
+        P.angle_inc_E_field = None
+        P.b1 = UP.b1                                # Reciprocal lattice vectors
+        P.b1_dangs = P.b1*co.as_to_au
+        P.b2 = UP.b2
+        P.b2_dangs = P.b2*co.as_to_au
+        if abs(np.cross(P.b1, P.b2)) < 1e-12*(P.b1 @ P.b1 + P.b2 @ P.b2):
+            sys.exit("b1 and b2 need to be linearly independent.")
     else:
-        sys.exit("BZ_type needs to be either hexagon or rectangle.")
+        sys.exit("BZ_type needs to be either hexagon, rectangle or lattice.")
 
     P.Nk2_idx_ext = -1
     if hasattr(UP, 'Nk2_idx_ext'):        # For parallelization: only do calculation
         P.Nk2_idx_ext = UP.Nk2_idx_ext    # for path Nk2_idx_ext (in total Nk2 paths)
 
+    P.Nk2_batch = 1
+    if hasattr(UP, 'Nk2_batch'):          # Number of paths integrated together in one
+        P.Nk2_batch = UP.Nk2_batch        # ODE vector ('auto': fit into batch_cache_bytes)
+    if P.Nk2_batch == 'auto':
+        # Per k-point: ODE vector, solver stages and work arrays (~16 vectors)
+        # and the matrix elements of the observables (~24 complex numbers)
+        bytes_per_k = (16*4 + 24)*np.dtype(P.type_complex_np).itemsize
+        P.Nk2_batch = max(1, batch_cache_bytes//(bytes_per_k*P.Nk1))
+    P.Nk2_batch = min(P.Nk2_batch, P.Nk2)
+
+    P.checkpoint = False
+    if hasattr(UP, 'checkpoint'):         # Write the accumulated currents and the state
+        P.checkpoint = UP.checkpoint      # of the current batch to checkpoint_*.npz
+
+    P.checkpoint_interval = 600           # Wall time between two checkpoints in s
+    if hasattr(UP, 'checkpoint_interval'):
+        P.checkpoint_interval = UP.checkpoint_interval
+
+    P.resume = False
+    if hasattr(UP, 'resume'):             # Continue from the last checkpoint if the
+        P.resume = UP.resume              # file of this calculation exists
+
+    P.workers = 1
+    if hasattr(UP, 'workers'):            # Number of processes the batches of paths are
+        P.workers = UP.workers            # distributed over ('auto': all available cores)
+    if P.workers == 'auto':
+        P.workers = len(os.sched_getaffinity(0))
+    if P.workers > 1 and (P.checkpoint or P.resume):
+        sys.exit("workers > 1 can not be combined with checkpoint or resume.")
+
+    P.parallel = False                    # Loops over k of the right hand side, the rk4
+    if hasattr(UP, 'parallel'):           # stages and the observables on numba threads
+        P.parallel = UP.parallel
+    if P.parallel and P.workers > 1:
+        # The workers are forked after the first batch has started the thread pool
+        sys.exit("parallel can not be combined with workers > 1 (use threads or mpi).")
+
+    P.threads = numba.config.NUMBA_NUM_THREADS
+    if hasattr(UP, 'threads'):            # Number of threads (default: cores)
+        P.threads = UP.threads
+    if P.parallel and not 1 <= P.threads <= numba.config.NUMBA_NUM_THREADS:
+        sys.exit("threads needs to be between 1 and NUMBA_NUM_THREADS = {:d}."
+                 .format(numba.config.NUMBA_NUM_THREADS))
+
+    P.mpi = False                         # Distribute the batches of paths over the MPI
+    if hasattr(UP, 'mpi'):                # ranks (mpirun -n N python runscript.py),
+        P.mpi = UP.mpi                    # rank 0 writes the output
+    if P.mpi and (P.checkpoint or P.resume or P.workers > 1):
+        sys.exit("mpi can not be combined with checkpoint, resume or workers > 1 "
+                 "(use one rank per core).")
+
+    P.symmetry = None                     # Integrate one path of every pair of mirror images
+    if hasattr(UP, 'symmetry'):           # at the E_dir axis ('mirror': Hamiltonian declared
+        P.symmetry = UP.symmetry          # mirror symmetric, 'auto': checked on the mesh)
+    if P.symmetry not in (None, 'mirror', 'auto'):
+        sys.exit("symmetry needs to be either None, 'mirror' or 'auto'.")
+    if P.symmetry is not None and (P.checkpoint or P.resume or P.save_full
+                                   or P.Nk2_idx_ext >= 0):
+        sys.exit("symmetry can not be combined with checkpoint, resume, save_full "
+                 "or Nk2_idx_ext.")
+
+    # Progressive Nk2: integrate the paths in levels (see progressive_levels)
+    # until the intensities of the harmonic orders in convergence_window
+    # change by less than convergence_tol
+    P.convergence_tol = None
+    if hasattr(UP, 'convergence_tol'):
+        P.convergence_tol = UP.convergence_tol
+    P.convergence_window = (1, 10)
+    if hasattr(UP, 'convergence_window'):
+        P.convergence_window = UP.convergence_window
+    if P.convergence_tol is not None:
+        if P.workers > 1 or P.mpi or P.checkpoint or P.resume or P.symmetry is not None \
+                or P.save_full or P.Nk2_idx_ext >= 0 or P.Nparam > 1:
+            sys.exit("convergence_tol can not be combined with workers > 1, mpi, checkpoint, "
+                     "resume, symmetry, save_full, Nk2_idx_ext or a parameter axis.")
+        if P.Nk2 & (P.Nk2 - 1) == 0:
+            sys.exit("convergence_tol needs Nk2 with an odd prime factor (e.g. 3*2^n).")
+        if np.ceil(max(P.convergence_window[0], 1)) > P.convergence_window[1]:
+            sys.exit("convergence_window needs to contain a harmonic order >= 1.")
+
     # params for n-band solver
 
     P.dipole_numerics = False
@@ -154,3 +375,36 @@ def parse_params(user_params):
         P.gidx = UP.gidx
 
     return P
+
+
+def set_time_step(P, dt):
+    """
+        Sets the time step to the largest step <= dt (in a.u.) that divides
+        the time window [t0, tf] into an integer number of steps
+    """
+    P.Nt = int(np.ceil((P.tf - P.t0)/dt)) + 1
+    P.dt = P.type_real_np((P.tf - P.t0)/(P.Nt - 1))
+    P.dt_fs = float(P.dt)*co.au_to_fs
+
+
+def set_parameter_combination(P, q):
+    """
+        Sets the scalar field and damping parameters (E0, chirp, phase, T1,
+        T2 in a.u. and in the units of the params file) of P to the parameter
+        combination q of the parameter axis
+    """
+    P.E0 = P.E0_axis[q]                          # Driving pulse field amplitude
+    P.E0_MVpcm = P.E0_MVpcm_axis[q]
+    P.chirp = P.chirp_axis[q]                    # Pulse chirp frequency
+    P.chirp_THz = P.chirp_THz_axis[q]
+    P.phase = P.phase_axis[q]                    # Carrier-envelope phase
+
+    P.T1_fs = P.T1_fs_axis[q]                    # Occupation damping time
+    P.T1 = P.T1_fs*co.fs_to_au
+    P.gamma1 = 1/P.T1
+    P.gamma1_dfs = 1/P.T1_fs
+
+    P.T2_fs = P.T2_fs_axis[q]                    # Polarization damping time
+    P.T2 = P.T2_fs*co.fs_to_au
+    P.gamma2 = 1/P.T2
+    P.gamma2_dfs = 1/P.T2_fs
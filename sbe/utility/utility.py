@@ -17,16 +17,30 @@ def mkdir_chdir(dirname):
 
 class conditional_njit():
     """
-    njit execution only with double precision
+    njit execution only with double precision, parallel compiles the
+    prange loops (and array expressions) for numba's thread pool
     """
-    def __init__(self, precision):
+    def __init__(self, precision, parallel=False):
         self.precision = precision
+        self.parallel = parallel
 
     def __call__(self, func):
         if self.precision in (np.float128, np.complex256):
             return func
+        if self.parallel:
+            return njit(func, parallel=True)
         return njit(func)
 
+@njit
+def two_sum(a, b):
+    """
+    Error free sum a + b = s + e (Knuth), componentwise for complex a, b
+    """
+    s = a + b
+    bb = s - a
+    e = (a - (s - bb)) + (b - bb)
+    return s, e
+
 def matrix_to_njit_functions(sf, hsymbols, kpflag=False):
     """
     Converts a sympy matrix into a matrix of functions
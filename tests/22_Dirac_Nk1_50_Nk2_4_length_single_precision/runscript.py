@@ -0,0 +1,48 @@
+import os
+import glob
+import shutil
+import numpy as np
+from params import params
+
+import sbe.dipole
+import sbe.hamiltonian
+from sbe.solver import sbe_solver
+
+# Accuracy envelope of single precision (see precision in params_parser.py):
+# maximum deviation of the current in E-direction from the double precision
+# run with the same solver, relative to its maximum (rk4: 2.1e-4)
+single_precision_tol = 5e-4
+
+def dirac():
+    A = 0.1974      # Fermi velocity
+
+    dirac_system = sbe.hamiltonian.BiTe(C0=0, C2=0, A=A, R=0, mz=0)
+    h_sym, ef_sym, wf_sym, _ediff_sym = dirac_system.eigensystem(gidx=1)
+    dirac_dipole = sbe.dipole.SymbolicDipole(h_sym, ef_sym, wf_sym)
+    dirac_curvature = sbe.dipole.SymbolicCurvature(h_sym, dirac_dipole.Ax, dirac_dipole.Ay)
+
+    return dirac_system, dirac_dipole, dirac_curvature
+
+def run(system, dipole, curvat):
+
+    sbe_solver(system, dipole, params, curvat)
+
+    # Double precision run of the same solver
+    os.makedirs('double', exist_ok=True)
+    os.chdir('double')
+    params_double = type('params', (params,), {'precision': 'double'})
+    sbe_solver(system, dipole, params_double, curvat)
+    os.chdir('..')
+    for kind in ['Iexact', 'Iapprox']:
+        single = np.load(glob.glob(kind + '_*.npy')[0])
+        double = np.load(glob.glob('double/' + kind + '_*.npy')[0])
+        deviation = np.amax(np.abs(single[1] - double[1]))/np.amax(np.abs(double[1]))
+        print(kind + " of single precision, deviation from double: ", deviation)
+        assert deviation < single_precision_tol, \
+            kind + " of single precision is outside of its accuracy envelope."
+    shutil.rmtree('double')
+
+    return 0
+
+if __name__ == "__main__":
+    run(*dirac())
@@ -0,0 +1,79 @@
+import os
+import glob
+import shutil
+import numpy as np
+from params import params
+
+import sbe.dipole
+import sbe.hamiltonian
+import sbe.solver
+from sbe.solver import sbe_solver
+
+def dirac():
+    A = 0.1974      # Fermi velocity
+
+    dirac_system = sbe.hamiltonian.BiTe(C0=0, C2=0, A=A, R=0, mz=0)
+    h_sym, ef_sym, wf_sym, _ediff_sym = dirac_system.eigensystem(gidx=1)
+    dirac_dipole = sbe.dipole.SymbolicDipole(h_sym, ef_sym, wf_sym)
+    dirac_curvature = sbe.dipole.SymbolicCurvature(h_sym, dirac_dipole.Ax, dirac_dipole.Ay)
+
+    return dirac_system, dirac_dipole, dirac_curvature
+
+class Interrupt(Exception):
+    pass
+
+def interrupt_at_checkpoint(n):
+    """
+    write_checkpoint that stops the run instead of writing checkpoint n, the
+    checkpoint n-1 is left for the resumed run
+    """
+    write_checkpoint = sbe.solver.write_checkpoint
+    count = [0]
+    def write_or_interrupt(*args, **kwargs):
+        count[0] += 1
+        if count[0] == n:
+            raise Interrupt()
+        write_checkpoint(*args, **kwargs)
+    return write_or_interrupt
+
+def run(system, dipole, curvat):
+
+    for checkpoint in glob.glob('checkpoint_*'):
+        os.remove(checkpoint)
+
+    # Every batch (one path each) writes ~21 checkpoints, stop in the second batch
+    write_checkpoint = sbe.solver.write_checkpoint
+    sbe.solver.write_checkpoint = interrupt_at_checkpoint(30)
+    try:
+        sbe_solver(system, dipole, params, curvat)
+        raise RuntimeError("The run was not interrupted.")
+    except Interrupt:
+        pass
+    finally:
+        sbe.solver.write_checkpoint = write_checkpoint
+    checkpoints = glob.glob('checkpoint_*.npz')
+    assert checkpoints, "No checkpoint after the interruption."
+    with np.load(checkpoints[0]) as data:
+        assert data['batch_idx'] == 1 and data['ti'] > 0, "Not interrupted in the second batch."
+
+    # Resumed run, its currents are compared to the reference
+    sbe_solver(system, dipole, params, curvat)
+    assert not glob.glob('checkpoint_*'), "The checkpoint was not removed."
+
+    # The resumed run reproduces the uninterrupted run
+    os.makedirs('uninterrupted', exist_ok=True)
+    os.chdir('uninterrupted')
+    params_uninterrupted = type('params', (params,), {'checkpoint': False, 'resume': False})
+    sbe_solver(system, dipole, params_uninterrupted, curvat)
+    os.chdir('..')
+    for kind in ['Iexact', 'Iapprox']:
+        resumed = np.load(glob.glob(kind + '_*.npy')[0])
+        uninterrupted = np.load(glob.glob('uninterrupted/' + kind + '_*.npy')[0])
+        assert np.array_equal(resumed, uninterrupted), \
+            kind + " of the resumed run differs from the uninterrupted run."
+    shutil.rmtree('uninterrupted')
+
+    return 0
+
+if __name__ == "__main__":
+    run(*dirac())
@@ -0,0 +1,35 @@
+import os
+import glob
+import shutil
+import numpy as np
+from params import params
+
+import sbe.dipole
+import sbe.hamiltonian
+from sbe.parameter_loops.parallel import parameter_sweep
+
+def dirac():
+    A = 0.1974      # Fermi velocity
+
+    dirac_system = sbe.hamiltonian.BiTe(C0=0, C2=0, A=A, R=0, mz=0)
+    h_sym, ef_sym, wf_sym, _ediff_sym = dirac_system.eigensystem(gidx=1)
+    dirac_dipole = sbe.dipole.SymbolicDipole(h_sym, ef_sym, wf_sym)
+    dirac_curvature = sbe.dipole.SymbolicCurvature(h_sym, dirac_dipole.Ax, dirac_dipole.Ay)
+
+    return dirac_system, dirac_dipole, dirac_curvature
+
+def run(system, dipole, curvat):
+
+    failed = parameter_sweep({'phase': [0, np.pi/2]}, system, dipole, curvat, params, workers=2)
+    assert not failed, "Points of the parameter sweep failed: " + str(failed)
+
+    # The currents of the point phase = pi/2 are compared to the reference
+    for filename in glob.glob('phase_1.57/I*_E_*.npy'):
+        shutil.copy(filename, os.path.basename(filename))
+    for dirname in glob.glob('phase_*'):
+        shutil.rmtree(dirname)
+
+    return 0
+
+if __name__ == "__main__":
+    run(*dirac())